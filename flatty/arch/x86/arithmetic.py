@@ -0,0 +1,330 @@
+import re
+from typing import List
+from arch.x86.emulator import CYCLES, EA_CYCLES
+from arch.x86.modes.realmode import REGISTERS_16
+
+WORD_BITS = 16
+WORD_MASK = 0xFFFF
+
+# Регистры для промежуточных значений. Их значения сохраняются в стеке
+SCRATCH_REGISTERS = ("bx", "cx", "si", "di")
+
+MEMORY_EA = EA_CYCLES[6][1] # Параметры и переменные в стеке: [bp + N] и [bp - N]
+
+SHIFT_ADD = "shift-add"
+SHIFT_ADD_SUB = "shift-add-sub"
+MUL = "mul"
+SHIFT = "shift"
+MAGIC = "magic multiply"
+MAGIC_ADD = "magic multiply with fixup"
+DIV = "div"
+MOVE = "move"
+
+def operand_kind(operand: str) -> str:
+	"""r - регистр, m - память, i - число"""
+	if operand.startswith("[") or operand.startswith("word ["):
+		return "m"
+
+	if operand in REGISTERS_16:
+		return "r"
+
+	return "i"
+
+def operand_registers(operand: str) -> set:
+	return {name for name in re.findall(r"[a-z]+", operand) if name in REGISTERS_16}
+
+def instruction_cycles(opcode: str, operands: List[str]) -> int:
+	"""Такты инструкции по таблице эмулятора"""
+	kinds = [operand_kind(operand) for operand in operands]
+	cycles = MEMORY_EA if "m" in kinds else 0
+
+	if opcode == "mov":
+		return cycles + CYCLES[f"mov {kinds[0]}, {kinds[1]}"]
+
+	if opcode in ("add", "sub", "xor"):
+		return cycles + CYCLES[f"alu {kinds[0]}, {kinds[1]}"]
+
+	if opcode in ("shl", "shr"):
+		return cycles + CYCLES[f"shift {kinds[0]}, 1"]
+
+	if opcode in ("push", "pop"):
+		return cycles + CYCLES[f"{opcode} {kinds[0]}"]
+
+	return cycles + CYCLES[f"{opcode} {kinds[0]}16"]
+
+class Sequence:
+	"""Вариант вычисления: инструкции и их такты"""
+	__slots__ = ("strategy", "instructions", "cycles")
+
+	def __init__(self, strategy: str, instructions: List[tuple]):
+		self.strategy = strategy
+		self.instructions = instructions # (опкод, операнды...)
+		self.cycles = sum(instruction_cycles(opcode, operands) for opcode, *operands in instructions)
+
+	def __repr__(self):
+		return f"{self.strategy}: {len(self.instructions)} instructions, {self.cycles} cycles"
+
+class SequenceBuilder:
+	"""Сборка варианта: регистры, которые портит вариант (кроме результата), сохраняются в стеке"""
+	def __init__(self, target: str, *sources: str):
+		self.target = target
+		self.instructions = []
+		self.saved = []
+		self.busy = operand_registers(target).union(*map(operand_registers, sources))
+
+	def emit(self, opcode: str, *operands: str):
+		# Размер памяти нужно указать, если в инструкции нет регистра
+		if not any(operand_kind(operand) == "r" for operand in operands):
+			operands = [f"word {operand}" if operand_kind(operand) == "m" else operand for operand in operands]
+
+		self.instructions.append((opcode, *operands))
+
+	def save(self, register: str):
+		if register != self.target and register not in self.saved:
+			self.emit("push", register)
+			self.saved.append(register)
+
+		self.busy.add(register)
+
+	def scratch(self) -> str:
+		"""Свободный регистр для промежуточного значения"""
+		register = next(register for register in SCRATCH_REGISTERS if register not in self.busy)
+		self.save(register)
+
+		return register
+
+	def work(self) -> str:
+		"""Регистр, в котором вычисляется результат: сам результат или временный регистр"""
+		return self.target if operand_kind(self.target) == "r" else self.scratch()
+
+	def store(self, register: str):
+		if register != self.target:
+			self.emit("mov", self.target, register)
+
+	def finish(self, strategy: str) -> Sequence:
+		for register in reversed(self.saved):
+			self.emit("pop", register)
+
+		return Sequence(strategy, self.instructions)
+
+def move(target: str, source: str) -> Sequence:
+	builder = SequenceBuilder(target, source)
+
+	if target == source:
+		pass
+	elif operand_kind(target) == "m" and operand_kind(source) == "m":
+		register = builder.scratch()
+		builder.emit("mov", register, source)
+		builder.emit("mov", target, register)
+	else:
+		builder.emit("mov", target, source)
+
+	return builder.finish(MOVE)
+
+def binary_digits(factor: int) -> List[int]:
+	"""Двоичные цифры от старшей"""
+	return [int(digit) for digit in bin(factor)[2:]]
+
+def signed_digits(factor: int) -> List[int]:
+	"""Несмежная форма (цифры 1, 0, -1) от старшей: меньше всего ненулевых цифр"""
+	digits = []
+
+	while factor:
+		digit = 2 - (factor & 3) if factor & 1 else 0
+		factor = (factor - digit) >> 1
+		digits.append(digit)
+
+	return digits[::-1]
+
+def shift_add(target: str, source: str, digits: List[int], strategy: str, copy: bool) -> Sequence:
+	"""Умножение по схеме Горнера: сдвиг на 1 и сложение (вычитание) множимого для каждой цифры.
+	copy - держать множимое из памяти в регистре"""
+	builder = SequenceBuilder(target, source)
+	work = builder.work()
+	operand = source
+
+	if any(digits[1:]) and (work == source or copy and operand_kind(source) == "m"):
+		operand = builder.scratch()
+		builder.emit("mov", operand, source)
+
+	if work != source:
+		builder.emit("mov", work, operand)
+
+	for digit in digits[1:]:
+		builder.emit("shl", work, "1")
+
+		if digit:
+			builder.emit("add" if digit > 0 else "sub", work, operand)
+
+	builder.store(work)
+
+	return builder.finish(strategy)
+
+def mul_instruction(target: str, left: str, right: str) -> Sequence:
+	"""Умножение инструкцией mul: результат в ax, dx портится"""
+	builder = SequenceBuilder(target, left, right)
+
+	if right == "ax":
+		left, right = right, left
+
+	builder.save("ax")
+	builder.save("dx")
+
+	if left != "ax":
+		builder.emit("mov", "ax", left)
+
+	if operand_kind(right) == "i":
+		builder.emit("mov", "dx", right)
+		right = "dx"
+
+	builder.emit("mul", right)
+	builder.store("ax")
+
+	return builder.finish(MUL)
+
+def div_instruction(target: str, dividend: str, divisor: str) -> Sequence:
+	"""Деление инструкцией div: делимое dx:ax, частное в ax"""
+	builder = SequenceBuilder(target, dividend, divisor)
+	builder.save("ax")
+	builder.save("dx")
+
+	if divisor in ("ax", "dx") or operand_kind(divisor) == "i":
+		register = builder.scratch()
+		builder.emit("mov", register, divisor)
+		divisor = register
+
+	if dividend != "ax":
+		builder.emit("mov", "ax", dividend)
+
+	builder.emit("xor", "dx", "dx")
+	builder.emit("div", divisor)
+	builder.store("ax")
+
+	return builder.finish(DIV)
+
+def shift_right(target: str, source: str, shift: int) -> Sequence:
+	builder = SequenceBuilder(target, source)
+	work = builder.work()
+
+	if work != source:
+		builder.emit("mov", work, source)
+
+	for _ in range(shift):
+		builder.emit("shr", work, "1")
+
+	builder.store(work)
+
+	return builder.finish(SHIFT)
+
+def magic_multiplier(divisor: int):
+	"""Множитель m < 2^16 и сдвиг s, при которых x / divisor = (x * m) >> (16 + s) для любого
+	16 битного x (Granlund, Montgomery). None если такого множителя нет"""
+	for shift in range(WORD_BITS + 1):
+		multiplier = -(-(1 << WORD_BITS + shift) // divisor)
+
+		if multiplier > WORD_MASK:
+			return None
+
+		if multiplier * divisor - (1 << WORD_BITS + shift) <= 1 << shift:
+			return multiplier, shift
+
+	return None
+
+def magic_divide(target: str, source: str, multiplier: int, shift: int) -> Sequence:
+	"""Деление умножением на обратное: старшее слово произведения в dx"""
+	builder = SequenceBuilder(target, source)
+	builder.save("ax")
+	builder.save("dx")
+
+	if source != "ax":
+		builder.emit("mov", "ax", source)
+
+	builder.emit("mov", "dx", str(multiplier))
+	builder.emit("mul", "dx")
+
+	for _ in range(shift):
+		builder.emit("shr", "dx", "1")
+
+	builder.store("dx")
+
+	return builder.finish(MAGIC)
+
+def magic_add_divide(target: str, source: str, divisor: int) -> Sequence:
+	"""Деление умножением на обратное, когда множитель не помещается в 16 бит:
+	t = (x * m) >> 16, q = (t + ((x - t) >> 1)) >> (l - 1). Делимое читается дважды"""
+	bits = (divisor - 1).bit_length()
+	multiplier = ((1 << WORD_BITS) * ((1 << bits) - divisor)) // divisor + 1
+	builder = SequenceBuilder(target, source)
+	builder.save("ax")
+	builder.save("dx")
+
+	builder.emit("mov", "ax", source)
+	builder.emit("mov", "dx", str(multiplier))
+	builder.emit("mul", "dx")
+	builder.emit("mov", "ax", source)
+	builder.emit("sub", "ax", "dx")
+	builder.emit("shr", "ax", "1")
+	builder.emit("add", "ax", "dx")
+
+	for _ in range(bits - 1):
+		builder.emit("shr", "ax", "1")
+
+	builder.store("ax")
+
+	return builder.finish(MAGIC_ADD)
+
+def cheapest(candidates: List[Sequence]) -> Sequence:
+	return min(candidates, key=lambda sequence: (sequence.cycles, len(sequence.instructions)))
+
+def multiply(target: str, source: str, factor: int) -> Sequence:
+	"""Самая быстрая последовательность для target = source * factor"""
+	factor &= WORD_MASK
+
+	if factor == 0:
+		builder = SequenceBuilder(target)
+
+		if operand_kind(target) == "r":
+			builder.emit("xor", target, target)
+		else:
+			builder.emit("mov", target, "0")
+
+		return builder.finish(MOVE)
+
+	if factor == 1:
+		return move(target, source)
+
+	candidates = [mul_instruction(target, source, str(factor))]
+	binary, signed = binary_digits(factor), signed_digits(factor)
+
+	for copy in (False, True):
+		candidates.append(shift_add(target, source, binary, SHIFT_ADD, copy))
+
+		if signed != binary:
+			candidates.append(shift_add(target, source, signed, SHIFT_ADD_SUB, copy))
+
+	return cheapest(candidates)
+
+def divide(target: str, source: str, divisor: int) -> Sequence:
+	"""Самая быстрая последовательность для беззнакового target = source / divisor"""
+	divisor &= WORD_MASK
+
+	if divisor == 0:
+		raise ZeroDivisionError("division by zero")
+
+	if divisor == 1:
+		return move(target, source)
+
+	if divisor & (divisor - 1) == 0:
+		return shift_right(target, source, divisor.bit_length() - 1)
+
+	candidates = [div_instruction(target, source, str(divisor))]
+	magic = magic_multiplier(divisor)
+
+	if magic is not None:
+		candidates.append(magic_divide(target, source, *magic))
+
+	# Делимое читается после mul, которая портит ax и dx
+	if source not in ("ax", "dx") and operand_kind(source) != "i":
+		candidates.append(magic_add_divide(target, source, divisor))
+
+	return cheapest(candidates)
@@ -0,0 +1,89 @@
+from typing import Iterator, List, TextIO
+
+class AsmInstruction:
+	"""Инструкция ассемблера в выходном коде"""
+	__slots__ = ("opcode", "operands")
+
+	def __init__(self, opcode: str, operands: List[str] = None):
+		self.opcode = opcode
+		self.operands = operands or []
+
+	def __repr__(self):
+		if self.operands:
+			return f"{self.opcode} {', '.join(self.operands)}"
+
+		return self.opcode
+
+class AsmLabel:
+	"""Метка"""
+	__slots__ = ("name",)
+
+	def __init__(self, name: str):
+		self.name = name
+
+	def __repr__(self):
+		return f"{self.name}:"
+
+class AsmDirective:
+	"""Директива ассемблера (bits 16 и т.д.)"""
+	__slots__ = ("text",)
+
+	def __init__(self, text: str):
+		self.text = text
+
+	def __repr__(self):
+		return self.text
+
+class Section:
+	"""Секция выходного кода. Для каждой функции создаётся своя секция"""
+	__slots__ = ("name", "items")
+
+	def __init__(self, name: str):
+		self.name = name
+		self.items = []
+
+	def __repr__(self):
+		return f"Section {self.name} ({len(self.items)} items)"
+
+class AsmBuffer:
+	"""Буфер сгенерированного кода: заголовок и секции функций"""
+	def __init__(self):
+		self.header = Section("header")
+		self.sections = []
+		self.current = self.header
+
+	def section(self, name: str) -> Section:
+		"""Начать новую секцию"""
+		self.current = Section(name)
+		self.sections.append(self.current)
+
+		return self.current
+
+	def emit(self, opcode: str, *operands: str):
+		"""Добавить инструкцию в текущую секцию"""
+		self.current.items.append(AsmInstruction(opcode, list(operands)))
+
+	def label(self, name: str):
+		"""Добавить метку в текущую секцию"""
+		self.current.items.append(AsmLabel(name))
+
+	def directive(self, text: str):
+		"""Добавить директиву в текущую секцию"""
+		self.current.items.append(AsmDirective(text))
+
+	def lines(self) -> Iterator[str]:
+		"""Построчный вывод кода"""
+		for section in [self.header] + self.sections:
+			for item in section.items:
+				yield repr(item)
+
+			yield ""
+
+	def write(self, file: TextIO):
+		"""Записать код в файл без сборки всего текста в памяти"""
+		for line in self.lines():
+			file.write(line)
+			file.write("\n")
+
+	def __repr__(self):
+		return "\n".join(self.lines())
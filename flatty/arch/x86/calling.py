@@ -0,0 +1,124 @@
+from typing import List, Optional, Set
+from ast import *
+from arch.x86.modes.realmode import REGISTER_FAMILIES, REGISTERS_8, IMPLICIT_WRITES
+from passes.walk import iter_statements, statement_expressions, iter_expression, iter_calls
+from passes.callgraph import CallGraph
+
+# Регистры для передачи аргументов в порядке предпочтения
+ARGUMENT_REGISTERS = ("di", "si", "dx", "bx", "cx")
+
+class FrameLayout:
+	"""Размещение параметров функции: в регистрах или в стеке"""
+	__slots__ = ("registers", "stack_index")
+
+	def __init__(self, registers: List[Optional[str]], stack_index: List[Optional[int]]):
+		self.registers = registers # Регистр для каждого параметра или None
+		self.stack_index = stack_index # Номер слота в стеке для каждого параметра или None
+
+	@property
+	def has_frame(self) -> bool:
+		"""Нужен ли функции кадр стека (push bp / mov bp, sp)"""
+		return any(index is not None for index in self.stack_index)
+
+	def location(self, index: int) -> str:
+		"""Операнд для обращения к параметру внутри функции"""
+		if index < len(self.registers) and self.registers[index]:
+			return self.registers[index]
+
+		# [bp] - сохранённый bp, [bp + 2] - адрес возврата, [bp + 4] - первый параметр в стеке
+		return f"[bp + {self.stack_index[index] * 2 + 4}]"
+
+	def argument_register(self, index: int) -> Optional[str]:
+		"""Регистр, в котором передаётся аргумент, или None если он передаётся через стек"""
+		return self.registers[index] if index < len(self.registers) else None
+
+def stack_layout(count: int) -> FrameLayout:
+	"""Все параметры в стеке"""
+	return FrameLayout([None] * count, list(range(count)))
+
+class StackCallingConvention:
+	"""Передача всех аргументов через стек"""
+	def __init__(self, program: Program):
+		self.layouts = {func.name: stack_layout(len(func.params)) for func in program.functions}
+
+	def layout(self, func_name: str, count: int = 0) -> FrameLayout:
+		"""Размещение параметров функции"""
+		return self.layouts.get(func_name) or stack_layout(count)
+
+class RegisterCallingConvention(StackCallingConvention):
+	"""Передача первых аргументов в свободных регистрах.
+
+	Регистры выбираются для каждой функции так, чтобы их не использовала ни она сама,
+	ни функции, которые она вызывает, ни функции, которые вызывают её, поэтому вызывающим
+	функциям не нужно их сохранять. Для рекурсии это неверно: рекурсивный вызов загружает свой
+	аргумент в тот же регистр и портит значение параметра вызывающей копии. Поэтому функции
+	на цикле рекурсии получают аргументы через стек"""
+	def __init__(self, program: Program):
+		super().__init__(program)
+
+		graph = CallGraph(program)
+		used = {func.name: self.mentioned_registers(func) for func in program.functions}
+		recursive = {name for cycle in graph.cycles() for name in cycle}
+
+		for func in program.functions:
+			if func.name in recursive or not self.is_eligible(func, program):
+				continue
+
+			related = graph.closure(func.name) | graph.closure(func.name, graph.callers)
+			busy = set().union(*(used[name] for name in related))
+			free = [register for register in ARGUMENT_REGISTERS if register not in busy]
+
+			registers = [free[i] if i < len(free) else None for i in range(len(func.params))]
+			stack_index = []
+			slot = 0
+
+			for register in registers:
+				stack_index.append(None if register else slot)
+				slot += register is None
+
+			self.layouts[func.name] = FrameLayout(registers, stack_index)
+
+			# Регистры параметров теперь заняты для всех связанных функций
+			used[func.name] |= {register for register in registers if register}
+
+	@staticmethod
+	def mentioned_registers(func: Func) -> Set[str]:
+		"""16 битные регистры, которые упоминает функция"""
+		registers = {"ax"} # Результат функции
+
+		for statement in iter_statements(func.body):
+			if isinstance(statement, Instruction):
+				registers.update(IMPLICIT_WRITES.get(statement.opcode, ()))
+
+			for expr in statement_expressions(statement):
+				for node in iter_expression(expr):
+					if isinstance(node, Register):
+						registers.add(REGISTER_FAMILIES[node.name])
+
+		return registers
+
+	@staticmethod
+	def is_eligible(func: Func, program: Program) -> bool:
+		"""Можно ли передавать параметры функции в регистрах"""
+		if func.name == "main" or not func.params:
+			return False
+
+		# Параметр в стеке можно читать как байт, а 16 битный регистр нет
+		for statement in iter_statements(func.body):
+			if not isinstance(statement, Instruction):
+				continue
+
+			operands = statement.operands
+
+			if (any(isinstance(operand, Parameter) for operand in operands)
+				and any(isinstance(operand, Register) and operand.name in REGISTERS_8 for operand in operands)
+			):
+				return False
+
+		# Все вызовы должны передавать правильное количество аргументов
+		for other in program.functions:
+			for call in iter_calls(other.body):
+				if call.func_name == func.name and len(call.args) != len(func.params):
+					return False
+
+		return True
@@ -0,0 +1,635 @@
+from bisect import bisect_right
+from typing import Dict
+from arch.x86.assembly import AsmBuffer
+from arch.x86.encoder import Encoder
+
+MEMORY_SIZE = 0x10000 # Один сегмент: cs = ds = ss
+STACK_TOP = 0xFFFE
+INSTRUCTION_LIMIT = 10_000_000 # Защита от бесконечных циклов
+
+REGISTER_NAMES = ("ax", "cx", "dx", "bx", "sp", "bp", "si", "di")
+
+# Оценка тактов 8086 (Intel 8086 Family User's Manual). К формам с памятью добавляется время
+# вычисления адреса (EA), к условным переходам - время перехода, если он выполнен
+CYCLES = {
+	"mov r, r": 2, "mov r, m": 8, "mov m, r": 9, "mov r, i": 4, "mov m, i": 10,
+	"alu r, r": 3, "alu r, m": 9, "alu m, r": 16, "alu r, i": 4, "alu m, i": 17,
+	"cmp m, r": 9, "cmp m, i": 10,
+	"inc r16": 2, "inc r8": 3, "inc m": 15,
+	"push r": 11, "push m": 16, "push i": 10, "pop r": 8, "pop m": 17,
+	"xchg ax, r": 3, "xchg r, r": 4, "xchg m, r": 17,
+	"mul r8": 70, "mul r16": 118, "mul m8": 76, "mul m16": 124,
+	"div r8": 80, "div r16": 144, "div m8": 86, "div m16": 150,
+	"not r": 3, "not m": 16,
+	"shift r, 1": 2, "shift m, 1": 15, "shift r, cl": 8, "shift m, cl": 20, "shift bit": 4,
+	"call": 19, "call r": 16, "call m": 21, "ret": 8, "ret i": 12,
+	"jmp": 15, "jmp r": 11, "jmp m": 18,
+	"jcc": 4, "jcc taken": 16, "loop": 5, "loop taken": 17, "jcxz": 6, "jcxz taken": 18,
+	"int": 51, "prefix": 2, "simple": 2, "cbw": 2, "cwd": 5,
+}
+
+# Время вычисления адреса по полю r/m без смещения и со смещением
+EA_CYCLES = {
+	0: (7, 11), 1: (8, 12), 2: (8, 12), 3: (7, 11), # bx + si, bx + di, bp + si, bp + di
+	4: (5, 9), 5: (5, 9), 6: (5, 9), 7: (5, 9) # si, di, bp, bx
+}
+
+# Регистры адреса для поля r/m
+EA_REGISTERS = {0: (3, 6), 1: (3, 7), 2: (5, 6), 3: (5, 7), 4: (6,), 5: (7,), 6: (5,), 7: (3,)}
+
+class EmulatorError(Exception):
+	def __init__(self, message, address: int = None):
+		if address is None:
+			super().__init__(message)
+		else:
+			super().__init__(f"{message} at {address:04X}h")
+
+class FunctionStats:
+	"""Количество выполненных инструкций и тактов в функции"""
+	__slots__ = ("instructions", "cycles")
+
+	def __init__(self):
+		self.instructions = 0
+		self.cycles = 0
+
+class ExecutionReport:
+	"""Результат выполнения программы"""
+	def __init__(self, output: str, registers: Dict[str, int], functions: Dict[str, FunctionStats]):
+		self.output = output # Вывод через int 10h
+		self.registers = registers # Регистры в момент hlt
+		self.functions = functions
+
+	@property
+	def instructions(self) -> int:
+		return sum(stats.instructions for stats in self.functions.values())
+
+	@property
+	def cycles(self) -> int:
+		return sum(stats.cycles for stats in self.functions.values())
+
+	def __repr__(self):
+		lines = [f"{'function':<16}{'instructions':>14}{'cycles':>12}"]
+
+		for name, stats in self.functions.items():
+			lines.append(f"{name:<16}{stats.instructions:>14}{stats.cycles:>12}")
+
+		lines.append(f"{'total':<16}{self.instructions:>14}{self.cycles:>12}")
+
+		if self.output:
+			lines.append(f"output: {self.output!r}")
+
+		lines.append(" ".join(f"{name}={value}" for name, value in self.registers.items()))
+
+		return "\n".join(lines)
+
+class Emulator:
+	"""Интерпретатор подмножества 8086 в реальном режиме, которое генерирует Flatty.
+
+	Вся память - один сегмент 64 КБ, префиксы сегментов игнорируются. int 10h с ah = 0Eh
+	выводит символ из al в буфер, hlt завершает выполнение"""
+	def __init__(self, image: bytes, origin: int = 0, entry: int = None, functions: Dict[str, int] = None):
+		if origin + len(image) > MEMORY_SIZE:
+			raise EmulatorError("image does not fit into memory")
+
+		self.memory = bytearray(MEMORY_SIZE)
+		self.memory[origin:origin + len(image)] = image
+		self.registers = [0] * 8
+		self.registers[4] = STACK_TOP
+		self.ip = origin if entry is None else entry
+		self.carry = self.zero = self.sign = self.overflow = self.parity = False
+		self.output = []
+		self.halted = False
+
+		# Начала функций для учёта статистики
+		functions = functions or {}
+		self.function_starts = sorted((address, name) for name, address in functions.items())
+		self.function_addresses = [address for address, _ in self.function_starts]
+		self.stats = {}
+
+	def function_at(self, address: int) -> str:
+		index = bisect_right(self.function_addresses, address) - 1
+
+		return self.function_starts[index][1] if index >= 0 else "entry"
+
+	def run(self, limit: int = INSTRUCTION_LIMIT) -> ExecutionReport:
+		"""Выполнение до hlt"""
+		executed = 0
+
+		while not self.halted:
+			if executed >= limit:
+				raise EmulatorError(f"instruction limit {limit} exceeded", self.ip)
+
+			address = self.ip
+			cycles = self.step()
+			name = self.function_at(address)
+			stats = self.stats.get(name)
+
+			if stats is None:
+				stats = self.stats[name] = FunctionStats()
+
+			stats.instructions += 1
+			stats.cycles += cycles
+			executed += 1
+
+		registers = {name: self.registers[index] for index, name in enumerate(REGISTER_NAMES)}
+
+		return ExecutionReport("".join(self.output), registers, self.stats)
+
+	# Память и регистры
+
+	def fetch(self) -> int:
+		value = self.memory[self.ip]
+		self.ip = (self.ip + 1) & 0xFFFF
+		return value
+
+	def fetch_word(self) -> int:
+		return self.fetch() | self.fetch() << 8
+
+	def fetch_signed(self) -> int:
+		value = self.fetch()
+		return value - 0x100 if value & 0x80 else value
+
+	def read(self, address: int, size: int) -> int:
+		if size == 8:
+			return self.memory[address & 0xFFFF]
+
+		return self.memory[address & 0xFFFF] | self.memory[(address + 1) & 0xFFFF] << 8
+
+	def write(self, address: int, value: int, size: int):
+		self.memory[address & 0xFFFF] = value & 0xFF
+
+		if size == 16:
+			self.memory[(address + 1) & 0xFFFF] = value >> 8 & 0xFF
+
+	def get_register(self, index: int, size: int) -> int:
+		if size == 16:
+			return self.registers[index]
+
+		value = self.registers[index & 3]
+		return value >> 8 if index & 4 else value & 0xFF
+
+	def set_register(self, index: int, value: int, size: int):
+		if size == 16:
+			self.registers[index] = value & 0xFFFF
+		elif index & 4:
+			self.registers[index & 3] = self.registers[index & 3] & 0x00FF | (value & 0xFF) << 8
+		else:
+			self.registers[index & 3] = self.registers[index & 3] & 0xFF00 | value & 0xFF
+
+	def push(self, value: int):
+		self.registers[4] = (self.registers[4] - 2) & 0xFFFF
+		self.write(self.registers[4], value, 16)
+
+	def pop(self) -> int:
+		value = self.read(self.registers[4], 16)
+		self.registers[4] = (self.registers[4] + 2) & 0xFFFF
+		return value
+
+	def modrm(self):
+		"""Разбор ModR/M: (reg, место операнда, такты EA). Место - ("r", номер) или ("m", адрес)"""
+		byte = self.fetch()
+		mod, reg, rm = byte >> 6, byte >> 3 & 7, byte & 7
+
+		if mod == 3:
+			return reg, ("r", rm), 0
+
+		if mod == 0 and rm == 6:
+			return reg, ("m", self.fetch_word()), 6
+
+		if mod == 1:
+			displacement = self.fetch_signed()
+		elif mod == 2:
+			displacement = self.fetch_word()
+		else:
+			displacement = 0
+
+		address = sum(self.registers[index] for index in EA_REGISTERS[rm]) + displacement
+
+		return reg, ("m", address & 0xFFFF), EA_CYCLES[rm][mod != 0]
+
+	def load(self, location, size: int) -> int:
+		kind, value = location
+		return self.get_register(value, size) if kind == "r" else self.read(value, size)
+
+	def store(self, location, value: int, size: int):
+		kind, target = location
+
+		if kind == "r":
+			self.set_register(target, value, size)
+		else:
+			self.write(target, value, size)
+
+	# Арифметика
+
+	def set_result_flags(self, result: int, size: int):
+		mask = 0xFF if size == 8 else 0xFFFF
+		result &= mask
+
+		self.zero = result == 0
+		self.sign = bool(result >> (size - 1) & 1)
+		self.parity = bin(result & 0xFF).count("1") % 2 == 0
+
+	def alu(self, operation: int, left: int, right: int, size: int) -> int:
+		"""add, or, adc, sbb, and, sub, xor, cmp. Возвращает результат и обновляет флаги"""
+		mask = 0xFF if size == 8 else 0xFFFF
+		sign = 1 << (size - 1)
+
+		if operation in (0, 2): # add, adc
+			result = left + right + (operation == 2 and self.carry)
+			self.carry = result > mask
+			self.overflow = bool((left ^ result) & (right ^ result) & sign)
+		elif operation in (3, 5, 7): # sbb, sub, cmp
+			result = left - right - (operation == 3 and self.carry)
+			self.carry = result < 0
+			self.overflow = bool((left ^ right) & (left ^ result) & sign)
+		else:
+			if operation == 1:
+				result = left | right
+			elif operation == 4:
+				result = left & right
+			else:
+				result = left ^ right
+
+			self.carry = self.overflow = False
+
+		self.set_result_flags(result, size)
+
+		return result & mask
+
+	def condition(self, code: int) -> bool:
+		"""Условие перехода 70h - 7Fh"""
+		result = (
+			self.overflow,
+			self.carry,
+			self.zero,
+			self.carry or self.zero,
+			self.sign,
+			self.parity,
+			self.sign != self.overflow,
+			self.zero or self.sign != self.overflow
+		)[code >> 1]
+
+		return not result if code & 1 else result
+
+	# Выполнение
+
+	def step(self) -> int:
+		"""Выполнение одной инструкции. Возвращает оценку тактов"""
+		start = self.ip
+		opcode = self.fetch()
+		cycles = 0
+
+		# Префиксы сегментов: вся память - один сегмент
+		while opcode in (0x26, 0x2E, 0x36, 0x3E):
+			cycles += CYCLES["prefix"]
+			opcode = self.fetch()
+
+		if opcode < 0x40 and opcode & 7 < 6:
+			return cycles + self.step_alu(opcode)
+
+		if 0x40 <= opcode <= 0x4F:
+			index = opcode & 7
+			value = self.registers[index]
+			carry = self.carry
+			self.registers[index] = self.alu(5 if opcode >= 0x48 else 0, value, 1, 16)
+			self.carry = carry # inc и dec не меняют CF
+			return cycles + CYCLES["inc r16"]
+
+		if 0x50 <= opcode <= 0x57:
+			# push sp сохраняет уже уменьшенное значение на 8086
+			value = self.registers[opcode & 7]
+			self.push(value if opcode != 0x54 else (value - 2) & 0xFFFF)
+			return cycles + CYCLES["push r"]
+
+		if 0x58 <= opcode <= 0x5F:
+			self.registers[opcode & 7] = self.pop()
+			return cycles + CYCLES["pop r"]
+
+		if opcode in (0x68, 0x6A):
+			self.push(self.fetch_word() if opcode == 0x68 else self.fetch_signed() & 0xFFFF)
+			return cycles + CYCLES["push i"]
+
+		if 0x70 <= opcode <= 0x7F:
+			offset = self.fetch_signed()
+
+			if self.condition(opcode & 0xF):
+				self.ip = (self.ip + offset) & 0xFFFF
+				return cycles + CYCLES["jcc taken"]
+
+			return cycles + CYCLES["jcc"]
+
+		if opcode in (0x80, 0x81, 0x83):
+			size = 8 if opcode == 0x80 else 16
+			operation, location, ea = self.modrm()
+
+			if opcode == 0x81:
+				value = self.fetch_word()
+			else:
+				value = self.fetch_signed() & (0xFF if size == 8 else 0xFFFF)
+
+			result = self.alu(operation, self.load(location, size), value, size)
+
+			if operation != 7:
+				self.store(location, result, size)
+
+			if location[0] == "r":
+				return cycles + CYCLES["alu r, i"]
+
+			return cycles + ea + CYCLES["cmp m, i" if operation == 7 else "alu m, i"]
+
+		if opcode in (0x86, 0x87):
+			size = 8 if opcode == 0x86 else 16
+			reg, location, ea = self.modrm()
+			value = self.load(location, size)
+			self.store(location, self.get_register(reg, size), size)
+			self.set_register(reg, value, size)
+			return cycles + (CYCLES["xchg r, r"] if location[0] == "r" else CYCLES["xchg m, r"] + ea)
+
+		if 0x88 <= opcode <= 0x8B:
+			size = 16 if opcode & 1 else 8
+			reg, location, ea = self.modrm()
+
+			if opcode & 2:
+				self.set_register(reg, self.load(location, size), size)
+				form = "mov r, r" if location[0] == "r" else "mov r, m"
+			else:
+				self.store(location, self.get_register(reg, size), size)
+				form = "mov r, r" if location[0] == "r" else "mov m, r"
+
+			return cycles + CYCLES[form] + ea
+
+		if opcode == 0x8F:
+			_, location, ea = self.modrm()
+			self.store(location, self.pop(), 16)
+			return cycles + (CYCLES["pop r"] if location[0] == "r" else CYCLES["pop m"] + ea)
+
+		if 0x90 <= opcode <= 0x97:
+			index = opcode & 7
+			self.registers[0], self.registers[index] = self.registers[index], self.registers[0]
+			return cycles + CYCLES["xchg ax, r"]
+
+		if opcode == 0x98:
+			self.registers[0] = (self.registers[0] & 0xFF) | (0xFF00 if self.registers[0] & 0x80 else 0)
+			return cycles + CYCLES["cbw"]
+
+		if opcode == 0x99:
+			self.registers[2] = 0xFFFF if self.registers[0] & 0x8000 else 0
+			return cycles + CYCLES["cwd"]
+
+		if 0xB0 <= opcode <= 0xBF:
+			size = 16 if opcode >= 0xB8 else 8
+			self.set_register(opcode & 7, self.fetch_word() if size == 16 else self.fetch(), size)
+			return cycles + CYCLES["mov r, i"]
+
+		if opcode in (0xC2, 0xC3):
+			release = self.fetch_word() if opcode == 0xC2 else 0
+			self.ip = self.pop()
+			self.registers[4] = (self.registers[4] + release) & 0xFFFF
+			return cycles + CYCLES["ret i" if opcode == 0xC2 else "ret"]
+
+		if opcode in (0xC6, 0xC7):
+			size = 16 if opcode == 0xC7 else 8
+			_, location, ea = self.modrm()
+			self.store(location, self.fetch_word() if size == 16 else self.fetch(), size)
+			return cycles + (CYCLES["mov r, i"] if location[0] == "r" else CYCLES["mov m, i"] + ea)
+
+		if 0xD0 <= opcode <= 0xD3:
+			return cycles + self.step_shift(16 if opcode & 1 else 8, opcode >= 0xD2, start)
+
+		if opcode == 0xCD:
+			self.interrupt(self.fetch(), start)
+			return cycles + CYCLES["int"]
+
+		if opcode in (0xE2, 0xE3):
+			offset = self.fetch_signed()
+
+			if opcode == 0xE2:
+				self.registers[1] = (self.registers[1] - 1) & 0xFFFF
+				taken = self.registers[1] != 0
+				form = "loop"
+			else:
+				taken = self.registers[1] == 0
+				form = "jcxz"
+
+			if taken:
+				self.ip = (self.ip + offset) & 0xFFFF
+				return cycles + CYCLES[f"{form} taken"]
+
+			return cycles + CYCLES[form]
+
+		if opcode == 0xE8:
+			offset = self.fetch_word()
+			self.push(self.ip)
+			self.ip = (self.ip + offset) & 0xFFFF
+			return cycles + CYCLES["call"]
+
+		if opcode in (0xE9, 0xEB):
+			offset = self.fetch_word() if opcode == 0xE9 else self.fetch_signed()
+			self.ip = (self.ip + offset) & 0xFFFF
+			return cycles + CYCLES["jmp"]
+
+		if opcode == 0xF4:
+			self.halted = True
+			return cycles + CYCLES["simple"]
+
+		if opcode in (0xF6, 0xF7):
+			return cycles + self.step_unary(16 if opcode == 0xF7 else 8, start)
+
+		if opcode in (0xF8, 0xF9, 0xFA, 0xFB, 0xFC, 0xFD):
+			if opcode in (0xF8, 0xF9):
+				self.carry = opcode == 0xF9
+
+			return cycles + CYCLES["simple"]
+
+		if opcode in (0xFE, 0xFF):
+			return cycles + self.step_group(16 if opcode == 0xFF else 8, start)
+
+		raise EmulatorError(f"unsupported opcode {opcode:02X}h", start)
+
+	def step_alu(self, opcode: int) -> int:
+		"""Арифметика 00h - 3Dh: r/m и регистр, аккумулятор и непосредственное значение"""
+		operation = opcode >> 3
+		form = opcode & 7
+		size = 16 if form & 1 else 8
+
+		if form >= 4:
+			value = self.fetch_word() if size == 16 else self.fetch()
+			result = self.alu(operation, self.get_register(0, size), value, size)
+
+			if operation != 7:
+				self.set_register(0, result, size)
+
+			return CYCLES["alu r, i"]
+
+		reg, location, ea = self.modrm()
+		register = self.get_register(reg, size)
+		value = self.load(location, size)
+
+		if form & 2:
+			result = self.alu(operation, register, value, size)
+
+			if operation != 7:
+				self.set_register(reg, result, size)
+
+			return CYCLES["alu r, r"] if location[0] == "r" else CYCLES["alu r, m"] + ea
+
+		result = self.alu(operation, value, register, size)
+
+		if operation != 7:
+			self.store(location, result, size)
+
+		if location[0] == "r":
+			return CYCLES["alu r, r"]
+
+		return CYCLES["cmp m, r" if operation == 7 else "alu m, r"] + ea
+
+	def step_unary(self, size: int, start: int) -> int:
+		"""Группа F6 / F7: not, neg, mul, div"""
+		operation, location, ea = self.modrm()
+		value = self.load(location, size)
+		memory = location[0] == "m"
+		mask = 0xFF if size == 8 else 0xFFFF
+
+		if operation == 2:
+			self.store(location, ~value, size)
+			return CYCLES["not m"] + ea if memory else CYCLES["not r"]
+
+		if operation == 3:
+			self.store(location, self.alu(5, 0, value, size), size)
+			return CYCLES["not m"] + ea if memory else CYCLES["not r"]
+
+		if operation == 4:
+			if size == 8:
+				result = (self.registers[0] & 0xFF) * value
+				self.registers[0] = result & 0xFFFF
+				high = result >> 8
+			else:
+				result = self.registers[0] * value
+				self.registers[0] = result & 0xFFFF
+				self.registers[2] = result >> 16 & 0xFFFF
+				high = self.registers[2]
+
+			self.carry = self.overflow = high != 0
+			return CYCLES[f"mul {'m' if memory else 'r'}{size}"] + ea
+
+		if operation == 6:
+			if value == 0:
+				raise EmulatorError("divide by zero", start)
+
+			if size == 8:
+				dividend = self.registers[0]
+			else:
+				dividend = self.registers[2] << 16 | self.registers[0]
+
+			quotient, remainder = divmod(dividend, value)
+
+			if quotient > mask:
+				raise EmulatorError("divide overflow", start)
+
+			if size == 8:
+				self.registers[0] = remainder << 8 | quotient
+			else:
+				self.registers[0], self.registers[2] = quotient, remainder
+
+			return CYCLES[f"div {'m' if memory else 'r'}{size}"] + ea
+
+		raise EmulatorError(f"unsupported F6/F7 operation {operation}", start)
+
+	def step_shift(self, size: int, by_cl: bool, start: int) -> int:
+		"""Группа D0 - D3: сдвиги на 1 или на cl. 8086 сдвигает по одному биту и не ограничивает число"""
+		operation, location, ea = self.modrm()
+		value = self.load(location, size)
+		count = self.registers[1] & 0xFF if by_cl else 1
+		mask = 0xFF if size == 8 else 0xFFFF
+		sign = 1 << (size - 1)
+
+		if operation in (4, 6): # shl, sal
+			result = value
+
+			for _ in range(count):
+				self.carry = bool(result & sign)
+				result = result << 1 & mask
+
+			self.overflow = bool(result & sign) != self.carry
+		elif operation == 5: # shr
+			result = value
+
+			for _ in range(count):
+				self.carry = bool(result & 1)
+				result >>= 1
+
+			self.overflow = bool(value & sign)
+		elif operation == 7: # sar
+			result = value
+
+			for _ in range(count):
+				self.carry = bool(result & 1)
+				result = result >> 1 | result & sign
+
+			self.overflow = False
+		else:
+			raise EmulatorError(f"unsupported D0-D3 operation {operation}", start)
+
+		if count:
+			self.set_result_flags(result, size)
+
+		self.store(location, result, size)
+		memory = location[0] == "m"
+
+		if not by_cl:
+			return CYCLES["shift m, 1"] + ea if memory else CYCLES["shift r, 1"]
+
+		return (CYCLES["shift m, cl"] + ea if memory else CYCLES["shift r, cl"]) + CYCLES["shift bit"] * count
+
+	def step_group(self, size: int, start: int) -> int:
+		"""Группа FE / FF: inc, dec, call, jmp, push"""
+		operation, location, ea = self.modrm()
+		memory = location[0] == "m"
+
+		if operation in (0, 1):
+			carry = self.carry
+			self.store(location, self.alu(5 if operation else 0, self.load(location, size), 1, size), size)
+			self.carry = carry
+			return CYCLES["inc m"] + ea if memory else CYCLES[f"inc r{size}"]
+
+		if size != 16:
+			raise EmulatorError(f"unsupported FE operation {operation}", start)
+
+		if operation == 2:
+			target = self.load(location, 16)
+			self.push(self.ip)
+			self.ip = target
+			return CYCLES["call m"] + ea if memory else CYCLES["call r"]
+
+		if operation == 4:
+			self.ip = self.load(location, 16)
+			return CYCLES["jmp m"] + ea if memory else CYCLES["jmp r"]
+
+		if operation == 6:
+			self.push(self.load(location, 16))
+			return CYCLES["push m"] + ea if memory else CYCLES["push r"]
+
+		raise EmulatorError(f"unsupported FF operation {operation}", start)
+
+	def interrupt(self, number: int, start: int):
+		"""Прерывания BIOS. Поддерживается только телетайпный вывод int 10h / ah = 0Eh"""
+		if number == 0x10 and self.registers[0] >> 8 == 0x0E:
+			self.output.append(chr(self.registers[0] & 0xFF))
+			return
+
+		raise EmulatorError(f"unsupported interrupt {number:02X}h (ah = {self.registers[0] >> 8:02X}h)", start)
+
+def function_addresses(encoder: Encoder) -> Dict[str, int]:
+	"""Адреса начала функций: глобальные метки, start - это main"""
+	return {
+		"main" if name == "start" else name: address
+		for name, address in encoder.labels.items()
+		if "." not in name
+	}
+
+def run(buffer: AsmBuffer, origin: int = 0, limit: int = INSTRUCTION_LIMIT) -> ExecutionReport:
+	"""Собрать буфер и выполнить его до hlt"""
+	encoder = Encoder(buffer, origin)
+	image = encoder.assemble()
+
+	return Emulator(image, encoder.origin, functions=function_addresses(encoder)).run(limit)
@@ -0,0 +1,580 @@
+import re
+from typing import List, Optional, TextIO
+from arch.x86.assembly import AsmBuffer, AsmInstruction, AsmLabel, AsmDirective
+
+REGISTERS_16 = {"ax": 0, "cx": 1, "dx": 2, "bx": 3, "sp": 4, "bp": 5, "si": 6, "di": 7}
+REGISTERS_8 = {"al": 0, "cl": 1, "dl": 2, "bl": 3, "ah": 4, "ch": 5, "dh": 6, "bh": 7}
+
+# Префиксы замены сегмента
+SEGMENT_PREFIXES = {"es": 0x26, "cs": 0x2E, "ss": 0x36, "ds": 0x3E}
+
+# Поле r/m для сочетаний базового и индексного регистров
+MEMORY_RM = {
+	("bx", "si"): 0, ("bx", "di"): 1, ("bp", "si"): 2, ("bp", "di"): 3,
+	("si",): 4, ("di",): 5, ("bp",): 6, ("bx",): 7
+}
+
+# Номер операции в группе арифметических инструкций (поле reg в 80 / 81 / 83)
+ARITHMETIC = {"add": 0, "or": 1, "adc": 2, "sbb": 3, "and": 4, "sub": 5, "xor": 6, "cmp": 7}
+
+# Номер операции в группе F6 / F7
+UNARY_GROUP = {"not": 2, "neg": 3, "mul": 4, "imul": 5, "div": 6, "idiv": 7}
+
+# Номер операции в группе сдвигов D0 - D3
+SHIFT_GROUP = {"rol": 0, "ror": 1, "rcl": 2, "rcr": 3, "shl": 4, "sal": 4, "shr": 5, "sar": 7}
+
+CONDITIONAL_JUMPS = {
+	"jo": 0x70, "jno": 0x71, "jb": 0x72, "jae": 0x73, "je": 0x74, "jne": 0x75, "jbe": 0x76, "ja": 0x77,
+	"js": 0x78, "jns": 0x79, "jp": 0x7A, "jnp": 0x7B, "jl": 0x7C, "jge": 0x7D, "jle": 0x7E, "jg": 0x7F,
+	"jc": 0x72, "jnc": 0x73, "jz": 0x74, "jnz": 0x75, "jnae": 0x72, "jnb": 0x73, "jna": 0x76, "jnbe": 0x77
+}
+
+# Переходы, у которых есть только короткая форма
+SHORT_ONLY_JUMPS = {"jcxz": 0xE3, "loop": 0xE2, "loope": 0xE1, "loopne": 0xE0}
+
+# Инструкции без операндов
+SIMPLE = {
+	"ret": 0xC3, "cli": 0xFA, "sti": 0xFB, "hlt": 0xF4, "nop": 0x90, "cld": 0xFC, "std": 0xFD,
+	"clc": 0xF8, "stc": 0xF9, "pushf": 0x9C, "popf": 0x9D, "cbw": 0x98, "cwd": 0x99, "int3": 0xCC
+}
+
+NUMBER = re.compile(r"^(?:0x[0-9a-f]+|[0-9][0-9a-f]*h|\d+|0b[01]+|[01]+b)$", re.IGNORECASE)
+
+class EncoderError(Exception):
+	def __init__(self, message, item=None):
+		if item is None:
+			super().__init__(message)
+		else:
+			super().__init__(f"{message}: {item!r}")
+
+def parse_number(text: str) -> Optional[int]:
+	"""Числовая константа в синтаксисе NASM или None"""
+	text = text.strip()
+
+	if len(text) == 3 and text[0] == text[2] and text[0] in "'\"":
+		return ord(text[1])
+
+	if not NUMBER.match(text):
+		return None
+
+	lowered = text.lower()
+
+	if lowered.startswith("0x"):
+		return int(lowered[2:], 16)
+	elif lowered.startswith("0b"):
+		return int(lowered[2:], 2)
+	elif lowered.endswith("h"):
+		return int(lowered[:-1], 16)
+	elif lowered.endswith("b") and not lowered.isdigit():
+		return int(lowered[:-1], 2)
+
+	return int(lowered)
+
+def fits_signed_8(value: int) -> bool:
+	"""Значение представимо знаковым байтом (с учётом переполнения слова)"""
+	value &= 0xFFFF
+
+	return value < 0x80 or value >= 0xFF80
+
+def word(value: int) -> bytes:
+	return (value & 0xFFFF).to_bytes(2, "little")
+
+class Operand:
+	"""Разобранный операнд: регистр, непосредственное значение или адрес в памяти"""
+	__slots__ = ("kind", "size", "code", "terms", "base", "segment")
+
+	def __init__(self, kind: str, size: Optional[int] = None, code: int = 0, terms: List = None, base: tuple = (), segment: str = None):
+		self.kind = kind # "register", "immediate" или "memory"
+		self.size = size # 8, 16 или None если размер не указан
+		self.code = code # Номер регистра
+		self.terms = terms or [] # Слагаемые значения или смещения: (знак, число или имя метки)
+		self.base = base # Базовый и индексный регистры адреса
+		self.segment = segment # Префикс замены сегмента
+
+	@property
+	def has_labels(self) -> bool:
+		return any(isinstance(term, str) for _, term in self.terms)
+
+def parse_terms(text: str, item) -> List:
+	"""Сумма чисел и меток: a + 4 - b"""
+	terms = []
+
+	for sign, term in re.findall(r"([+-]?)\s*([^+\-\s]+)", text):
+		value = parse_number(term)
+		terms.append((-1 if sign == "-" else 1, value if value is not None else term))
+
+	if not terms:
+		raise EncoderError("empty expression", item)
+
+	return terms
+
+def parse_operand(text: str, item) -> Operand:
+	"""Разбор текстового операнда"""
+	text = text.strip()
+	lowered = text.lower()
+	size = None
+
+	for prefix, prefix_size in (("byte ", 8), ("word ", 16), ("short ", None), ("near ", None)):
+		if lowered.startswith(prefix):
+			size = prefix_size
+			text = text[len(prefix):].strip()
+			lowered = text.lower()
+
+	if lowered in REGISTERS_16:
+		return Operand("register", 16, REGISTERS_16[lowered])
+
+	if lowered in REGISTERS_8:
+		return Operand("register", 8, REGISTERS_8[lowered])
+
+	if not text.startswith("["):
+		return Operand("immediate", size, terms=parse_terms(text, item))
+
+	if not text.endswith("]"):
+		raise EncoderError("unterminated memory operand", item)
+
+	inner = text[1:-1].strip()
+	segment = None
+
+	if ":" in inner:
+		segment, inner = (part.strip() for part in inner.split(":", 1))
+		segment = segment.lower()
+
+		if segment not in SEGMENT_PREFIXES:
+			raise EncoderError(f"unknown segment {segment}", item)
+
+	registers = []
+	terms = []
+
+	for sign, term in parse_terms(inner, item):
+		if isinstance(term, str) and term.lower() in REGISTERS_16:
+			if sign < 0:
+				raise EncoderError("register can not be subtracted in address", item)
+
+			registers.append(term.lower())
+		else:
+			terms.append((sign, term))
+
+	base = tuple(sorted(registers, key=lambda name: name not in ("bx", "bp")))
+
+	if base and base not in MEMORY_RM:
+		raise EncoderError(f"invalid address registers {' + '.join(registers)}", item)
+
+	return Operand("memory", size, terms=terms, base=base, segment=segment)
+
+class Encoded:
+	"""Инструкция или директива выходного кода с текущим размером кодировки"""
+	__slots__ = ("item", "operands", "long", "address", "code", "scope")
+
+	def __init__(self, item, operands: List[Operand], scope: str):
+		self.item = item
+		self.operands = operands
+		self.long = False # Переход в длинной форме (выбирается при релаксации)
+		self.address = 0
+		self.code = b""
+		self.scope = scope # Последняя глобальная метка для локальных меток .name
+
+class Encoder:
+	"""Ассемблер подмножества 8086 в плоский двоичный образ.
+
+	Метки разрешаются в два этапа: сначала все переходы считаются короткими и адреса
+	пересчитываются, пока какой-нибудь переход не достаёт до цели (тогда он становится
+	длинным), затем код кодируется окончательно с известными адресами"""
+	def __init__(self, buffer: AsmBuffer, origin: int = 0):
+		self.buffer = buffer
+		self.origin = origin
+		self.labels = {} # Полное имя метки -> адрес
+		self.items = [] # Encoded или AsmLabel в порядке вывода
+		self.relaxed = 0 # Количество переходов в длинной форме
+
+	def assemble(self) -> bytes:
+		"""Кодирование всего буфера"""
+		self.collect()
+
+		changed = True
+
+		# Релаксация: переходы только удлиняются, поэтому цикл конечен
+		while changed:
+			self.layout()
+			changed = False
+
+			for encoded in self.items:
+				if isinstance(encoded, Encoded) and self.is_jump(encoded) and not encoded.long:
+					if not self.reaches_short(encoded):
+						encoded.long = True
+						self.relaxed += 1
+						changed = True
+
+		for encoded in self.items:
+			if isinstance(encoded, Encoded):
+				code = self.encode(encoded, final=True)
+
+				if len(code) != len(encoded.code):
+					raise EncoderError("instruction size changed between passes", encoded.item)
+
+				encoded.code = code
+
+		return b"".join(encoded.code for encoded in self.items if isinstance(encoded, Encoded))
+
+	def collect(self):
+		"""Разбор всех инструкций буфера"""
+		scope = ""
+
+		for section in [self.buffer.header] + self.buffer.sections:
+			for item in section.items:
+				if isinstance(item, AsmLabel):
+					if not item.name.startswith("."):
+						scope = item.name
+
+					self.items.append(AsmLabel(self.full_name(item.name, scope)))
+				elif isinstance(item, AsmInstruction):
+					operands = [parse_operand(operand, item) for operand in item.operands]
+					self.items.append(Encoded(item, operands, scope))
+				elif isinstance(item, AsmDirective):
+					self.collect_directive(item, scope)
+
+	def collect_directive(self, item: AsmDirective, scope: str):
+		"""Директивы bits, org, db и dw"""
+		name, _, rest = item.text.strip().partition(" ")
+		name = name.lower()
+
+		if name == "bits":
+			if rest.strip() != "16":
+				raise EncoderError("only 16 bit code is supported", item)
+		elif name == "org":
+			self.origin = parse_number(rest)
+		elif name in ("db", "dw"):
+			operands = [parse_operand(value, item) for value in rest.split(",")]
+			self.items.append(Encoded(item, operands, scope))
+		else:
+			raise EncoderError("unsupported directive", item)
+
+	@staticmethod
+	def full_name(name: str, scope: str) -> str:
+		"""Локальные метки .name относятся к последней глобальной метке"""
+		return scope + name if name.startswith(".") else name
+
+	def layout(self):
+		"""Расчёт адресов с текущими размерами переходов"""
+		address = self.origin
+		defined = set()
+
+		for encoded in self.items:
+			if isinstance(encoded, AsmLabel):
+				if encoded.name in defined:
+					raise EncoderError(f"duplicate label {encoded.name}")
+
+				defined.add(encoded.name)
+				self.labels[encoded.name] = address
+			else:
+				encoded.address = address
+				encoded.code = self.encode(encoded, final=False)
+				address += len(encoded.code)
+
+	@staticmethod
+	def is_jump(encoded: Encoded) -> bool:
+		item = encoded.item
+
+		return (isinstance(item, AsmInstruction)
+			and (item.opcode in CONDITIONAL_JUMPS or item.opcode in SHORT_ONLY_JUMPS or item.opcode == "jmp")
+			and len(encoded.operands) == 1
+			and encoded.operands[0].kind == "immediate"
+		)
+
+	def reaches_short(self, encoded: Encoded) -> bool:
+		"""Достаёт ли короткий переход (2 байта) до цели"""
+		target = self.value(encoded.operands[0], encoded, final=False)
+
+		return -128 <= target - (encoded.address + 2) <= 127
+
+	def value(self, operand: Operand, encoded: Encoded, final: bool) -> int:
+		"""Значение выражения. На первых проходах неизвестные метки равны 0"""
+		total = 0
+
+		for sign, term in operand.terms:
+			if isinstance(term, str):
+				name = self.full_name(term, encoded.scope)
+
+				if name not in self.labels:
+					if final:
+						raise EncoderError(f"undefined label {term}", encoded.item)
+
+					continue
+
+				term = self.labels[name]
+
+			total += sign * term
+
+		return total
+
+	# Кодирование
+
+	def encode(self, encoded: Encoded, final: bool) -> bytes:
+		"""Байты инструкции или директивы"""
+		item = encoded.item
+		operands = encoded.operands
+
+		if isinstance(item, AsmDirective):
+			size = 1 if item.text.lower().startswith("db") else 2
+			return b"".join((self.value(operand, encoded, final) & (0xFF if size == 1 else 0xFFFF)).to_bytes(size, "little") for operand in operands)
+
+		opcode = item.opcode.lower()
+		segment = next((operand.segment for operand in operands if operand.kind == "memory" and operand.segment), None)
+		prefix = bytes([SEGMENT_PREFIXES[segment]]) if segment else b""
+
+		if opcode in SIMPLE and not operands:
+			return bytes([SIMPLE[opcode]])
+
+		if opcode == "ret" and len(operands) == 1:
+			return b"\xC2" + word(self.value(operands[0], encoded, final))
+
+		if self.is_jump(encoded):
+			return self.encode_jump(encoded, final)
+
+		if opcode == "int" and len(operands) == 1:
+			return bytes([0xCD, self.value(operands[0], encoded, final) & 0xFF])
+
+		if opcode == "mov" and len(operands) == 2:
+			return prefix + self.encode_mov(encoded, final)
+
+		if opcode in ARITHMETIC and len(operands) == 2:
+			return prefix + self.encode_arithmetic(encoded, ARITHMETIC[opcode], final)
+
+		if opcode in UNARY_GROUP and len(operands) == 1:
+			size = self.operand_size(encoded, operands)
+			return prefix + bytes([0xF6 if size == 8 else 0xF7]) + self.modrm(UNARY_GROUP[opcode], operands[0], encoded, final)
+
+		if opcode in SHIFT_GROUP and len(operands) == 2:
+			return prefix + self.encode_shift(encoded, SHIFT_GROUP[opcode], final)
+
+		if opcode in ("inc", "dec") and len(operands) == 1:
+			return prefix + self.encode_inc_dec(encoded, opcode == "dec", final)
+
+		if opcode in ("push", "pop") and len(operands) == 1:
+			return prefix + self.encode_stack(encoded, opcode == "push", final)
+
+		if opcode == "xchg" and len(operands) == 2:
+			return prefix + self.encode_xchg(encoded, final)
+
+		if opcode in ("call", "jmp") and len(operands) == 1:
+			operand = operands[0]
+
+			if opcode == "call" and operand.kind == "immediate":
+				return b"\xE8" + word(self.value(operand, encoded, final) - (encoded.address + 3))
+
+			if operand.kind == "register" and operand.size != 16:
+				raise EncoderError("near indirect transfer needs a 16 bit operand", item)
+
+			# call / jmp через регистр или слово в памяти
+			return prefix + b"\xFF" + self.modrm(2 if opcode == "call" else 4, operand, encoded, final)
+
+		raise EncoderError("unsupported instruction", item)
+
+	def encode_jump(self, encoded: Encoded, final: bool) -> bytes:
+		"""Переходы на метку. Для длинной формы условного перехода используется обратное условие"""
+		opcode = encoded.item.opcode.lower()
+		target = self.value(encoded.operands[0], encoded, final)
+		address = encoded.address
+
+		if not encoded.long:
+			offset = target - (address + 2)
+
+			if final and not -128 <= offset <= 127:
+				raise EncoderError("short jump out of range", encoded.item)
+
+			if opcode == "jmp":
+				code = 0xEB
+			elif opcode in SHORT_ONLY_JUMPS:
+				code = SHORT_ONLY_JUMPS[opcode]
+			else:
+				code = CONDITIONAL_JUMPS[opcode]
+
+			return bytes([code, offset & 0xFF])
+
+		if opcode == "jmp":
+			return b"\xE9" + word(target - (address + 3))
+
+		if opcode in SHORT_ONLY_JUMPS:
+			# loop .taken / jmp short .skip / .taken: jmp near target / .skip:
+			return bytes([SHORT_ONLY_JUMPS[opcode], 2, 0xEB, 3, 0xE9]) + word(target - (address + 7))
+
+		# У 8086 нет условного перехода rel16: jncc +3 / jmp near target
+		return bytes([CONDITIONAL_JUMPS[opcode] ^ 1, 3, 0xE9]) + word(target - (address + 5))
+
+	def operand_size(self, encoded: Encoded, operands: List[Operand], default: Optional[int] = None) -> int:
+		"""Размер операции по регистрам или явному указанию byte / word"""
+		sizes = {operand.size for operand in operands if operand.kind != "immediate" and operand.size}
+
+		if len(sizes) > 1:
+			raise EncoderError("operand size mismatch", encoded.item)
+
+		if sizes:
+			return sizes.pop()
+
+		if default is None:
+			raise EncoderError("operation size not specified", encoded.item)
+
+		return default
+
+	def modrm(self, reg: int, operand: Operand, encoded: Encoded, final: bool) -> bytes:
+		"""Байт ModR/M и смещение для регистра или адреса в памяти"""
+		if operand.kind == "register":
+			return bytes([0xC0 | reg << 3 | operand.code])
+
+		if operand.kind != "memory":
+			raise EncoderError("register or memory operand expected", encoded.item)
+
+		displacement = self.value(operand, encoded, final)
+
+		if not operand.base:
+			# Прямой адрес [disp16]
+			return bytes([reg << 3 | 6]) + word(displacement)
+
+		rm = MEMORY_RM[operand.base]
+
+		# Смещение с меткой всегда занимает слово, чтобы размер не менялся между проходами
+		if operand.has_labels:
+			return bytes([0x80 | reg << 3 | rm]) + word(displacement)
+
+		if displacement == 0 and operand.base != ("bp",):
+			return bytes([reg << 3 | rm])
+
+		if -128 <= displacement <= 127:
+			return bytes([0x40 | reg << 3 | rm, displacement & 0xFF])
+
+		return bytes([0x80 | reg << 3 | rm]) + word(displacement)
+
+	def immediate(self, operand: Operand, size: int, encoded: Encoded, final: bool) -> bytes:
+		value = self.value(operand, encoded, final)
+
+		if size == 8:
+			return bytes([value & 0xFF])
+
+		return word(value)
+
+	def encode_mov(self, encoded: Encoded, final: bool) -> bytes:
+		target, source = encoded.operands
+		size = self.operand_size(encoded, [target, source])
+		wide = size == 16
+
+		if target.kind == "immediate":
+			raise EncoderError("immediate can not be a destination", encoded.item)
+
+		if source.kind == "immediate":
+			if target.kind == "register":
+				return bytes([(0xB8 if wide else 0xB0) | target.code]) + self.immediate(source, size, encoded, final)
+
+			return bytes([0xC7 if wide else 0xC6]) + self.modrm(0, target, encoded, final) + self.immediate(source, size, encoded, final)
+
+		if source.kind == "register":
+			return bytes([0x89 if wide else 0x88]) + self.modrm(source.code, target, encoded, final)
+
+		if target.kind == "register":
+			return bytes([0x8B if wide else 0x8A]) + self.modrm(target.code, source, encoded, final)
+
+		raise EncoderError("memory to memory move", encoded.item)
+
+	def encode_arithmetic(self, encoded: Encoded, operation: int, final: bool) -> bytes:
+		target, source = encoded.operands
+		size = self.operand_size(encoded, [target, source])
+		wide = size == 16
+
+		if target.kind == "immediate":
+			raise EncoderError("immediate can not be a destination", encoded.item)
+
+		if source.kind == "immediate":
+			value = self.value(source, encoded, final)
+
+			if wide and not source.has_labels and fits_signed_8(value):
+				return b"\x83" + self.modrm(operation, target, encoded, final) + bytes([value & 0xFF])
+
+			# Короткая форма для аккумулятора
+			if target.kind == "register" and target.code == 0:
+				return bytes([operation << 3 | (5 if wide else 4)]) + self.immediate(source, size, encoded, final)
+
+			return bytes([0x81 if wide else 0x80]) + self.modrm(operation, target, encoded, final) + self.immediate(source, size, encoded, final)
+
+		if source.kind == "register":
+			return bytes([operation << 3 | wide]) + self.modrm(source.code, target, encoded, final)
+
+		if target.kind == "register":
+			return bytes([operation << 3 | 2 | wide]) + self.modrm(target.code, source, encoded, final)
+
+		raise EncoderError("memory to memory operation", encoded.item)
+
+	def encode_shift(self, encoded: Encoded, operation: int, final: bool) -> bytes:
+		"""Сдвиг на 1 (D0 / D1) или на cl (D2 / D3). Сдвиг на другое число появился в 80186"""
+		target, count = encoded.operands
+		size = self.operand_size(encoded, [target])
+
+		if count.kind == "register" and count.size == 8 and count.code == 1:
+			opcode = 0xD2
+		elif count.kind == "immediate" and self.value(count, encoded, final) == 1:
+			opcode = 0xD0
+		else:
+			raise EncoderError("shift count must be 1 or cl", encoded.item)
+
+		return bytes([opcode | (size == 16)]) + self.modrm(operation, target, encoded, final)
+
+	def encode_inc_dec(self, encoded: Encoded, decrement: bool, final: bool) -> bytes:
+		operand = encoded.operands[0]
+		size = self.operand_size(encoded, [operand])
+
+		if operand.kind == "register" and size == 16:
+			return bytes([(0x48 if decrement else 0x40) | operand.code])
+
+		return bytes([0xFF if size == 16 else 0xFE]) + self.modrm(int(decrement), operand, encoded, final)
+
+	def encode_stack(self, encoded: Encoded, push: bool, final: bool) -> bytes:
+		operand = encoded.operands[0]
+
+		if operand.kind == "register":
+			if operand.size != 16:
+				raise EncoderError("only 16 bit registers can be pushed", encoded.item)
+
+			return bytes([(0x50 if push else 0x58) | operand.code])
+
+		if operand.kind == "immediate":
+			if not push:
+				raise EncoderError("can not pop into immediate", encoded.item)
+
+			# push imm появился в 80186, NASM кодирует его так же
+			value = self.value(operand, encoded, final)
+
+			if not operand.has_labels and fits_signed_8(value):
+				return bytes([0x6A, value & 0xFF])
+
+			return b"\x68" + word(value)
+
+		if self.operand_size(encoded, [operand], default=16) != 16:
+			raise EncoderError("only words can be pushed", encoded.item)
+
+		return (b"\xFF" + self.modrm(6, operand, encoded, final)) if push else (b"\x8F" + self.modrm(0, operand, encoded, final))
+
+	def encode_xchg(self, encoded: Encoded, final: bool) -> bytes:
+		first, second = encoded.operands
+		size = self.operand_size(encoded, [first, second])
+
+		if first.kind == "register" and second.kind == "register" and size == 16 and 0 in (first.code, second.code):
+			return bytes([0x90 | (first.code or second.code)])
+
+		if first.kind == "register":
+			first, second = second, first
+
+		if second.kind != "register":
+			raise EncoderError("xchg needs a register operand", encoded.item)
+
+		return bytes([0x87 if size == 16 else 0x86]) + self.modrm(second.code, first, encoded, final)
+
+	def write_listing(self, file: TextIO):
+		"""Листинг: адрес, байты кодировки и исходная строка"""
+		for encoded in self.items:
+			if isinstance(encoded, AsmLabel):
+				file.write(f"{self.labels[encoded.name]:04X}{'':22}{encoded.name}:\n")
+				continue
+
+			code = encoded.code.hex(" ").upper()
+			file.write(f"{encoded.address:04X}  {code:<20}  {encoded.item!r}\n")
+
+def assemble(buffer: AsmBuffer, origin: int = 0) -> bytes:
+	"""Собрать буфер в плоский двоичный образ"""
+	return Encoder(buffer, origin).assemble()
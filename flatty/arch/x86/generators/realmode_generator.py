@@ -1,103 +1,640 @@
 import sys
 from ast import *
+from arch.x86.assembly import AsmBuffer, AsmInstruction
+from arch.x86.peephole import instruction_size
+from arch.x86.modes.realmode import REGISTERS_8
+from arch.x86.calling import StackCallingConvention
+from symbols import SymbolTable
+from arch.x86.switch import SwitchChain, JUMP_TABLE, BINARY_SEARCH
+from arch.x86.arithmetic import multiply, divide, mul_instruction, div_instruction
+from passes.constant_folding import literal_value
 
-class RealModeGenerator:
-	def __init__(self, program: Program):
+# Условный переход для каждого оператора сравнения. Сравнение беззнаковое
+JUMPS = {"==": "je", "!=": "jne", "<": "jb", ">": "ja", "<=": "jbe", ">=": "jae"}
+
+# Противоположное условие: переход, когда сравнение ложно
+INVERSE = {"==": "!=", "!=": "==", "<": ">=", ">=": "<", ">": "<=", "<=": ">"}
+
+# Условие при перестановке операндов местами
+MIRROR = {"==": "==", "!=": "!=", "<": ">", ">": "<", "<=": ">=", ">=": "<="}
+
+# Регистры, которые можно использовать как индекс в адресе
+INDEX_REGISTERS = ("bx", "si", "di")
+
+# Короткий переход (loop, jcxz) достаёт на 127 байт вперёд и на 128 назад от следующей инструкции
+SHORT_JUMP_FORWARD = 127
+SHORT_JUMP_BACKWARD = 128
+
+SEARCH_LEAF = 3 # Столько значений в конце двоичного поиска проверяются по очереди
+
+# 8086 сдвигает только на 1 или на cl
+SHIFT_OPCODES = frozenset(["shl", "shr"])
+
+def is_memory(operand: str) -> bool:
+	return operand.startswith("[")
+
+def code_size(items: list) -> int:
+	"""Верхняя оценка размера кода в байтах: условный переход, который не достаёт до цели,
+	ассемблер заменяет обратным переходом через jmp (5 байт)"""
+	return sum(
+		5 if item.opcode in JUMPS.values() else instruction_size(item)
+		for item in items if isinstance(item, AsmInstruction)
+	)
+
+class RealModeGenerator(NodeVisitor):
+	prefix = "generate_" # Узел IfElseChain генерирует generate_if_else_chain и т.д.
+
+	def __init__(self, program: Program, convention=None, tail_calls: bool = False, clobbers=None, switch_tables: bool = False, symbols: SymbolTable = None, allocation=None, strength_reduction: bool = False):
 		self.program = program
-		self.code = ""
+		self.buffer = AsmBuffer()
+		self.convention = convention or StackCallingConvention(program)
+		self.tail_calls = tail_calls # Заменять вызовы в хвостовой позиции на jmp
+		self.clobbers = clobbers # ClobberAnalysis: какие регистры сохранять вокруг вызовов
+		self.switch_tables = switch_tables # Таблицы переходов и двоичный поиск для цепочек elseif
+		self.switches = [] # Отчёт о выбранной стратегии для каждой цепочки
+		self.strength_reduction = strength_reduction # Умножение и деление на константу без mul и div
+		self.tables = [] # Таблицы переходов текущей функции: (метка, цели)
 		self.current_func = None # Текущая обрабатываемая функция
+		self.label_count = 0 # Счётчик для уникальных меток
+		self.symbols = symbols or SymbolTable(program)
+		self.parameters = {} # Операнды параметров текущей функции: имя -> регистр или [bp + N]
+		self.allocation = allocation # RegisterAllocator: размер переменных в кадре стека
+		self.frame_size = 0 # Байт под переменные текущей функции
+		self.has_frame = False # Нужен ли текущей функции кадр стека
 
-	def get_parameter_index(self, parameter_name: str, func_node: Func):
-		"""Получить индекс параметра в функции"""
-		return func_node.params.index(parameter_name)
+	def new_label(self, kind: str) -> str:
+		"""Новая уникальная метка"""
+		self.label_count += 1
+
+		return f".{kind}_{self.label_count}"
+
+	def generate(self, reuse: dict = None) -> AsmBuffer:
+		"""Генерация кода. reuse - готовый код функций (из кэша): имя -> элементы секции"""
+		self.buffer.directive("bits 16")
+
+		self.buffer.section("entry")
+		self.buffer.emit("jmp", "start")
 
-	def generate(self) -> str:
-		"""Генерация кода"""
 		for func in self.program.functions:
+			if reuse and func.name in reuse:
+				self.buffer.section(func.name).items = reuse[func.name]
+				continue
+
 			self.current_func = func
 			self.generate_func(func)
 
-		code = "bits 16\n\n"
-		code += "jmp start\n\n"
-		code += self.code
-
-		return code
+		return self.buffer
 
 	def generate_func(self, func_node: Func):
 		"""Генерация кода функции"""
+		self.buffer.section(func_node.name)
+
+		# Локальные метки нумеруются внутри функции: код функции не зависит от остальных
+		self.label_count = 0
+
 		if func_node.name == "main":
-			self.code += "start:\n"
+			self.buffer.label("start")
 		else:
-			self.code += f"{func_node.name}:\n"
+			self.buffer.label(func_node.name)
 
-		if len(func_node.params) > 0:
-			self.code += "push bp\n"
-			self.code += "mov bp, sp\n"
+		layout = self.convention.layout(func_node.name)
+		self.parameters = self.symbols.locations(func_node.name, layout)
+		self.frame_size = self.allocation.frame_size(func_node.name) if self.allocation else 0
+		self.has_frame = layout.has_frame or self.frame_size > 0
 
-		self.generate_func_body(func_node)
+		if self.has_frame:
+			self.buffer.emit("push", "bp")
+			self.buffer.emit("mov", "bp", "sp")
 
-		if len(func_node.params) > 0:
-			self.code += "pop bp\n"
+		# Переменные в стеке лежат ниже сохранённого bp: [bp - 2], [bp - 4], ...
+		if self.frame_size:
+			self.buffer.emit("sub", "sp", str(self.frame_size))
 
-		if func_node.name == "main":
-			self.code += "cli\n"
-			self.code += "hlt\n"
-		else:
-			self.code += "ret\n\n"
+		# Хвостовой вызов сам разбирает кадр и передаёт управление
+		if not self.generate_func_body(func_node):
+			self.generate_leave()
 
+			if func_node.name == "main":
+				self.buffer.emit("cli")
+				self.buffer.emit("hlt")
+			else:
+				self.buffer.emit("ret")
+
+		# Таблицы переходов размещаются после кода функции
+		for label, targets in self.tables:
+			self.buffer.label(label)
+			self.buffer.directive(f"dw {', '.join(targets)}")
+
+		self.tables = []
 		self.current_func = None
 
-	def generate_func_body(self, func_node: Func):
-		"""Генерация кода тела функции"""
-		for node in func_node.body:
-			if isinstance(node, Instruction):
-				self.generate_instruction(node)
-			elif isinstance(node, CallFunc):
-				self.generate_call_func(node)
+	def generate_leave(self):
+		"""Разбор кадра стека перед выходом из функции"""
+		if self.frame_size:
+			self.buffer.emit("mov", "sp", "bp")
+
+		if self.has_frame:
+			self.buffer.emit("pop", "bp")
+
+	def generate_func_body(self, func_node: Func) -> bool:
+		"""Генерация кода тела функции. Возвращает True если тело закончилось хвостовым вызовом"""
+		body = func_node.body
+		tail_call = self.get_tail_call(func_node)
+
+		if tail_call:
+			body = body[:-1]
+
+		self.generate_body(body)
+
+		if tail_call:
+			self.generate_tail_call(tail_call)
+
+		return tail_call is not None
+
+	def generate_body(self, body: List):
+		"""Генерация кода блока"""
+		for node in body:
+			self.visit(node)
+
+	def generate_operand(self, operand) -> str:
+		"""Генерация операнда инструкции"""
+		return self.visit(operand)
+
+	def generate_literal(self, node: Literal) -> str:
+		return node.value
+
+	def generate_register(self, node: Register) -> str:
+		return node.name
+
+	def generate_parameter(self, node: Parameter) -> str:
+		return self.parameters[node.name]
+
+	def generate_stack_slot(self, node: StackSlot) -> str:
+		return f"[bp - {node.offset}]"
+
+	def generic_visit(self, node: ASTNode):
+		print(f"error: unsupported node type: {type(node)}")
+		sys.exit()
+
+	def emit_sized(self, opcode: str, operands: List[str], registers: List):
+		"""Инструкция с указанием размера памяти, если его нельзя вывести из регистров"""
+		if not any(isinstance(operand, Register) for operand in registers) and any(map(is_memory, operands)):
+			operands = [f"word {operand}" if is_memory(operand) else operand for operand in operands]
+
+		self.buffer.emit(opcode, *operands)
 
 	def generate_instruction(self, instruction: Instruction):
 		"""Генерация кода инструкции"""
-		parts = []
-
-		used_registers = []
-
-		for operand in instruction.operands:
-			if isinstance(operand, Register):
-				used_registers.append(operand.name)
-
-		for operand in instruction.operands:
-			if isinstance(operand, Literal):
-				parts.append(operand.value)
-			elif isinstance(operand, Register):
-				parts.append(operand.name)
-			elif isinstance(operand, Parameter):
-				# Должно получится [bp + 4] для первого параметра
-				# Прибавлять +2 для каждого последующего параметра
-
-				index = self.get_parameter_index(operand.name, self.current_func)
-				parts.append(f"[bp + {index * 2 + 6}]")
-			elif isinstance(operand, CallFunc):
-				self.generate_call_func(operand)
-				parts.append("ax") # Результат функции возвращается в регистре AX
-			else:
-				print(f"error: unsupported operand type: {type(operand)}")
+		operands = instruction.operands
+
+		if (instruction.opcode == "mov" and len(operands) == 2
+			and isinstance(operands[1], BinaryOperation) and operands[1].operation in ("*", "/")
+		):
+			self.generate_arithmetic(operands[0], operands[1])
+			return
+
+		parts = [self.generate_operand(operand) for operand in operands]
+
+		if instruction.opcode in SHIFT_OPCODES and len(parts) == 2 and parts[1] != "cl":
+			count = literal_value(operands[1])
+
+			if count is None:
+				print(f"error: shift count must be a number or cl: {instruction}")
 				sys.exit()
 
-		self.code += f"{instruction.opcode} {', '.join(parts)}\n"
+			narrow = isinstance(operands[0], Register) and operands[0].name in REGISTERS_8
+
+			# Сдвиг больше чем на разрядность всегда даёт 0
+			for _ in range(min(count, 8 if narrow else 16)):
+				self.emit_sized(instruction.opcode, [parts[0], "1"], operands)
+
+			return
+
+		if len(parts) == 2 and is_memory(parts[0]) and is_memory(parts[1]):
+			# Два операнда в памяти (параметр и переменная в стеке): второй передаётся через ax
+			self.buffer.emit("push", "ax")
+			self.buffer.emit("mov", "ax", parts[1])
+			self.buffer.emit(instruction.opcode, parts[0], "ax")
+			self.buffer.emit("pop", "ax")
+			return
+
+		# Результат вызова в операнде лежит в регистре
+		registers = [Register("ax") if isinstance(operand, CallFunc) else operand for operand in instruction.operands]
+		self.emit_sized(instruction.opcode, parts, registers)
+
+	def generate_arithmetic(self, target, expr: BinaryOperation):
+		"""mov target, a * b и mov target, a / b (деление беззнаковое). Умножение и деление
+		на константу заменяются самой быстрой последовательностью сдвигов и сложений"""
+		for operand in (target, expr.left, expr.right):
+			if (not isinstance(operand, (Register, Parameter, StackSlot, Literal))
+				or isinstance(operand, Register) and operand.name in REGISTERS_8
+				or operand is target and isinstance(target, Literal)
+			):
+				print(f"error: operands of {expr.operation} must be 16 bit registers, parameters, variables or numbers: {expr}")
+				sys.exit()
+
+		left, right = expr.left, expr.right
+
+		if expr.operation == "*" and literal_value(left) is not None:
+			left, right = right, left
+
+		target_operand, left_operand, right_operand = (self.generate_operand(node) for node in (target, left, right))
+		constant = literal_value(right)
+
+		if expr.operation == "/" and constant == 0:
+			print(f"error: division by zero in function {self.current_func.name}")
+			sys.exit()
+
+		if expr.operation == "*":
+			if constant is None or not self.strength_reduction:
+				sequence = mul_instruction(target_operand, left_operand, right_operand)
+			else:
+				sequence = multiply(target_operand, left_operand, constant)
+		elif constant is None or not self.strength_reduction:
+			sequence = div_instruction(target_operand, left_operand, right_operand)
+		else:
+			sequence = divide(target_operand, left_operand, constant)
+
+		for opcode, *parts in sequence.instructions:
+			self.buffer.emit(opcode, *parts)
+
+	def generate_expression_statement(self, expr):
+		"""Генерация выражения-оператора: счётчик и шаг цикла for"""
+		if expr is None:
+			return
+		elif isinstance(expr, BinaryOperation) and expr.operation == "=":
+			self.generate_instruction(Instruction("mov", [expr.left, expr.right]))
+		elif isinstance(expr, UnaryOperation) and expr.operation in ("++", "--"):
+			self.generate_instruction(Instruction("inc" if expr.operation == "++" else "dec", [expr.operand]))
+		elif isinstance(expr, CallFunc):
+			self.generate_call_func(expr)
+		else:
+			print(f"error: unsupported statement: {expr}")
+			sys.exit()
+
+	def generate_condition(self, condition, target: str, jump_if: bool):
+		"""Переход на target, если значение условия равно jump_if. Иначе выполнение продолжается дальше.
+		Сравнение сразу превращается в cmp и условный переход, без вычисления 0 / 1"""
+		if isinstance(condition, BinaryOperation) and condition.operation in ("&&", "||"):
+			# Сокращённое вычисление: правая часть не вычисляется, если результат уже известен
+			if (condition.operation == "&&") == jump_if:
+				skip = self.new_label("skip")
+
+				self.generate_condition(condition.left, skip, not jump_if)
+				self.generate_condition(condition.right, target, jump_if)
+				self.buffer.label(skip)
+			else:
+				self.generate_condition(condition.left, target, jump_if)
+				self.generate_condition(condition.right, target, jump_if)
+		elif isinstance(condition, BinaryOperation) and condition.operation in JUMPS:
+			self.generate_compare(condition.left, condition.right, condition.operation, target, jump_if)
+		elif isinstance(condition, Literal) and condition.value.isdigit():
+			# Константное условие
+			if (int(condition.value) != 0) == jump_if:
+				self.buffer.emit("jmp", target)
+		else:
+			self.generate_compare(condition, Literal("0"), "!=", target, jump_if)
+
+	def generate_compare(self, left, right, operation: str, target: str, jump_if: bool):
+		"""cmp и условный переход"""
+		left_operand = self.generate_operand(left)
+		right_operand = self.generate_operand(right)
+
+		# Непосредственное значение может быть только вторым операндом
+		if isinstance(left, Literal) and not isinstance(right, Literal):
+			left, right = right, left
+			left_operand, right_operand = right_operand, left_operand
+			operation = MIRROR[operation]
+
+		if is_memory(left_operand) and is_memory(right_operand):
+			# cmp не принимает два операнда в памяти. pop не меняет флаги
+			self.buffer.emit("push", "ax")
+			self.buffer.emit("mov", "ax", left_operand)
+			self.buffer.emit("cmp", "ax", right_operand)
+			self.buffer.emit("pop", "ax")
+		else:
+			registers = [Register("ax") if isinstance(operand, CallFunc) else operand for operand in (left, right)]
+			self.emit_sized("cmp", [left_operand, right_operand], registers)
+
+		self.buffer.emit(JUMPS[operation if jump_if else INVERSE[operation]], target)
+
+	def generate_if_else_chain(self, node: IfElseChain):
+		"""Генерация if / elseif / else"""
+		switch = SwitchChain.match(node) if self.switch_tables else None
+
+		if switch:
+			self.switches.append(switch.describe(self.current_func.name))
+
+			if switch.strategy() == JUMP_TABLE:
+				self.generate_jump_table(switch)
+				return
+			elif switch.strategy() == BINARY_SEARCH:
+				self.generate_binary_search(switch)
+				return
+
+		end = self.new_label("if_end")
+		branches = [node.if_branch] + (node.elseif_branches or [])
+
+		for index, branch in enumerate(branches):
+			last = index == len(branches) - 1 and not node.else_branch
+			following = end if last else self.new_label("elseif")
+
+			self.generate_condition(branch.condition, following, False)
+			self.generate_body(branch.body)
+
+			if not last:
+				self.buffer.emit("jmp", end)
+				self.buffer.label(following)
+
+		if node.else_branch:
+			self.generate_body(node.else_branch.body)
+
+		self.buffer.label(end)
+
+	def generate_cases(self, switch: SwitchChain, labels: List[str], default: str, end: str, restore: str = None):
+		"""Тела веток после выбора ветки. restore - регистр, сохранённый в стеке перед выбором"""
+		self.buffer.label(default)
+
+		if restore:
+			self.buffer.emit("pop", restore)
+
+		if switch.default:
+			self.generate_body(switch.default)
+
+		for label, (_, body) in zip(labels, switch.cases):
+			self.buffer.emit("jmp", end)
+			self.buffer.label(label)
+
+			if restore:
+				self.buffer.emit("pop", restore)
+
+			self.generate_body(body)
+
+		self.buffer.label(end)
+
+	def generate_jump_table(self, switch: SwitchChain):
+		"""Выбор ветки по таблице переходов с проверкой границ: один переход на любую ветку"""
+		end = self.new_label("switch_end")
+		default = self.new_label("switch_default")
+		table = self.new_label("switch_table")
+		labels = [self.new_label("case") for _ in switch.cases]
+
+		# Индекс считается в регистре, который можно использовать в адресе. Он сохраняется в стеке
+		# и восстанавливается в начале каждой ветки, поэтому выбор не портит регистры
+		index = switch.register if switch.register in INDEX_REGISTERS else "bx"
+
+		self.buffer.emit("push", index)
+
+		if switch.register in REGISTERS_8:
+			self.buffer.emit("mov", "bl", switch.register)
+			self.buffer.emit("xor", "bh", "bh")
+		elif switch.register != index:
+			self.buffer.emit("mov", index, switch.register)
+
+		if switch.low:
+			self.buffer.emit("sub", index, str(switch.low))
+
+		# Значения меньше нижней границы после вычитания становятся большими беззнаковыми
+		self.buffer.emit("cmp", index, str(switch.high - switch.low))
+		self.buffer.emit("ja", default)
+		self.buffer.emit("add", index, index)
+		self.buffer.emit("jmp", f"[cs:{index} + {table}]")
+
+		targets = dict(zip((value for value, _ in switch.cases), labels))
+		self.tables.append((table, [targets.get(value, default) for value in range(switch.low, switch.high + 1)]))
+
+		self.generate_cases(switch, labels, default, end, restore=index)
+
+	def generate_binary_search(self, switch: SwitchChain):
+		"""Выбор ветки двоичным поиском по значениям: O(log n) сравнений"""
+		end = self.new_label("switch_end")
+		default = self.new_label("switch_default")
+		labels = [self.new_label("case") for _ in switch.cases]
+
+		cases = [(value, label) for (value, _), label in zip(switch.cases, labels)]
+		self.generate_search(switch.register, cases, default)
+		self.generate_cases(switch, labels, default, end)
+
+	def generate_search(self, register: str, cases: List, default: str):
+		"""Дерево сравнений для отсортированных значений"""
+		if len(cases) <= SEARCH_LEAF:
+			for value, label in cases:
+				self.buffer.emit("cmp", register, str(value))
+				self.buffer.emit("je", label)
+
+			self.buffer.emit("jmp", default)
+			return
+
+		middle = len(cases) // 2
+		value, label = cases[middle]
+		lower = self.new_label("search")
+
+		self.buffer.emit("cmp", register, str(value))
+		self.buffer.emit("je", label)
+		self.buffer.emit("jb", lower)
+		self.generate_search(register, cases[middle + 1:], default)
+		self.buffer.label(lower)
+		self.generate_search(register, cases[:middle], default)
+
+	def generate_loop(self, condition, body: List, step=None):
+		"""Цикл с проверкой условия внизу: на каждую итерацию один переход"""
+		top = self.new_label("loop")
+		test = self.new_label("loop_test")
+
+		self.buffer.emit("jmp", test)
+		self.buffer.label(top)
+		self.generate_body(body)
+		self.generate_expression_statement(step)
+		self.buffer.label(test)
+		self.generate_condition(condition, top, True)
+
+	def generate_while_do_loop(self, node: WhileDoLoop):
+		"""Генерация цикла while"""
+		self.generate_loop(node.condition, node.body)
+
+	def generate_do_while_loop(self, node: DoWhileLoop):
+		"""Генерация цикла do while"""
+		top = self.new_label("do")
+
+		self.buffer.label(top)
+		self.generate_body(node.body)
+		self.generate_condition(node.condition, top, True)
+
+	def generate_count_loop(self, node: CountLoop):
+		"""Генерация цикла со счётчиком в cx. loop уменьшает cx и переходит одной инструкцией,
+		но только коротко: если тело больше, используются dec cx и jne"""
+		top = self.new_label("loop")
+		items = self.buffer.current.items
+
+		if node.check_zero:
+			end = self.new_label("loop_end")
+			self.buffer.emit("jcxz", end)
+			check = len(items) - 1
+
+		self.buffer.label(top)
+		start = len(items)
+		self.generate_body(node.body)
+
+		if code_size(items[start:]) + 2 <= SHORT_JUMP_BACKWARD:
+			self.buffer.emit("loop", top)
+		else:
+			self.buffer.emit("dec", "cx")
+			self.buffer.emit("jne", top)
+
+		if node.check_zero:
+			if code_size(items[check + 1:]) > SHORT_JUMP_FORWARD:
+				items[check:check + 1] = [AsmInstruction("cmp", ["cx", "0"]), AsmInstruction("je", [end])]
+
+			self.buffer.label(end)
+
+	def generate_for_loop(self, node: ForLoop):
+		"""Генерация цикла for"""
+		self.generate_expression_statement(node.counter)
+		self.generate_loop(node.condition, node.body, node.operation)
+
+	def get_tail_call(self, func_node: Func):
+		"""Вызов в хвостовой позиции, который можно заменить на jmp, или None"""
+		if not self.tail_calls or func_node.name == "main" or not func_node.body:
+			return None
+
+		last = func_node.body[-1]
+
+		# mov ax, f() после вызова превращается в mov ax, ax
+		if (isinstance(last, Instruction)
+			and last.opcode == "mov"
+			and len(last.operands) == 2
+			and isinstance(last.operands[0], Register)
+			and last.operands[0].name == "ax"
+			and isinstance(last.operands[1], CallFunc)
+		):
+			last = last.operands[1]
+
+		if not isinstance(last, CallFunc):
+			return None
+
+		# Аргументы вызываемой функции в стеке должны поместиться на место аргументов текущей
+		current = self.convention.layout(func_node.name)
+		callee = self.convention.layout(last.func_name, len(last.args))
+		current_slots = sum(index is not None for index in current.stack_index)
+		callee_slots = sum(not callee.argument_register(index) for index in range(len(last.args)))
+
+		if callee_slots > current_slots:
+			return None
+
+		return last
+
+	def generate_tail_call(self, call_func_node: CallFunc):
+		"""Генерация хвостового вызова: аргументы на место аргументов текущей функции, разбор кадра и jmp"""
+		stack_size = self.generate_call_args(call_func_node)
+
+		# Аргументы лежат в стеке в прямом порядке, первый - на вершине
+		for slot in range(stack_size // 2):
+			self.buffer.emit("pop", f"word [bp + {slot * 2 + 4}]")
+
+		self.generate_leave()
+
+		# Оставшиеся аргументы текущей функции снимет со стека вызывающая функция
+		self.buffer.emit("jmp", call_func_node.func_name)
 
 	def generate_call_func(self, call_func_node: CallFunc) -> str:
 		"""Генерация кода вызова функции"""
-		if call_func_node.args:
-			for arg in reversed(call_func_node.args):
-				if isinstance(arg, Literal):
-					self.code += f"push {arg.value}\n"
-				elif isinstance(arg, Register):
-					self.code += f"push {arg.name}\n"
-				elif isinstance(arg, CallFunc):
-					self.generate_call_func(arg)
-					self.code += "push ax\n"
-
-		self.code += f"call {call_func_node.func_name}\n"
-
-		if call_func_node.args:
-			self.code += f"add sp, {len(call_func_node.args) * 2}\n"
\ No newline at end of file
+		saved = self.clobbers.saved_registers(call_func_node) if self.clobbers else []
+
+		# Сохраняем живые регистры, которые портит вызываемая функция
+		for register in saved:
+			self.buffer.emit("push", register)
+
+		stack_size = self.generate_call_args(call_func_node)
+
+		self.buffer.emit("call", call_func_node.func_name)
+
+		if stack_size:
+			self.buffer.emit("add", "sp", str(stack_size))
+
+		for register in reversed(saved):
+			self.buffer.emit("pop", register)
+
+		return "ax" # Результат функции возвращается в регистре AX
+
+	def generate_call_args(self, call_func_node: CallFunc) -> int:
+		"""Передача аргументов вызова. Возвращает размер аргументов в стеке"""
+		args = call_func_node.args
+		layout = self.convention.layout(call_func_node.func_name, len(args))
+
+		# Аргументы в стеке передаются справа налево
+		for index in reversed(range(len(args))):
+			if not layout.argument_register(index):
+				self.generate_push_arg(args[index])
+
+		# Аргументы в регистрах: сначала вычисляем вложенные вызовы, так как они портят регистры
+		register_args = [index for index in range(len(args)) if layout.argument_register(index)]
+		nested_calls = [index for index in register_args if isinstance(args[index], CallFunc)]
+
+		for index in nested_calls:
+			self.generate_call_func(args[index])
+			self.buffer.emit("push", "ax")
+
+		self.generate_parallel_move({
+			layout.argument_register(index): self.generate_arg(args[index])
+			for index in register_args if index not in nested_calls
+		})
+
+		for index in reversed(nested_calls):
+			self.buffer.emit("pop", layout.argument_register(index))
+
+		return 2 * sum(not layout.argument_register(index) for index in range(len(args)))
+
+	def generate_parallel_move(self, moves: dict):
+		"""Одновременная запись значений в регистры. Источником может быть другой регистр назначения,
+		например при рекурсивном вызове f(b, a) с параметрами в регистрах"""
+		moves = {target: source for target, source in moves.items() if target != source}
+
+		while moves:
+			sources = set(moves.values())
+			ready = [target for target in moves if target not in sources]
+
+			if ready:
+				for target in ready:
+					self.buffer.emit("mov", target, moves.pop(target))
+
+				continue
+
+			# Остались только циклы: меняем местами первую пару
+			target, source = next(iter(moves.items()))
+			self.buffer.emit("xchg", target, source)
+			del moves[target]
+
+			# Значение, которое лежало в target, теперь в source
+			for other, other_source in moves.items():
+				if other_source == target:
+					moves[other] = source
+
+			moves = {target: source for target, source in moves.items() if target != source}
+
+	def generate_arg(self, arg) -> str:
+		"""Операнд аргумента вызова"""
+		if isinstance(arg, Literal):
+			return arg.value
+		elif isinstance(arg, Register):
+			return arg.name
+		elif isinstance(arg, Parameter):
+			return self.parameters[arg.name]
+		elif isinstance(arg, StackSlot):
+			return self.generate_stack_slot(arg)
+
+		print(f"error: unsupported argument type: {type(arg)}")
+		sys.exit()
+
+	def generate_push_arg(self, arg):
+		"""Передача аргумента через стек"""
+		if isinstance(arg, CallFunc):
+			self.generate_call_func(arg)
+			self.buffer.emit("push", "ax")
+			return
+
+		operand = self.generate_arg(arg)
+
+		if operand.startswith("["):
+			operand = f"word {operand}"
+
+		self.buffer.emit("push", operand)
@@ -10,9 +10,53 @@ OPCODES = frozenset([
 	"add",
 	"sub",
 	"mul",
+	"shl",
+	"shr",
 	"inc",
 	"dec",
 	"xor",
 	"push",
+	"pop",
+	"int"
+])
+
+# 16 битный регистр, к которому относится каждый регистр
+REGISTER_FAMILIES = {
+	"ax": "ax", "al": "ax", "ah": "ax",
+	"bx": "bx", "bl": "bx", "bh": "bx",
+	"cx": "cx", "cl": "cx", "ch": "cx",
+	"dx": "dx", "dl": "dx", "dh": "dx",
+	"di": "di", "si": "si", "bp": "bp", "sp": "sp"
+}
+
+REGISTERS_16 = frozenset(REGISTER_FAMILIES.values())
+REGISTERS_8 = frozenset(name for name, family in REGISTER_FAMILIES.items() if name != family)
+
+# Опкоды, которые записывают результат в первый операнд
+WRITE_OPCODES = frozenset([
+	"mov",
+	"add",
+	"sub",
+	"shl",
+	"shr",
+	"inc",
+	"dec",
+	"xor",
+	"pop"
+])
+
+# Регистры, которые опкод изменяет неявно
+IMPLICIT_WRITES = {
+	"mul": ("ax", "dx")
+}
+
+# Регистры, которые опкод читает неявно
+IMPLICIT_READS = {
+	"mul": ("ax",)
+}
+
+# Опкоды, которые не читают первый операнд, а только записывают его
+OVERWRITE_OPCODES = frozenset([
+	"mov",
 	"pop"
-])
\ No newline at end of file
+])
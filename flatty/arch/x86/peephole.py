@@ -0,0 +1,316 @@
+from typing import List, Set
+from arch.x86.assembly import AsmBuffer, AsmInstruction, AsmLabel, Section
+from arch.x86.modes.realmode import REGISTERS, REGISTERS_8
+
+def is_register(operand: str) -> bool:
+	return operand in REGISTERS
+
+def is_memory(operand: str) -> bool:
+	return operand.startswith("[")
+
+def is_immediate(operand: str) -> bool:
+	return not is_register(operand) and not is_memory(operand)
+
+def instruction_size(instruction: AsmInstruction) -> int:
+	"""Оценка размера инструкции 8086 в байтах"""
+	opcode = instruction.opcode
+	operands = instruction.operands
+
+	if not operands:
+		return 1 # ret, cli, hlt, ...
+
+	if opcode in ("push", "pop"):
+		if is_register(operands[0]):
+			return 1
+
+		return 3
+
+	if opcode in ("inc", "dec"):
+		return 1 if operands[0] in REGISTERS and operands[0] not in REGISTERS_8 else 2
+
+	if opcode in ("jmp", "call"):
+		return 3
+
+	if opcode.startswith("j"):
+		return 2
+
+	if opcode == "int":
+		return 2
+
+	# Число сдвига не кодируется: D0 - D3 сдвигают на 1 или на cl
+	if opcode in ("shl", "shr"):
+		return 3 if is_memory(operands[0]) else 2
+
+	size = 2 # opcode + ModR/M
+
+	for operand in operands[1:]:
+		if is_memory(operand):
+			size += 1 # disp8 для [bp + N]
+		elif is_immediate(operand):
+			size += 1 if operands[0] in REGISTERS_8 else 2
+
+	if is_memory(operands[0]):
+		size += 1
+
+	return size
+
+def label_key(section: Section, name: str) -> tuple:
+	"""Ключ метки: локальная метка относится к своей секции"""
+	return (section.name if name.startswith(".") else None, name)
+
+def section_sizes(buffer: AsmBuffer) -> dict:
+	"""Оценка размера каждой секции в байтах"""
+	return {
+		section.name: sum(instruction_size(item) for item in section.items if isinstance(item, AsmInstruction))
+		for section in buffer.sections
+	}
+
+def remove_self_move(items, i):
+	"""mov ax, ax -> (ничего)"""
+	instruction = items[i]
+
+	if (instruction.opcode == "mov"
+		and len(instruction.operands) == 2
+		and instruction.operands[0] == instruction.operands[1]
+		and is_register(instruction.operands[0])
+	):
+		return []
+
+	return None
+
+def collapse_push_pop(items, i):
+	"""push x / pop y -> mov y, x"""
+	first, second = items[i], items[i + 1]
+
+	if not (isinstance(second, AsmInstruction) and first.opcode == "push" and second.opcode == "pop"):
+		return None
+
+	source = first.operands[0]
+	target = second.operands[0]
+
+	if source == target:
+		return []
+
+	if not is_register(target) and not is_register(source):
+		return None
+
+	if is_register(target) and target in REGISTERS_8:
+		return None
+
+	return [AsmInstruction("mov", [target, source])]
+
+def merge_stack_adjustments(items, i):
+	"""add sp, N / add sp, M -> add sp, N + M"""
+	first, second = items[i], items[i + 1]
+
+	if not isinstance(second, AsmInstruction):
+		return None
+
+	for instruction in (first, second):
+		if (instruction.opcode not in ("add", "sub")
+			or len(instruction.operands) != 2
+			or instruction.operands[0] != "sp"
+			or not instruction.operands[1].isdigit()
+		):
+			return None
+
+	total = 0
+
+	for instruction in (first, second):
+		value = int(instruction.operands[1])
+		total += value if instruction.opcode == "add" else -value
+
+	if total == 0:
+		return []
+
+	if total > 0:
+		return [AsmInstruction("add", ["sp", str(total)])]
+
+	return [AsmInstruction("sub", ["sp", str(-total)])]
+
+def remove_jump_to_next(items, i):
+	"""jmp label / label: -> label:"""
+	first, second = items[i], items[i + 1]
+
+	if first.opcode == "jmp" and isinstance(second, AsmLabel) and first.operands == [second.name]:
+		return [second]
+
+	return None
+
+def remove_unreachable(items, i):
+	"""jmp label / add ax, 1 -> jmp label (код после безусловного перехода не выполняется)"""
+	first, second = items[i], items[i + 1]
+
+	if first.opcode in ("jmp", "ret") and isinstance(second, AsmInstruction):
+		return [first]
+
+	return None
+
+# Правила перезаписи: (название, размер окна, функция)
+# Функция возвращает список инструкций на замену первой (window == 1)
+# или первых двух (window == 2) позиций окна, либо None если правило не применимо
+RULES = [
+	("self-move", 1, remove_self_move),
+	("push-pop", 2, collapse_push_pop),
+	("stack-adjust", 2, merge_stack_adjustments),
+	("jump-to-next", 2, remove_jump_to_next),
+	("unreachable", 2, remove_unreachable),
+]
+
+# loop и jcxz только короткие: после перенаправления они могли бы не достать до цели
+JUMP_OPCODES = frozenset(["jmp", "je", "jne", "ja", "jae", "jb", "jbe"])
+
+class PeepholeStats:
+	"""Статистика работы оптимизатора"""
+	def __init__(self):
+		self.instructions_removed = 0
+		self.bytes_saved = 0
+		self.rules = {name: 0 for name, _, _ in RULES}
+		self.rules["jump-thread"] = 0
+
+	def __repr__(self):
+		applied = ", ".join(f"{name}: {count}" for name, count in self.rules.items() if count)
+
+		return (f"removed {self.instructions_removed} instructions, "
+			f"saved {self.bytes_saved} bytes ({applied or 'nothing applied'})")
+
+class PeepholeOptimizer:
+	"""Оптимизатор по окну для сгенерированного 16 битного кода"""
+	def __init__(self, buffer: AsmBuffer, rules=RULES, cached: Set[str] = frozenset()):
+		self.buffer = buffer
+		self.rules = rules
+		self.cached = cached # Секции из кэша уже оптимизированы, правила к ним не применяются
+		self.stats = PeepholeStats()
+
+	def optimize(self) -> AsmBuffer:
+		"""Применять правила до неподвижной точки"""
+		changed = True
+
+		while changed:
+			changed = False
+
+			for section in self.buffer.sections:
+				if section.name not in self.cached:
+					changed |= self.optimize_items(section.items)
+
+			changed |= self.optimize_boundaries()
+			changed |= self.thread_jumps()
+
+		return self.buffer
+
+	def optimize_items(self, items: List) -> bool:
+		"""Один проход правил по списку инструкций секции"""
+		changed = False
+		i = 0
+
+		while i < len(items):
+			if not isinstance(items[i], AsmInstruction):
+				i += 1
+				continue
+
+			for name, window, rule in self.rules:
+				if i + window > len(items):
+					continue
+
+				replacement = rule(items, i)
+
+				if replacement is None:
+					continue
+
+				old = [item for item in items[i:i + window] if isinstance(item, AsmInstruction)]
+				self.record(name, old, replacement)
+
+				items[i:i + window] = replacement
+				changed = True
+
+				# Шаг назад: замена могла открыть новое совпадение с предыдущей инструкцией
+				i = max(i - 1, 0)
+				break
+			else:
+				i += 1
+
+		return changed
+
+	def optimize_boundaries(self) -> bool:
+		"""Переходы на метку в начале следующей секции"""
+		changed = False
+		sections = [self.buffer.header] + self.buffer.sections
+
+		for section, following in zip(sections, sections[1:]):
+			if not section.items or not following.items:
+				continue
+
+			last = section.items[-1]
+
+			if isinstance(last, AsmInstruction) and remove_jump_to_next([last, following.items[0]], 0) is not None:
+				self.record("jump-to-next", [last], [])
+				section.items.pop()
+				changed = True
+
+		return changed
+
+	def thread_jumps(self) -> bool:
+		"""Переход на метку, за которой стоит jmp, сразу направляется в конечную точку.
+		Локальные метки (.name) видны только в своей секции"""
+		forward = {} # (секция, метка) -> (секция, цель jmp, который стоит сразу после неё)
+
+		for section in self.buffer.sections:
+			items = section.items
+
+			for i, item in enumerate(items):
+				if not isinstance(item, AsmLabel):
+					continue
+
+				j = i + 1
+
+				while j < len(items) and isinstance(items[j], AsmLabel):
+					j += 1
+
+				# Косвенный переход по таблице не продолжается
+				if (j < len(items)
+					and isinstance(items[j], AsmInstruction)
+					and items[j].opcode == "jmp"
+					and not is_memory(items[j].operands[0])
+				):
+					forward[label_key(section, item.name)] = (section, items[j].operands[0])
+
+		changed = False
+
+		for section in self.buffer.sections:
+			for item in section.items:
+				if not isinstance(item, AsmInstruction) or item.opcode not in JUMP_OPCODES:
+					continue
+
+				target = item.operands[0]
+				key = label_key(section, target)
+				seen = {key}
+
+				while key in forward:
+					owner, following = forward[key]
+
+					# Локальная метка другой функции отсюда не видна
+					if following.startswith(".") and owner is not section:
+						break
+
+					key = label_key(owner, following)
+
+					if key in seen:
+						break
+
+					seen.add(key)
+					target = following
+
+				if target != item.operands[0]:
+					item.operands = [target]
+					self.record("jump-thread", [item], [item])
+					changed = True
+
+		return changed
+
+	def record(self, name: str, old: List[AsmInstruction], new: List[AsmInstruction]):
+		"""Учёт сэкономленных инструкций и байт"""
+		new = [item for item in new if isinstance(item, AsmInstruction)]
+
+		self.stats.rules[name] += 1
+		self.stats.instructions_removed += len(old) - len(new)
+		self.stats.bytes_saved += sum(map(instruction_size, old)) - sum(map(instruction_size, new))
@@ -0,0 +1,91 @@
+from typing import List, Optional
+from ast import *
+from passes.constant_folding import literal_value
+
+MIN_CASES = 4 # Меньше веток выгоднее проверять по очереди
+MIN_DENSITY = 0.5 # Доля заполненных ячеек таблицы переходов
+MAX_TABLE_SIZE = 256 # Наибольшее количество ячеек в таблице переходов
+
+LINEAR = "linear"
+JUMP_TABLE = "jump table"
+BINARY_SEARCH = "binary search"
+
+def case_value(condition, register: Optional[str] = None):
+	"""Регистр и значение для условия вида reg == N (или N == reg), иначе None"""
+	if not isinstance(condition, BinaryOperation) or condition.operation != "==":
+		return None
+
+	left, right = condition.left, condition.right
+
+	if isinstance(right, Register):
+		left, right = right, left
+
+	if not isinstance(left, Register) or literal_value(right) is None:
+		return None
+
+	if register is not None and left.name != register:
+		return None
+
+	return left.name, literal_value(right)
+
+class SwitchChain:
+	"""Цепочка if / elseif, которая сравнивает один регистр с разными константами"""
+	__slots__ = ("register", "cases", "default")
+
+	def __init__(self, register: str, cases: List, default: Optional[List]):
+		self.register = register
+		self.cases = cases # (значение, тело) в порядке возрастания значений
+		self.default = default # Тело else или None
+
+	@classmethod
+	def match(cls, node: IfElseChain) -> Optional["SwitchChain"]:
+		"""Распознать цепочку сравнений одного регистра с константами"""
+		branches = [node.if_branch] + (node.elseif_branches or [])
+		first = case_value(branches[0].condition)
+
+		if first is None:
+			return None
+
+		register = first[0]
+		cases = {}
+
+		for branch in branches:
+			case = case_value(branch.condition, register)
+
+			if case is None:
+				return None
+
+			# Повторная проверка того же значения никогда не выполнится
+			cases.setdefault(case[1], branch.body)
+
+		default = node.else_branch.body if node.else_branch else None
+
+		return cls(register, sorted(cases.items(), key=lambda case: case[0]), default)
+
+	@property
+	def low(self) -> int:
+		return self.cases[0][0]
+
+	@property
+	def high(self) -> int:
+		return self.cases[-1][0]
+
+	@property
+	def density(self) -> float:
+		"""Доля значений диапазона, для которых есть ветка"""
+		return len(self.cases) / (self.high - self.low + 1)
+
+	def strategy(self) -> str:
+		"""Способ выбора ветки в зависимости от количества и плотности значений"""
+		if len(self.cases) < MIN_CASES:
+			return LINEAR
+
+		if self.high - self.low + 1 <= MAX_TABLE_SIZE and self.density >= MIN_DENSITY:
+			return JUMP_TABLE
+
+		return BINARY_SEARCH
+
+	def describe(self, func_name: str) -> str:
+		"""Строка для отчёта о выбранной стратегии"""
+		return (f"{func_name}: {self.register} in [{self.low}..{self.high}], {len(self.cases)} cases, "
+			f"density {self.density:.2f} -> {self.strategy()}")
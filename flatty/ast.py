@@ -1,13 +1,21 @@
-from typing import List
+import re
+from typing import Iterator, List
+
+INTERNED_DIGITS = 3 # Литералы до 999 создаются один раз
 
 class ASTNode:
-	pass
+	"""Узел AST. fields - атрибуты с дочерними узлами (узел, список узлов или None)"""
+	__slots__ = ()
+	fields = ()
 
 class Expression(ASTNode):
-	pass
+	__slots__ = ()
 
 class Program(ASTNode):
 	"""Программа"""
+	__slots__ = ("functions",)
+	fields = ("functions",)
+
 	def __init__(self, functions: List):
 		self.functions = functions
 
@@ -16,16 +24,23 @@ class Program(ASTNode):
 
 class Func(ASTNode):
 	"""Определение функции"""
-	def __init__(self, name: str, params: List, body: List):
+	__slots__ = ("name", "params", "body", "noinline")
+	fields = ("body",)
+
+	def __init__(self, name: str, params: List, body: List, noinline: bool = False):
 		self.name = name
 		self.params = params
 		self.body = body
+		self.noinline = noinline # Запрет встраивания функции
 
 	def __repr__(self):
-		return f"Func {self.name} ({", ".join(self.params)}) {{{", ".join(str(node) for node in self.body)}}}"
+		return f"{"noinline " if self.noinline else ""}Func {self.name} ({", ".join(self.params)}) {{{", ".join(str(node) for node in self.body)}}}"
 
 class CallFunc(ASTNode):
 	"""Вызов функции"""
+	__slots__ = ("func_name", "args")
+	fields = ("args",)
+
 	def __init__(self, func_name: str, args: List):
 		self.func_name = func_name
 		self.args = args
@@ -34,31 +49,104 @@ class CallFunc(ASTNode):
 		return f"{self.func_name}({", ".join(str(arg) for arg in self.args)})"
 
 class Register(ASTNode):
-	"""Регистр"""
+	"""Регистр. Узлы неизменяемые и общие: Register("ax") всегда возвращает один и тот же объект"""
+	__slots__ = ("name",)
+	interned = {}
+
+	def __new__(cls, name: str):
+		node = cls.interned.get(name)
+
+		if node is None:
+			node = super().__new__(cls)
+			node.name = name
+			cls.interned[name] = node
+
+		return node
+
 	def __init__(self, name: str):
-		self.name = name
+		pass
+
+	def __reduce__(self):
+		return (Register, (self.name,))
+
+	def __copy__(self):
+		return self
+
+	def __deepcopy__(self, memo):
+		return self
 
 	def __repr__(self):
 		return f"{self.name}"
 
 class Literal(ASTNode):
-	"""Литерал. Нужен для представления константных значений"""
+	"""Литерал. Нужен для представления константных значений.
+	Узлы неизменяемые, короткие числа (до INTERNED_DIGITS цифр) общие для всей программы"""
+	__slots__ = ("value",)
+	interned = {}
+
+	def __new__(cls, value: str):
+		node = cls.interned.get(value)
+
+		if node is None:
+			node = super().__new__(cls)
+			node.value = value
+
+			if len(value) <= INTERNED_DIGITS and value.isdigit():
+				cls.interned[value] = node
+
+		return node
+
 	def __init__(self, value: str):
-		self.value = value
+		pass
+
+	def __reduce__(self):
+		return (Literal, (self.value,))
+
+	def __copy__(self):
+		return self
+
+	def __deepcopy__(self, memo):
+		return self
 
 	def __repr__(self):
 		return f"{self.value}"
 
 class Parameter(ASTNode):
 	"""Параметр функции"""
+	__slots__ = ("name",)
+
 	def __init__(self, name: str):
 		self.name = name
 
 	def __repr__(self):
 		return f"{self.name}"
 
+class Variable(ASTNode):
+	"""Локальная переменная функции (var). Распределитель регистров заменяет её на Register или StackSlot"""
+	__slots__ = ("name",)
+
+	def __init__(self, name: str):
+		self.name = name
+
+	def __repr__(self):
+		return f"{self.name}"
+
+class StackSlot(ASTNode):
+	"""Локальная переменная в кадре стека: [bp - offset]"""
+	__slots__ = ("name", "offset")
+
+	def __init__(self, name: str, offset: int):
+		self.name = name
+		self.offset = offset
+
+	def __repr__(self):
+		return f"{self.name}[bp - {self.offset}]"
+
 class Instruction(ASTNode):
 	"""Инструкция ассемблера"""
+	__slots__ = ("opcode", "operands")
+	fields = ("operands",)
+
 	def __init__(self, opcode: str, operands: List):
 		self.opcode = opcode
 		self.operands = operands
@@ -68,6 +156,9 @@ class Instruction(ASTNode):
 
 class BinaryOperation(Expression):
 	"""Операция с бинарным оператором с 2 операндами"""
+	__slots__ = ("left", "right", "operation")
+	fields = ("left", "right")
+
 	def __init__(self, left: ASTNode, right: ASTNode, operation: str):
 		self.left = left
 		self.right = right
@@ -78,6 +169,9 @@ class BinaryOperation(Expression):
 
 class UnaryOperation(Expression):
 	"""Тернарная операция с 1 операндом"""
+	__slots__ = ("operand", "operation", "type")
+	fields = ("operand",)
+
 	def __init__(self, operand: ASTNode, operation: str, type: str):
 		self.operand = operand
 		self.operation = operation
@@ -91,6 +185,9 @@ class UnaryOperation(Expression):
 
 class IfOperator(ASTNode):
 	"""Условный оператор if"""
+	__slots__ = ("condition", "body")
+	fields = ("condition", "body")
+
 	def __init__(self, condition: Expression, body: List):
 		self.condition = condition
 		self.body = body
@@ -100,6 +197,9 @@ class IfOperator(ASTNode):
 
 class ElseIfOperator(ASTNode):
 	"""Условный оператор elseif"""
+	__slots__ = ("condition", "body")
+	fields = ("condition", "body")
+
 	def __init__(self, condition: Expression, body: List):
 		self.condition = condition
 		self.body = body
@@ -109,6 +209,9 @@ class ElseIfOperator(ASTNode):
 
 class ElseOperator(ASTNode):
 	"""Условный оператор else"""
+	__slots__ = ("body",)
+	fields = ("body",)
+
 	def __init__(self, body: List):
 		self.body = body
 
@@ -117,6 +220,9 @@ class ElseOperator(ASTNode):
 
 class IfElseChain(ASTNode):
 	"""Полная конструкция if / elseif / else"""
+	__slots__ = ("if_branch", "elseif_branches", "else_branch")
+	fields = ("if_branch", "elseif_branches", "else_branch")
+
 	def __init__(self, if_branch: IfOperator, elseif_branches: List[ElseIfOperator] = None, else_branch: ElseOperator = None):
 		self.if_branch = if_branch
 		self.elseif_branches = elseif_branches
@@ -132,6 +238,9 @@ class IfElseChain(ASTNode):
 		return f" ".join(parts)
 
 class WhileDoLoop(ASTNode):
+	__slots__ = ("condition", "body")
+	fields = ("condition", "body")
+
 	def __init__(self, condition: Expression, body: List):
 		self.condition = condition
 		self.body = body
@@ -140,6 +249,9 @@ class WhileDoLoop(ASTNode):
 		return f"while ({self.condition}) {{{", ".join(str(node) for node in self.body)}}}"
 
 class DoWhileLoop(ASTNode):
+	__slots__ = ("condition", "body")
+	fields = ("condition", "body")
+
 	def __init__(self, condition: Expression, body: List):
 		self.condition = condition
 		self.body = body
@@ -148,6 +260,9 @@ class DoWhileLoop(ASTNode):
 		return f"{{{", ".join(str(node) for node in self.body)}}} while ({self.condition})"
 
 class ForLoop(ASTNode):
+	__slots__ = ("counter", "condition", "operation", "body")
+	fields = ("counter", "condition", "operation", "body")
+
 	def __init__(self, counter, condition: Expression, operation: Expression, body: List):
 		self.counter = counter
 		self.condition = condition
@@ -155,4 +270,101 @@ class ForLoop(ASTNode):
 		self.body = body
 
 	def __repr__(self):
-		return f"for ({self.counter}; {self.condition}; {self.operation}) {{{", ".join(str(node) for node in self.body)}}}"
\ No newline at end of file
+		return f"for ({self.counter}; {self.condition}; {self.operation}) {{{", ".join(str(node) for node in self.body)}}}"
+
+class CountLoop(ASTNode):
+	"""Цикл со счётчиком в cx на инструкции loop (dec cx / jne для большого тела). Создаётся оптимизатором циклов"""
+	__slots__ = ("body", "check_zero")
+	fields = ("body",)
+
+	def __init__(self, body: List, check_zero: bool = True):
+		self.body = body
+		self.check_zero = check_zero # cx может быть равен 0 до входа в цикл: нужен jcxz
+
+	def __repr__(self):
+		return f"loop cx {{{", ".join(str(node) for node in self.body)}}}"
+
+def iter_child_nodes(node: ASTNode) -> Iterator[ASTNode]:
+	"""Дочерние узлы по порядку полей"""
+	for field in node.fields:
+		value = getattr(node, field)
+
+		if isinstance(value, list):
+			for child in value:
+				if child is not None:
+					yield child
+		elif value is not None:
+			yield value
+
+def snake_case(name: str) -> str:
+	"""IfElseChain -> if_else_chain, ASTNode -> ast_node"""
+	return re.sub(r"(?<=[a-z0-9])(?=[A-Z])|(?<=[A-Z])(?=[A-Z][a-z])", "_", name).lower()
+
+class NodeVisitor:
+	"""Обход AST с выбором метода по классу узла.
+
+	Для узла класса IfElseChain вызывается метод prefix + "if_else_chain", а если его нет -
+	метод ближайшего базового класса или generic_visit. Метод ищется один раз для каждого
+	класса узла и запоминается в таблице класса обходчика, дальше выбор - один поиск в словаре"""
+	prefix = "visit_"
+	dispatch = {}
+
+	def __init_subclass__(cls, **kwargs):
+		super().__init_subclass__(**kwargs)
+		cls.dispatch = {} # Класс узла -> функция обработки
+
+	@classmethod
+	def resolve(cls, node_class: type):
+		"""Метод обработки для класса узла"""
+		method = cls.dispatch.get(node_class)
+
+		if method is None:
+			for base in node_class.__mro__:
+				method = getattr(cls, cls.prefix + snake_case(base.__name__), None)
+
+				if method is not None:
+					break
+			else:
+				method = cls.generic_visit
+
+			cls.dispatch[node_class] = method
+
+		return method
+
+	def visit(self, node: ASTNode):
+		method = self.dispatch.get(node.__class__) or self.resolve(node.__class__)
+
+		return method(self, node)
+
+	def generic_visit(self, node: ASTNode):
+		"""Обход дочерних узлов"""
+		for child in iter_child_nodes(node):
+			self.visit(child)
+
+class NodeTransformer(NodeVisitor):
+	"""Обход AST с заменой узлов: результат метода заменяет узел.
+	В списке узлов метод может вернуть None (удалить узел) или список (вставить узлы)"""
+	def generic_visit(self, node: ASTNode) -> ASTNode:
+		for field in node.fields:
+			value = getattr(node, field)
+
+			if isinstance(value, list):
+				result = []
+
+				for child in value:
+					if child is None:
+						result.append(child)
+						continue
+
+					child = self.visit(child)
+
+					if isinstance(child, list):
+						result.extend(child)
+					elif child is not None:
+						result.append(child)
+
+				value[:] = result
+			elif value is not None:
+				setattr(node, field, self.visit(value))
+
+		return node
@@ -0,0 +1,183 @@
+"""Пакетная компиляция многих файлов в пуле процессов.
+
+Рабочие процессы живут всю сборку и заранее импортируют лексер, парсер и генератор кода,
+поэтому запуск интерпретатора и импорт оплачиваются один раз на процесс, а не на файл"""
+import io
+import os
+import copy
+import time
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+class BatchResult:
+	"""Результат компиляции одного файла"""
+	__slots__ = ("input_file", "output_file", "error", "time", "log")
+
+	def __init__(self, input_file: str, output_file: str):
+		self.input_file = input_file
+		self.output_file = output_file
+		self.error = None # Текст ошибки или None
+		self.time = 0.0 # Секунды
+		self.log = "" # Вывод компилятора (отчёты --stats, --run и т.д.)
+
+def read_manifest(path: str) -> List[Tuple[str, Optional[str]]]:
+	"""Файл со списком входных файлов: в каждой строке путь и, через пробел, необязательный путь
+	выходного файла. Пустые строки и строки, начинающиеся с #, пропускаются.
+	Относительные пути считаются от каталога манифеста"""
+	base = os.path.dirname(os.path.abspath(path))
+	entries = []
+
+	with open(path) as file:
+		for line in file:
+			fields = line.split()
+
+			if not fields or fields[0].startswith("#"):
+				continue
+
+			input_file = os.path.join(base, fields[0])
+			output_file = os.path.join(base, fields[1]) if len(fields) > 1 else None
+			entries.append((input_file, output_file))
+
+	return entries
+
+def output_path(input_file: str, flags) -> str:
+	"""Выходной файл по умолчанию: имя входного с расширением формата, в --output-dir или рядом"""
+	extension = ".bin" if flags.format == "bin16-raw" else ".asm"
+	name = os.path.splitext(os.path.basename(input_file))[0] + extension
+
+	return os.path.join(flags.output_dir or os.path.dirname(input_file), name)
+
+def file_flags(flags, output_file: str):
+	"""Флаги компиляции одного файла: выходные пути не должны пересекаться между файлами"""
+	flags = copy.copy(flags)
+	stem = os.path.splitext(output_file)[0]
+
+	flags.output_file = output_file
+
+	if flags.listing:
+		flags.listing = f"{stem}.lst"
+
+	if flags.profile:
+		flags.profile = os.path.join(flags.profile, os.path.basename(stem))
+
+	return flags
+
+def warm_up():
+	"""Инициализация рабочего процесса: импорт всех фаз компилятора до первого файла"""
+	import flatty
+	import arch.x86.modes.realmode
+	import arch.x86.calling
+	import arch.x86.generators
+	import arch.x86.peephole
+	import arch.x86.encoder
+
+def compile_file(input_file: str, flags) -> BatchResult:
+	"""Компиляция одного файла в рабочем процессе. Ошибка не прерывает пакет, а возвращается в результате"""
+	import flatty
+
+	result = BatchResult(input_file, flags.output_file)
+	log = io.StringIO()
+	start = time.perf_counter()
+
+	try:
+		with contextlib.redirect_stdout(log):
+			with open(input_file, "rb") as file:
+				flatty.compile(file.read(), flags)
+	except SystemExit:
+		# Генератор сообщает об ошибке через print и sys.exit
+		lines = log.getvalue().strip().splitlines()
+		result.error = lines[-1].removeprefix("error: ") if lines else "compilation aborted"
+	except Exception as error:
+		result.error = f"{type(error).__name__}: {error}"
+
+	result.time = time.perf_counter() - start
+	result.log = log.getvalue()
+
+	return result
+
+def duplicate_outputs(tasks: List[Tuple[str, object]]) -> dict:
+	"""Выходные файлы, в которые компилируется больше одного входного: выходной файл -> входные"""
+	owners = {}
+
+	for input_file, options in tasks:
+		owners.setdefault(os.path.normcase(os.path.abspath(options.output_file)), []).append(input_file)
+
+	return {output_file: inputs for output_file, inputs in owners.items() if len(inputs) > 1}
+
+def compile_batch(entries: List[Tuple[str, Optional[str]]], flags, jobs: int = None) -> List[BatchResult]:
+	"""Компиляция файлов в пуле процессов. Результаты идут в порядке входных файлов.
+	Если у нескольких файлов один выходной файл, ничего не компилируется: эти файлы получают ошибку"""
+	tasks = [
+		(input_file, file_flags(flags, output_file or output_path(input_file, flags)))
+		for input_file, output_file in entries
+	]
+
+	duplicates = duplicate_outputs(tasks)
+
+	if duplicates:
+		results = []
+
+		for input_file, options in tasks:
+			result = BatchResult(input_file, options.output_file)
+			inputs = duplicates.get(os.path.normcase(os.path.abspath(options.output_file)))
+
+			if inputs:
+				result.error = f"{options.output_file} is the output of several files: {', '.join(inputs)}"
+			else:
+				result.error = "not compiled: output file conflict"
+
+			results.append(result)
+
+		return results
+
+	if flags.output_dir:
+		os.makedirs(flags.output_dir, exist_ok=True)
+
+	jobs = min(jobs or os.cpu_count() or 1, len(tasks)) or 1
+
+	if jobs == 1:
+		return [compile_file(input_file, options) for input_file, options in tasks]
+
+	with ProcessPoolExecutor(max_workers=jobs, initializer=warm_up) as executor:
+		return list(executor.map(compile_file, *zip(*tasks)))
+
+def print_summary(results: List[BatchResult], elapsed: float):
+	"""Вывод компилятора и время каждого файла, ошибки и общее время"""
+	for result in results:
+		if result.log.strip():
+			print(f"== {result.input_file}")
+			print(result.log.rstrip())
+
+	width = max(len(result.input_file) for result in results)
+
+	print(f"{'file':<{width}}  {'time ms':>9}  result")
+
+	for result in results:
+		status = f"error: {result.error}" if result.error else result.output_file
+		print(f"{result.input_file:<{width}}  {result.time * 1000:>9.1f}  {status}")
+
+	failed = sum(result.error is not None for result in results)
+	total = sum(result.time for result in results)
+
+	print(f"{len(results)} files, {failed} failed, {total * 1000:.1f} ms compile time, {elapsed * 1000:.1f} ms wall time")
+
+def main(flags) -> int:
+	entries = [(input_file, None) for input_file in flags.input_file]
+
+	if flags.manifest:
+		entries += read_manifest(flags.manifest)
+
+	if not entries:
+		print("error: no input files")
+		return 1
+
+	if flags.output_file:
+		print("error: -o is ambiguous with several input files, use --output-dir or a manifest")
+		return 1
+
+	start = time.perf_counter()
+	results = compile_batch(entries, flags, flags.jobs)
+	print_summary(results, time.perf_counter() - start)
+
+	return 1 if any(result.error for result in results) else 0
@@ -0,0 +1,79 @@
+"""Прогон примеров в эмуляторе 8086: проверка результата и количество тактов.
+
+Запуск из каталога flatty: python -m benchmarks.cycles [-v]"""
+import os
+import sys
+import argparse
+import flatty
+from arch.x86.emulator import run, EmulatorError
+
+PROGRAMS = os.path.join(os.path.dirname(__file__), "programs")
+
+# Программа и ожидаемый результат: значения регистров и вывод через int 10h
+BENCHMARKS = [
+	("sum", {"ax": 3}, ""),
+	("max3", {"ax": 8}, ""),
+	("loop", {"ax": 55}, ""),
+	("hello", {}, "Hi"),
+	("locals", {"ax": 55}, ""),
+	("spill", {"ax": 279}, ""),
+	("arith", {"ax": 8322}, ""),
+	("liveness", {"ax": 1}, ""),
+	("saves", {"ax": 7}, ""),
+	("bigloop", {"ax": 61916}, ""),
+]
+
+# Наборы флагов компилятора, которые сравниваются между собой
+CONFIGURATIONS = [
+	("O0", ["-O", "0"]),
+	("O1", []),
+	("O1 regcall", ["--regcall"]),
+	("O1 unroll", ["--unroll"]),
+]
+
+def measure(name: str, options: list):
+	"""Компиляция и выполнение программы. Возвращает отчёт эмулятора"""
+	path = os.path.join(PROGRAMS, f"{name}.flt")
+	flags = flatty.argument_parser().parse_args([path, "-f", "bin16", *options])
+
+	with open(path) as file:
+		assembly = flatty.build(file.read(), flags)
+
+	return run(assembly)
+
+def main() -> int:
+	argument_parser = argparse.ArgumentParser()
+	argument_parser.add_argument("-v", "--verbose", action="store_true", help="Print per-function statistics")
+	args = argument_parser.parse_args()
+
+	failed = 0
+
+	print(f"{'program':<10}{'configuration':<16}{'instructions':>14}{'cycles':>10}  result")
+
+	for name, registers, output in BENCHMARKS:
+		for configuration, options in CONFIGURATIONS:
+			try:
+				report = measure(name, options)
+			except EmulatorError as error:
+				print(f"{name:<10}{configuration:<16}{'':>14}{'':>10}  error: {error}")
+				failed += 1
+				continue
+
+			wrong = [register for register, value in registers.items() if report.registers[register] != value]
+
+			if report.output != output:
+				wrong.append("output")
+
+			result = "ok" if not wrong else f"FAIL ({', '.join(wrong)})"
+			failed += bool(wrong)
+
+			print(f"{name:<10}{configuration:<16}{report.instructions:>14}{report.cycles:>10}  {result}")
+
+			if args.verbose:
+				print(report)
+				print("")
+
+	return 1 if failed else 0
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,97 @@
+"""Генератор синтетических программ на Flatty для замеров скорости компилятора"""
+import random
+from typing import List
+
+REGISTERS = ("bx", "cx", "dx", "si", "di")
+COMPARISONS = ("==", "!=", "<", ">", "<=", ">=")
+
+class ProgramGenerator:
+	"""Генерация программ по осям размера. Одинаковые seed и параметры дают одинаковый текст"""
+	def __init__(self, seed: int = 0):
+		self.random = random.Random(seed)
+
+	def program(self, functions: int = 1, nesting: int = 0, expression: int = 1, calls: int = 0, chain: bool = False) -> str:
+		"""functions - количество функций, nesting - глубина вложенности if / while / for,
+		expression - количество слагаемых в выражении операнда, calls - глубина вложенных вызовов в аргументах,
+		chain - функции вызывают друг друга по цепочке f0 -> f1 -> ..., main вызывает только f0"""
+		lines = []
+
+		for index in range(functions):
+			callee = f"f{index + 1}" if chain and index + 1 < functions else None
+			lines += self.function(index, nesting, expression, callee)
+
+		lines.append("func main() {")
+
+		# Каждая функция достижима из main
+		for index in range(1 if chain else functions):
+			lines.append(f"\tf{index}({self.number()}, {self.number()})")
+
+		if calls and functions:
+			lines.append(f"\tmov bx, {self.nested_call(calls, functions)}")
+
+		lines.append("}")
+		lines.append("")
+
+		return "\n".join(lines)
+
+	def number(self) -> int:
+		return self.random.randint(0, 100)
+
+	def register(self) -> str:
+		return self.random.choice(REGISTERS)
+
+	def expression(self, terms: int) -> str:
+		"""Константное выражение из terms слагаемых"""
+		parts = [str(self.number())]
+
+		for _ in range(terms - 1):
+			parts.append(self.random.choice("+-*"))
+			parts.append(str(self.number()))
+
+		return " ".join(parts)
+
+	def function(self, index: int, nesting: int, expression: int, callee: str = None) -> List[str]:
+		lines = [f"func f{index}(a, b) {{"]
+		lines.append("\tmov ax, a")
+		lines.append(f"\tadd ax, {self.expression(expression)}")
+		lines += self.block(nesting, 1)
+
+		# Следующая функция цепочки
+		if callee:
+			lines.append(f"\t{callee}(ax, {self.register()})")
+		lines.append("\tadd ax, b")
+		lines.append("}")
+		lines.append("")
+
+		return lines
+
+	def block(self, depth: int, indent: int) -> List[str]:
+		"""Вложенные операторы управления глубины depth"""
+		tab = "\t" * indent
+
+		if depth == 0:
+			return [f"{tab}inc {self.register()}"]
+
+		kind = ("if", "while", "for")[depth % 3]
+		register = self.register()
+		inner = self.block(depth - 1, indent + 1)
+
+		if kind == "if":
+			return (
+				[f"{tab}if ({register} {self.random.choice(COMPARISONS)} {self.number()}) {{"]
+				+ inner
+				+ [f"{tab}}} else {{", f"{tab}\tdec {register}", f"{tab}}}"]
+			)
+		elif kind == "while":
+			return [f"{tab}while ({register} < {self.number()}) {{"] + inner + [f"{tab}\tinc {register}", f"{tab}}}"]
+
+		return [f"{tab}for ({register} = 0; {register} < {self.number()}; {register}++) {{"] + inner + [f"{tab}}}"]
+
+	def nested_call(self, depth: int, functions: int) -> str:
+		"""Вызов, первый аргумент которого - вызов глубины depth - 1"""
+		name = f"f{self.random.randrange(functions)}"
+
+		if depth <= 1:
+			return f"{name}({self.number()}, {self.number()})"
+
+		return f"{name}({self.nested_call(depth - 1, functions)}, {self.number()})"
@@ -0,0 +1,235 @@
+"""Замеры скорости компилятора на синтетических программах растущего размера.
+
+Каждая фаза (препроцессор, лексер, парсер, проходы оптимизации, генератор, оптимизатор по окну)
+замеряется отдельно. Результаты сравниваются с сохранённой базовой линией: замер проваливается,
+если фаза стала медленнее или её время растёт быстрее размера программы.
+
+Запуск из каталога flatty: python -m benchmarks.throughput [--update-baseline]"""
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import tracemalloc
+from typing import Callable, Dict, List
+from preprocessor import Preprocessor
+from lexer import Lexer
+from parser import Parser
+from passes import ConstantFolder, Inliner, CallGraph, ClobberAnalysis, LoopOptimizer
+from arch.x86.modes.realmode import REGISTERS, OPCODES
+from arch.x86.calling import StackCallingConvention
+from arch.x86.generators import RealModeGenerator
+from arch.x86.peephole import PeepholeOptimizer
+from benchmarks.synthetic import ProgramGenerator
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+SEED = 2024
+
+# Оси размера: параметры генератора для каждого значения
+AXES = {
+	"functions": (lambda size: {"functions": size}, [250, 500, 1000, 2000]),
+	"nesting": (lambda size: {"functions": 4, "nesting": size}, [6, 12, 24]),
+	"expression": (lambda size: {"functions": 20, "expression": size}, [50, 100, 200]),
+	"calls": (lambda size: {"functions": 4, "calls": size}, [8, 16, 32]),
+	"chain": (lambda size: {"functions": size, "nesting": 1, "chain": True}, [250, 500, 1000, 2000]),
+}
+
+PHASES = ("preprocessor", "lexer", "parser", "passes", "generator", "peephole")
+
+TOLERANCE = 0.5 # Допустимое замедление относительно базовой линии
+GROWTH_LIMIT = 1.3 # Наибольший показатель степени роста времени от размера программы
+MIN_TIME = 0.005 # Более короткие замеры слишком шумные для сравнения
+
+def compile_phases(source: str) -> Dict[str, Callable]:
+	"""Фазы компиляции с -O1 в виде функций, каждая принимает результат предыдущей"""
+	state = {}
+
+	def preprocess(_):
+		state["preprocessor"] = Preprocessor(source)
+		return state["preprocessor"].preprocess()
+
+	def lex(code):
+		return list(Lexer(code, REGISTERS, OPCODES).tokenize())
+
+	def parse(tokens):
+		return Parser(tokens, state["preprocessor"].source_map).parse()
+
+	def optimize(program):
+		program = Inliner(program).inline()
+		program = ConstantFolder(program).fold()
+		call_graph = CallGraph(program)
+		call_graph.eliminate_dead()
+		program = LoopOptimizer(program, call_graph).optimize()
+
+		state["convention"] = StackCallingConvention(program)
+		state["clobbers"] = ClobberAnalysis(program, call_graph, state["convention"]).analyze()
+
+		# Глубина стека для --callgraph обходит весь граф вызовов
+		call_graph.stack_depth(state["convention"], clobbers=state["clobbers"])
+
+		return program
+
+	def generate(program):
+		return RealModeGenerator(
+			program, state["convention"],
+			tail_calls=True,
+			clobbers=state["clobbers"],
+			switch_tables=True,
+			strength_reduction=True
+		).generate()
+
+	def peephole(assembly):
+		return PeepholeOptimizer(assembly).optimize()
+
+	return dict(zip(PHASES, (preprocess, lex, parse, optimize, generate, peephole)))
+
+def time_phases(source: str, repeat: int) -> Dict[str, float]:
+	"""Наименьшее время каждой фазы за repeat прогонов"""
+	best = {phase: math.inf for phase in PHASES}
+
+	for _ in range(repeat):
+		result = None
+
+		for phase, function in compile_phases(source).items():
+			start = time.perf_counter()
+			result = function(result)
+			best[phase] = min(best[phase], time.perf_counter() - start)
+
+	return best
+
+def peak_memory(source: str) -> Dict[str, int]:
+	"""Пиковое выделение памяти в байтах для каждой фазы"""
+	peaks = {}
+	result = None
+
+	tracemalloc.start()
+
+	try:
+		for phase, function in compile_phases(source).items():
+			tracemalloc.reset_peak()
+			result = function(result)
+			peaks[phase] = tracemalloc.get_traced_memory()[1]
+	finally:
+		tracemalloc.stop()
+
+	return peaks
+
+def measure(repeat: int, axes: List[str]) -> dict:
+	"""Замеры по всем осям и размерам"""
+	results = {}
+
+	for axis in axes:
+		parameters, sizes = AXES[axis]
+		results[axis] = {}
+
+		for size in sizes:
+			source = ProgramGenerator(SEED).program(**parameters(size))
+
+			results[axis][str(size)] = {
+				"bytes": len(source),
+				"time": time_phases(source, repeat),
+				"memory": peak_memory(source),
+			}
+
+	return results
+
+def growth_exponent(sizes: List[float], times: List[float]) -> float:
+	"""Наклон прямой log(время) от log(размер) по методу наименьших квадратов"""
+	xs = [math.log(size) for size in sizes]
+	ys = [math.log(max(value, 1e-9)) for value in times]
+	mean_x = sum(xs) / len(xs)
+	mean_y = sum(ys) / len(ys)
+
+	return (
+		sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys))
+		/ sum((x - mean_x) ** 2 for x in xs)
+	)
+
+def growth_failures(results: dict) -> List[str]:
+	"""Фазы, время которых растёт быстрее размера исходного кода"""
+	failures = []
+
+	for axis, sizes in results.items():
+		runs = list(sizes.values())
+
+		if len(runs) < 2 or runs[-1]["bytes"] <= runs[0]["bytes"]:
+			continue
+
+		for phase in PHASES:
+			# Короткие замеры слишком шумные
+			if runs[-1]["time"][phase] < MIN_TIME:
+				continue
+
+			exponent = growth_exponent([run["bytes"] for run in runs], [run["time"][phase] for run in runs])
+
+			if exponent > GROWTH_LIMIT:
+				failures.append(f"{axis}/{phase}: time grows as n^{exponent:.2f}")
+
+	return failures
+
+def regression_failures(results: dict, baseline: dict, tolerance: float) -> List[str]:
+	"""Фазы, которые стали медленнее базовой линии или используют больше памяти"""
+	failures = []
+
+	for axis, sizes in results.items():
+		for size, run in sizes.items():
+			reference = baseline.get(axis, {}).get(size)
+
+			if reference is None:
+				continue
+
+			for phase in PHASES:
+				current, previous = run["time"][phase], reference["time"].get(phase)
+
+				if previous is not None and current >= MIN_TIME and current > previous * (1 + tolerance):
+					failures.append(f"{axis}/{size}/{phase}: {current * 1000:.1f} ms, baseline {previous * 1000:.1f} ms")
+
+				current, previous = run["memory"][phase], reference["memory"].get(phase)
+
+				if previous is not None and current > previous * (1 + tolerance):
+					failures.append(f"{axis}/{size}/{phase}: peak memory {current // 1024} KiB, baseline {previous // 1024} KiB")
+
+	return failures
+
+def print_results(results: dict):
+	print(f"{'axis':<12}{'size':>6}{'bytes':>9}" + "".join(f"{phase:>14}" for phase in PHASES) + f"{'peak KiB':>10}")
+
+	for axis, sizes in results.items():
+		for size, run in sizes.items():
+			times = "".join(f"{run['time'][phase] * 1000:>12.1f}ms" for phase in PHASES)
+			print(f"{axis:<12}{size:>6}{run['bytes']:>9}{times}{max(run['memory'].values()) // 1024:>10}")
+
+def main() -> int:
+	argument_parser = argparse.ArgumentParser()
+	argument_parser.add_argument("--baseline", type=str, default=BASELINE, help="Baseline JSON file")
+	argument_parser.add_argument("--update-baseline", action="store_true", help="Write current results as the new baseline")
+	argument_parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="Allowed slowdown relative to baseline (0.5 - 50%%)")
+	argument_parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement, the fastest is kept")
+	argument_parser.add_argument("--axis", action="append", choices=list(AXES), help="Measure only the given axis")
+	args = argument_parser.parse_args()
+
+	results = measure(args.repeat, args.axis or list(AXES))
+	print_results(results)
+
+	failures = growth_failures(results)
+
+	if args.update_baseline:
+		with open(args.baseline, "w") as file:
+			json.dump(results, file, indent="\t")
+			file.write("\n")
+
+		print(f"baseline written to {args.baseline}")
+	elif os.path.exists(args.baseline):
+		with open(args.baseline) as file:
+			failures += regression_failures(results, json.load(file), args.tolerance)
+	else:
+		print(f"no baseline at {args.baseline}, run with --update-baseline to create it")
+
+	for failure in failures:
+		print(f"FAIL {failure}")
+
+	return 1 if failures else 0
+
+if __name__ == "__main__":
+	sys.exit(main())
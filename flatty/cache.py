@@ -0,0 +1,293 @@
+import os
+import json
+import hashlib
+from collections import OrderedDict
+from typing import Dict, Iterable, Iterator, List, Optional
+from arch.x86.assembly import AsmInstruction, AsmLabel, AsmDirective
+
+CACHE_VERSION = 1 # Формат записей кэша
+CACHE_SIZE = 64 # Размер кэша по умолчанию в мегабайтах
+MEMORY_ENTRIES = 100000 # Наибольшее количество функций в кэше в памяти
+
+_compiler_digest = None
+
+def compiler_digest() -> str:
+	"""Хэш исходного кода компилятора: после его изменения старые записи не используются"""
+	global _compiler_digest
+
+	if _compiler_digest is None:
+		root = os.path.dirname(os.path.abspath(__file__))
+		digest = hashlib.sha256()
+
+		for directory, names, files in sorted(os.walk(root)):
+			names[:] = sorted(name for name in names if name not in ("benchmarks", "__pycache__"))
+
+			for name in sorted(files):
+				if name.endswith(".py"):
+					with open(os.path.join(directory, name), "rb") as file:
+						digest.update(os.path.relpath(os.path.join(directory, name), root).encode())
+						digest.update(file.read())
+
+		_compiler_digest = digest.hexdigest()
+
+	return _compiler_digest
+
+class FunctionDigests:
+	"""Хэши нормализованных потоков токенов функций (без номеров строк и столбцов)"""
+	def __init__(self):
+		self.digests = {} # Имя функции -> хэш
+
+	def observe(self, tokens: Iterable) -> Iterator:
+		"""Пропустить поток токенов через себя, не собирая его в памяти"""
+		digest = None
+		name = None
+		expect_name = False
+		depth = 0
+		newline = False
+
+		for token in tokens:
+			group, value = token[:2]
+
+			if depth == 0 and group == "KEYWORD" and value in ("func", "noinline"):
+				if digest is None:
+					digest = hashlib.sha256()
+
+				expect_name = value == "func"
+			elif expect_name:
+				name = value
+				expect_name = False
+
+			if digest is not None:
+				# Повторные переводы строк не меняют программу
+				if group != "NEW_LINE" or not newline:
+					digest.update(f"{group}\0{value}\0".encode())
+
+				newline = group == "NEW_LINE"
+
+			if group == "LBRACE":
+				depth += 1
+			elif group == "RBRACE":
+				depth -= 1
+
+				if depth == 0 and digest is not None:
+					self.digests[name] = digest.hexdigest()
+					digest = None
+					name = None
+
+			yield token
+
+def function_keys(program, digests: FunctionDigests, call_graph, convention, clobbers, settings: tuple) -> Dict[str, str]:
+	"""Ключи кэша для функций программы.
+
+	Ключ функции зависит от её токенов, от токенов всех функций, которые она вызывает
+	до встраивания (call_graph), от размещения параметров, портящихся и живых при входе регистров этих функций,
+	от имени следующей функции (переход в конец функции на следующую удаляется) и от настроек"""
+	names = [func.name for func in program.functions]
+	keys = {}
+
+	for index, name in enumerate(names):
+		related = sorted(call_graph.closure(name)) if name in call_graph.functions else [name]
+
+		signatures = []
+
+		for other in related:
+			layout = convention.layout(other)
+			signatures.append([
+				other,
+				digests.digests.get(other),
+				layout.registers,
+				layout.stack_index,
+				sorted(clobbers.clobbers.get(other, ())) if clobbers else None,
+				sorted(clobbers.live_on_entry.get(other, ())) if clobbers else None,
+			])
+
+		description = json.dumps([
+			CACHE_VERSION,
+			compiler_digest(),
+			list(settings),
+			name,
+			signatures,
+			names[index + 1] if index + 1 < len(names) else None,
+		])
+
+		keys[name] = hashlib.sha256(description.encode()).hexdigest()
+
+	return keys
+
+def encode_items(items: List) -> list:
+	result = []
+
+	for item in items:
+		if isinstance(item, AsmInstruction):
+			result.append(["i", item.opcode, item.operands])
+		elif isinstance(item, AsmLabel):
+			result.append(["l", item.name])
+		else:
+			result.append(["d", item.text])
+
+	return result
+
+def decode_items(data: list) -> List:
+	items = []
+
+	for kind, *fields in data:
+		if kind == "i":
+			opcode, operands = fields
+			items.append(AsmInstruction(opcode, list(operands)))
+		elif kind == "l":
+			items.append(AsmLabel(*fields))
+		elif kind == "d":
+			items.append(AsmDirective(*fields))
+		else:
+			raise ValueError(f"unknown item kind {kind}")
+
+	return items
+
+class CompilationCache:
+	"""Кэш сгенерированного кода функций на диске. Записи адресуются ключом функции,
+	при превышении размера удаляются давно не использованные записи (по времени доступа)"""
+	def __init__(self, directory: str, limit: int = CACHE_SIZE * 1024 * 1024):
+		self.directory = directory
+		self.limit = limit # Наибольший размер кэша в байтах
+		self.hits = 0
+		self.misses = 0
+		self.corrupt = 0 # Повреждённые или устаревшие записи, они удаляются
+		self.stored = 0
+		self.evicted = 0
+
+	def path(self, key: str) -> str:
+		return os.path.join(self.directory, key[:2], key)
+
+	def load(self, key: str) -> Optional[List]:
+		"""Код функции по ключу или None"""
+		path = self.path(key)
+
+		try:
+			with open(path, "rb") as file:
+				data = file.read()
+		except OSError:
+			self.misses += 1
+			return None
+
+		try:
+			entry = json.loads(data)
+			payload = json.dumps(entry["items"], separators=(",", ":"))
+
+			if (entry["version"] != CACHE_VERSION
+				or entry["key"] != key
+				or entry["checksum"] != hashlib.sha256(payload.encode()).hexdigest()
+			):
+				raise ValueError("stale entry")
+
+			items = decode_items(entry["items"])
+		except (ValueError, KeyError, TypeError):
+			self.corrupt += 1
+			self.misses += 1
+			self.remove(path)
+			return None
+
+		# Время доступа обновляется явно: файловая система может быть смонтирована с noatime
+		try:
+			os.utime(path)
+		except OSError:
+			pass
+
+		self.hits += 1
+
+		return items
+
+	def store(self, key: str, items: List):
+		"""Сохранить код функции. Запись атомарна: файл записывается целиком и переименовывается"""
+		path = self.path(key)
+		data = encode_items(items)
+		payload = json.dumps(data, separators=(",", ":"))
+		entry = json.dumps({
+			"version": CACHE_VERSION,
+			"key": key,
+			"checksum": hashlib.sha256(payload.encode()).hexdigest(),
+			"items": data,
+		}, separators=(",", ":"))
+
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		temporary = f"{path}.{os.getpid()}.tmp"
+
+		with open(temporary, "w") as file:
+			file.write(entry)
+
+		os.replace(temporary, path)
+		self.stored += 1
+
+	def remove(self, path: str):
+		try:
+			os.remove(path)
+		except OSError:
+			pass
+
+	def evict(self):
+		"""Удалить давно не использованные записи, пока размер кэша больше предела"""
+		entries = []
+		total = 0
+
+		for directory, _, files in os.walk(self.directory):
+			for name in files:
+				path = os.path.join(directory, name)
+
+				try:
+					status = os.stat(path)
+				except OSError:
+					continue
+
+				entries.append((status.st_mtime, status.st_size, path))
+				total += status.st_size
+
+		for _, size, path in sorted(entries):
+			if total <= self.limit:
+				break
+
+			self.remove(path)
+			total -= size
+			self.evicted += 1
+
+	def finish(self):
+		if self.stored:
+			self.evict()
+
+	def __repr__(self):
+		return (f"Cache: {self.hits} hits, {self.misses} misses, "
+			f"{self.corrupt} corrupt or stale, {self.evicted} evicted")
+
+class MemoryCache:
+	"""Кэш кода функций в памяти процесса (сервер компиляции). Тот же интерфейс, что у CompilationCache.
+	Код хранится в сериализованном виде: оптимизатор по окну изменяет инструкции на месте"""
+	def __init__(self, limit: int = MEMORY_ENTRIES):
+		self.entries = OrderedDict() # Ключ -> элементы секции, от давно использованных к недавним
+		self.limit = limit
+		self.hits = 0
+		self.misses = 0
+		self.corrupt = 0
+		self.evicted = 0
+
+	def load(self, key: str) -> Optional[List]:
+		data = self.entries.get(key)
+
+		if data is None:
+			self.misses += 1
+			return None
+
+		self.entries.move_to_end(key)
+		self.hits += 1
+
+		return decode_items(data)
+
+	def store(self, key: str, items: List):
+		self.entries[key] = encode_items(items)
+		self.entries.move_to_end(key)
+
+	def finish(self):
+		while len(self.entries) > self.limit:
+			self.entries.popitem(last=False)
+			self.evicted += 1
+
+	def __repr__(self):
+		return (f"Cache: {self.hits} hits, {self.misses} misses, "
+			f"{len(self.entries)} functions in memory, {self.evicted} evicted")
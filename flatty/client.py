@@ -0,0 +1,66 @@
+"""Тонкий клиент сервера компиляции (flatty.py serve).
+
+Передаёт аргументы командной строки серверу через Unix сокет и печатает ответ. Если сервер
+не запущен или сокет принадлежит другому пользователю, компилирует в своём процессе. Модули компилятора импортируются только в этом случае:
+клиент запускается за время старта интерпретатора.
+
+Протокол: одна строка JSON в каждую сторону.
+Запрос: {"argv": [...], "cwd": "..."}. Ответ: {"status": код, "stdout": "...", "stderr": "..."}"""
+import os
+import sys
+import json
+import stat
+import socket
+
+def default_socket() -> str:
+	"""Путь сокета: переменная окружения FLATTY_SOCKET или файл во временном каталоге пользователя"""
+	return os.environ.get("FLATTY_SOCKET") or os.path.join(
+		os.environ.get("XDG_RUNTIME_DIR") or "/tmp",
+		f"flatty-{os.getuid()}.sock"
+	)
+
+def trusted_socket(path: str) -> bool:
+	"""Сокет создан текущим пользователем. Сокет в /tmp мог заранее создать другой пользователь,
+	чтобы получить аргументы и каталог клиента и вернуть поддельный ответ"""
+	try:
+		info = os.lstat(path)
+	except OSError:
+		return False
+
+	return stat.S_ISSOCK(info.st_mode) and info.st_uid == os.getuid()
+
+def request(path: str, message: dict) -> dict:
+	"""Отправить запрос серверу и дождаться ответа"""
+	with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+		connection.connect(path)
+		connection.sendall(json.dumps(message).encode() + b"\n")
+
+		with connection.makefile("rb") as stream:
+			line = stream.readline()
+
+	if not line:
+		raise ConnectionError("server closed the connection")
+
+	return json.loads(line)
+
+def main(argv=None) -> int:
+	argv = sys.argv[1:] if argv is None else argv
+	path = default_socket()
+
+	try:
+		if not trusted_socket(path):
+			raise ConnectionError("no server socket owned by the current user")
+
+		response = request(path, {"argv": argv, "cwd": os.getcwd()})
+	except (OSError, ValueError):
+		# Сервер не запущен или сокет чужой: компиляция в этом процессе
+		import flatty
+		return flatty.main(argv)
+
+	sys.stdout.write(response["stdout"])
+	sys.stderr.write(response["stderr"])
+
+	return response["status"]
+
+if __name__ == "__main__":
+	sys.exit(main())
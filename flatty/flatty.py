@@ -1,24 +1,45 @@
 import os
 import sys
+import mmap
 import argparse
+from typing import List
 from preprocessor import Preprocessor
 from lexer import Lexer
 from parser import Parser
+from passes import ConstantFolder, Inliner, CallGraph, ClobberAnalysis, LoopOptimizer, RegisterAllocator, INLINE_THRESHOLD
 from arch.x86.generators import RealModeGenerator
+from arch.x86.assembly import AsmBuffer, AsmInstruction
+from passes.walk import count_nodes
+from instrumentation import Instrumentation, DUMP_FORMS
+from cache import CompilationCache, FunctionDigests, function_keys, CACHE_SIZE
 
-DEBUG = True
+def program_size(program) -> int:
+	"""Количество узлов AST программы"""
+	return sum(1 + count_nodes(func.body) for func in program.functions)
+
+def assembly_size(assembly: AsmBuffer):
+	"""Количество инструкций и оценка размера кода в байтах"""
+	from arch.x86.peephole import section_sizes
+
+	instructions = sum(
+		isinstance(item, AsmInstruction)
+		for section in [assembly.header] + assembly.sections
+		for item in section.items
+	)
+
+	return instructions, sum(section_sizes(assembly).values())
+
+def build(code, flags, instrumentation: Instrumentation = None, cache: CompilationCache = None) -> AsmBuffer:
+	"""Компиляция исходного кода в буфер ассемблера.
+	С кэшем генерируется код только тех функций, которые изменились сами или через вызываемые"""
+	instrumentation = instrumentation or Instrumentation()
+	phase = instrumentation.phase
 
-def compile(code, flags):
 	# Препроцессинг
 	preprocessor = Preprocessor(code)
-	code = preprocessor.preprocess()
+	code = instrumentation.stream("preprocessor", preprocessor.stream(), dump="source", end="")
 
-	if DEBUG:
-		print("Preprocessor:")
-		print(code)
-		print("")
-
-	if flags.format == "bin16":
+	if flags.format in ("bin16", "bin16-raw"):
 		from arch.x86.modes.realmode import REGISTERS, OPCODES
 	else:
 		print("error: unknown format output file")
@@ -26,39 +47,249 @@ def compile(code, flags):
 
 	# Токенизация
 	lexer = Lexer(code, REGISTERS, OPCODES)
-	tokens = lexer.tokenize()
+	tokens = instrumentation.stream("lexer", lexer.tokenize(), dump="tokens", count="tokens")
 
-	if DEBUG:
-		print("Tokens:")
-		print(tokens)
-		print("")
+	if cache:
+		digests = FunctionDigests()
+		tokens = digests.observe(tokens)
 
 	# Парсинг
-	parser = Parser(tokens)
-	program = parser.parse()
+	with phase("parser"):
+		parser = Parser(tokens, preprocessor.source_map)
+		program = parser.parse()
 
-	if DEBUG:
-		print("AST:")
-		print(program)
-		print("")
+	if cache:
+		# Зависимости функций до встраивания: встроенный код тоже входит в ключ
+		dependencies = CallGraph(program)
+
+	# Вызовы несуществующих функций и с неверным числом аргументов: все ошибки до генерации кода
+	with phase("symbols"):
+		errors = parser.symbols.check(program)
+
+	if errors:
+		for error in errors:
+			print(f"error: {error}")
+
+		sys.exit(1)
+
+	if instrumentation.enabled:
+		instrumentation.count("preprocessor", "lines", len(preprocessor.source_map))
+		instrumentation.count("parser", "nodes", program_size(program))
+
+	# Встраивание маленьких функций
+	if flags.optimize > 0 and flags.inline_threshold > 0:
+		with phase("inliner"):
+			inliner = Inliner(program, flags.inline_threshold)
+			program = inliner.inline()
+
+		instrumentation.count("inliner", "inlined", inliner.inlined)
+
+	# Свёртка константных выражений
+	with phase("constant folding"):
+		folder = ConstantFolder(program)
+		program = folder.fold()
+
+	instrumentation.count("constant folding", "folded", folder.folded)
+
+	# Удаление функций, недостижимых из main
+	with phase("call graph"):
+		call_graph = CallGraph(program)
+
+		if flags.optimize > 0:
+			instrumentation.count("call graph", "removed", len(call_graph.eliminate_dead()))
 
-	if flags.format == "bin16":
-		generator = RealModeGenerator(program)
+	# Регистры и ячейки стека для локальных переменных
+	with phase("allocator"):
+		allocator = RegisterAllocator(program, call_graph)
+		program = allocator.allocate()
+
+	if instrumentation.enabled:
+		allocations = allocator.functions.values()
+		instrumentation.count("allocator", "variables", sum(len(allocation.intervals) for allocation in allocations))
+		instrumentation.count("allocator", "spilled", sum(len(allocation.spilled) for allocation in allocations))
+
+	if flags.optimize > 0:
+		# Оптимизация циклов
+		with phase("loops"):
+			loop_optimizer = LoopOptimizer(program, call_graph, flags.unroll)
+			program = loop_optimizer.optimize()
+
+		for key, value in loop_optimizer.stats.items():
+			instrumentation.count("loops", key, value)
+
+	if instrumentation.enabled:
+		instrumentation.count("loops" if flags.optimize > 0 else "call graph", "nodes", program_size(program))
+
+	instrumentation.write_dump("ast", program.functions)
+
+	if flags.format in ("bin16", "bin16-raw"):
+		if flags.regcall:
+			from arch.x86.calling import RegisterCallingConvention
+			convention = RegisterCallingConvention(program)
+		else:
+			from arch.x86.calling import StackCallingConvention
+			convention = StackCallingConvention(program)
+
+		with phase("clobbers"):
+			clobbers = ClobberAnalysis(program, call_graph, convention).analyze()
+
+		generator = RealModeGenerator(
+			program, convention,
+			tail_calls=flags.optimize > 0,
+			clobbers=clobbers,
+			switch_tables=flags.optimize > 0,
+			symbols=parser.symbols,
+			allocation=allocator,
+			strength_reduction=flags.optimize > 0
+		)
 	else:
 		print("error: unknown format output file")
 		sys.exit()
 
-	assembly = generator.generate()
+	reuse = {}
+
+	if cache:
+		with phase("cache"):
+			settings = (flags.format, flags.optimize, flags.inline_threshold, flags.unroll, flags.regcall)
+			keys = function_keys(program, digests, dependencies, convention, clobbers, settings)
+
+			for name, key in keys.items():
+				items = cache.load(key)
+
+				if items is not None:
+					reuse[name] = items
+
+	with phase("generator"):
+		assembly = generator.generate(reuse)
+
+	if instrumentation.enabled:
+		instructions, size = assembly_size(assembly)
+		instrumentation.count("generator", "instructions", instructions)
+		instrumentation.count("generator", "bytes", size)
+
+	if flags.alloc_report:
+		print("Register allocation:")
+
+		for allocation in allocator.functions.values():
+			print(allocation.describe())
 
-	if DEBUG:
-		print("Assembly:")
-		print(assembly)
 		print("")
 
-	with open(flags.output_file, "w") as file:
-		file.write(assembly)
+	if flags.switch_report:
+		print("Switch chains:")
 
-if __name__ == "__main__":
+		for line in generator.switches:
+			print(line)
+
+		print("")
+
+	# Оптимизация по окну
+	if flags.optimize > 0:
+		from arch.x86.peephole import PeepholeOptimizer
+
+		with phase("peephole"):
+			optimizer = PeepholeOptimizer(assembly, cached=set(reuse))
+			assembly = optimizer.optimize()
+
+		if instrumentation.enabled:
+			instructions, size = assembly_size(assembly)
+			instrumentation.count("peephole", "removed", optimizer.stats.instructions_removed)
+			instrumentation.count("peephole", "instructions", instructions)
+			instrumentation.count("peephole", "bytes", size)
+
+	if cache:
+		with phase("cache"):
+			for section in assembly.sections:
+				if section.name in keys and section.name not in reuse:
+					cache.store(keys[section.name], section.items)
+
+			cache.finish()
+
+		for counter in ("hits", "misses", "corrupt", "evicted"):
+			instrumentation.count("cache", counter, getattr(cache, counter))
+
+	if flags.callgraph:
+		from arch.x86.peephole import section_sizes
+		print(call_graph.dump(convention, section_sizes(assembly), allocator.frames(), clobbers=clobbers))
+
+	instrumentation.write_dump("asm", assembly.lines())
+
+	return assembly
+
+def compile(code, flags, cache=None):
+	"""Компиляция и запись выходного файла. Без --cache используется переданный кэш (если есть)"""
+	instrumentation = Instrumentation(
+		stats=flags.stats,
+		profile=flags.profile,
+		dump=flags.dump,
+		dump_prefix=os.path.splitext(flags.output_file or "out")[0]
+	)
+
+	# sys.exit при ошибке не должен оставлять tracemalloc и профилировщики включёнными
+	try:
+		if flags.cache:
+			cache = CompilationCache(flags.cache, flags.cache_size * 1024 * 1024)
+
+		assembly = build(code, flags, instrumentation, cache)
+
+		if flags.cache:
+			print(cache)
+
+		if flags.run:
+			# Выполнение в эмуляторе 8086: вывод, регистры, инструкции и такты по функциям
+			from arch.x86.emulator import run, EmulatorError
+			from arch.x86.encoder import EncoderError
+
+			try:
+				with instrumentation.phase("emulator"):
+					report = run(assembly, flags.org)
+			except (EmulatorError, EncoderError) as error:
+				print(f"error: {error}")
+				sys.exit(1)
+
+			print(report)
+
+		if flags.format == "bin16-raw":
+			# Сборка в плоский двоичный образ без внешнего ассемблера
+			from arch.x86.encoder import Encoder, EncoderError
+
+			try:
+				with instrumentation.phase("encoder"):
+					encoder = Encoder(assembly, flags.org)
+					binary = encoder.assemble()
+			except EncoderError as error:
+				print(f"error: {error}")
+				sys.exit(1)
+
+			instrumentation.count("encoder", "bytes", len(binary))
+			instrumentation.count("encoder", "relaxed", encoder.relaxed)
+
+			with open(flags.output_file or "out.bin", "wb") as file:
+				file.write(binary)
+
+			if flags.listing:
+				with open(flags.listing, "w") as file:
+					encoder.write_listing(file)
+		else:
+			with open(flags.output_file or "out.asm", "w") as file:
+				assembly.write(file)
+	finally:
+		instrumentation.stop()
+
+	instrumentation.finish()
+
+def dump_forms(value: str) -> list:
+	"""Список промежуточных представлений для --dump"""
+	forms = [form for form in value.split(",") if form]
+
+	for form in forms:
+		if form not in DUMP_FORMS:
+			raise argparse.ArgumentTypeError(f"unknown form {form} (expected {", ".join(DUMP_FORMS)})")
+
+	return forms
+
+def argument_parser() -> argparse.ArgumentParser:
+	"""Аргументы командной строки"""
 	if sys.platform == "windows":
 		default_format = "win32"
 	elif sys.platform == "linux":
@@ -66,19 +297,61 @@ if __name__ == "__main__":
 	else:
 		default_format = "elf64"
 
-	argument_parser = argparse.ArgumentParser()
+	parser = argparse.ArgumentParser()
 
-	argument_parser.add_argument("input_file", type=str, help="Input file")
-	argument_parser.add_argument("-f", "--format", type=str, default=default_format, help="Format output file")
-	argument_parser.add_argument("-o", "--output-file", type=str, default="out.asm", help="Output file")
+	parser.add_argument("input_file", type=str, nargs="*", help="Input files, several files are compiled in parallel")
+	parser.add_argument("--manifest", type=str, default=None, help="File with input files to compile in parallel, one per line with optional output file")
+	parser.add_argument("-j", "--jobs", type=int, default=None, help="Worker processes for several input files (default - number of cores)")
+	parser.add_argument("--output-dir", type=str, default=None, help="Directory for output files of several input files")
+	parser.add_argument("-f", "--format", type=str, default=default_format, help="Format output file")
+	parser.add_argument("-o", "--output-file", type=str, default=None, help="Output file (out.asm, or out.bin for bin16-raw)")
+	parser.add_argument("--listing", type=str, default=None, help="Listing file with addresses and encodings (bin16-raw)")
+	parser.add_argument("--org", type=lambda value: int(value, 0), default=0, help="Load address of the binary image (bin16-raw)")
+	parser.add_argument("-O", "--optimize", type=int, default=1, help="Optimization level (0 - disabled)")
+	parser.add_argument("--regcall", action="store_true", help="Pass arguments in registers where possible")
+	parser.add_argument("--callgraph", action="store_true", help="Print call graph with function sizes and stack depth")
+	parser.add_argument("--alloc-report", action="store_true", help="Print register pressure, spills and location of local variables of each function")
+	parser.add_argument("--switch-report", action="store_true", help="Print how each elseif chain over one register is dispatched")
+	parser.add_argument("--unroll", action="store_true", help="Unroll loops with small constant trip count")
+	parser.add_argument("--run", action="store_true", help="Run the program in the 8086 emulator and print instruction and cycle counts")
+	parser.add_argument("--inline-threshold", type=int, default=INLINE_THRESHOLD, help="Maximum size of inlined function (0 - disable inlining)")
+	parser.add_argument("--cache", type=str, nargs="?", const=".flatty-cache", default=None, help="Reuse generated code of unchanged functions from the cache directory")
+	parser.add_argument("--cache-size", type=int, default=CACHE_SIZE, help="Cache size limit in megabytes, least recently used entries are removed")
+	parser.add_argument("--stats", action="store_true", help="Print time, allocations and output size of each compilation phase")
+	parser.add_argument("--profile", type=str, nargs="?", const="profile", default=None, help="Write cProfile statistics and trace events of each phase to the directory")
+	parser.add_argument("--dump", type=dump_forms, default=[], help=f"Write intermediate forms next to the output file ({", ".join(DUMP_FORMS)})")
 
-	args = argument_parser.parse_args()
+	return parser
 
-	if not os.path.exists(args.input_file):
-		print(f"Error: file {args.input_file} not exists")
-		sys.exit()
+def main(argv: List[str] = None, cache=None) -> int:
+	"""Командная строка. cache - кэш функций в памяти (сервер компиляции)"""
+	argv = sys.argv[1:] if argv is None else argv
 
-	with open(args.input_file, "r") as file:
-		code = file.read()
+	if argv[:1] == ["serve"]:
+		import server
+		return server.main(argv[1:])
 
-	compile(code, args)
\ No newline at end of file
+	args = argument_parser().parse_args(argv)
+
+	if args.manifest or len(args.input_file) != 1:
+		import batch
+		return batch.main(args)
+
+	input_file = args.input_file[0]
+
+	if not os.path.exists(input_file):
+		print(f"Error: file {input_file} not exists")
+		return 1
+
+	with open(input_file, "rb") as file:
+		if os.fstat(file.fileno()).st_size == 0:
+			code = b""
+		else:
+			code = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+		compile(code, args, cache)
+
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,209 @@
+import os
+import json
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Iterable, Iterator, List, TextIO
+
+DUMP_FORMS = ("source", "tokens", "ast", "asm") # Промежуточные представления для --dump
+
+class PhaseStats:
+	"""Статистика фазы компиляции. Время и память считаются без вложенных фаз"""
+	__slots__ = ("time", "allocated", "peak", "counts")
+
+	def __init__(self):
+		self.time = 0.0 # Секунды
+		self.allocated = 0 # Прирост выделенной памяти в байтах
+		self.peak = 0 # Пиковое выделение памяти в байтах
+		self.counts = {} # Размер результата: токены, узлы AST, инструкции, байты
+
+class Instrumentation:
+	"""Замеры фаз компиляции: время, память, размеры результатов, профилирование и дампы.
+
+	Выключенная инструментация ничего не делает: phase() возвращает пустой контекст,
+	stream() возвращает поток без обёртки. Токены и строки препроцессора обрабатываются
+	потоком, поэтому время переключается между фазами при каждой выдаче элемента"""
+	def __init__(self, stats: bool = False, profile: str = None, dump: List[str] = None, dump_prefix: str = "out"):
+		self.stats = stats
+		self.profile = profile # Каталог для cProfile и trace events
+		self.dump = frozenset(dump or ())
+		self.dump_prefix = dump_prefix
+		self.enabled = stats or profile is not None
+		self.phases = {} # Имя фазы -> PhaseStats в порядке первого входа
+		self.current = None # Фаза, которой сейчас засчитывается время
+		self.clock = 0.0
+		self.memory = 0
+		self.profilers = {}
+		self.events = [] # Trace events (формат Chrome trace)
+		self.origin = time.perf_counter()
+
+		if self.stats:
+			import tracemalloc
+			self.tracemalloc = tracemalloc
+			tracemalloc.start()
+
+	def switch(self, name: str) -> str:
+		"""Засчитать прошедшее время текущей фазе и перейти к фазе name. Возвращает прежнюю фазу"""
+		now = time.perf_counter()
+		previous = self.current
+
+		if previous is not None:
+			stats = self.phases[previous]
+			stats.time += now - self.clock
+
+			if self.stats:
+				current, peak = self.tracemalloc.get_traced_memory()
+				stats.allocated += current - self.memory
+				stats.peak = max(stats.peak, peak)
+
+			if previous in self.profilers:
+				self.profilers[previous].disable()
+
+		if name is not None:
+			if name not in self.phases:
+				self.phases[name] = PhaseStats()
+
+			if self.profile is not None:
+				if name not in self.profilers:
+					import cProfile
+					self.profilers[name] = cProfile.Profile()
+
+				self.profilers[name].enable()
+
+		if self.stats:
+			self.tracemalloc.reset_peak()
+			self.memory = self.tracemalloc.get_traced_memory()[0]
+
+		self.current = name
+		self.clock = time.perf_counter()
+
+		return previous
+
+	def phase(self, name: str):
+		"""Контекст фазы компиляции"""
+		if not self.enabled:
+			return nullcontext()
+
+		return self.measure(name)
+
+	@contextmanager
+	def measure(self, name: str):
+		start = time.perf_counter()
+		previous = self.switch(name)
+
+		try:
+			yield
+		finally:
+			self.switch(previous)
+			self.event(name, start, time.perf_counter())
+
+	def stream(self, name: str, items: Iterable, dump: str = None, count: str = None, end: str = "\n") -> Iterable:
+		"""Поток элементов фазы name. Время выдачи каждого элемента засчитывается фазе,
+		элементы считаются (count) и пишутся в файл дампа (dump) через end, если он запрошен"""
+		dump = dump if dump in self.dump else None
+
+		if not self.enabled and dump is None:
+			return items
+
+		if self.enabled:
+			self.phases.setdefault(name, PhaseStats())
+
+		return self.iterate(name, items, dump, count, end)
+
+	def iterate(self, name: str, items: Iterable, dump: str, count: str, end: str) -> Iterator:
+		iterator = iter(items)
+		total = 0
+		start = None
+		file = self.open_dump(dump) if dump else None
+
+		try:
+			while True:
+				if self.enabled:
+					previous = self.switch(name)
+					start = start or time.perf_counter()
+
+				try:
+					item = next(iterator)
+				except StopIteration:
+					break
+				finally:
+					if self.enabled:
+						self.switch(previous)
+
+				total += 1
+
+				if file:
+					file.write(str(item))
+					file.write(end)
+
+				yield item
+		finally:
+			if file:
+				file.close()
+
+			if self.enabled and count:
+				self.count(name, count, total)
+
+			if self.enabled and start is not None:
+				self.event(name, start, time.perf_counter())
+
+	def count(self, phase: str, key: str, value: int):
+		"""Размер результата фазы"""
+		if self.enabled:
+			self.phases.setdefault(phase, PhaseStats()).counts[key] = value
+
+	def event(self, name: str, start: float, end: float):
+		if self.profile is not None:
+			self.events.append({
+				"name": name, "ph": "X", "pid": os.getpid(), "tid": 0,
+				"ts": (start - self.origin) * 1e6, "dur": (end - start) * 1e6
+			})
+
+	def open_dump(self, form: str) -> TextIO:
+		return open(f"{self.dump_prefix}.{form}", "w")
+
+	def write_dump(self, form: str, parts: Iterable):
+		"""Записать промежуточное представление по частям, не собирая весь текст в памяти"""
+		if form not in self.dump:
+			return
+
+		with self.open_dump(form) as file:
+			for part in parts:
+				file.write(str(part))
+				file.write("\n")
+
+	def stop(self):
+		"""Остановка tracemalloc и профилировщиков. Вызывается и после ошибки компиляции:
+		сервер компиляции выполняет следующие запросы в том же процессе"""
+		self.switch(None)
+
+		if self.stats and self.tracemalloc.is_tracing():
+			self.tracemalloc.stop()
+
+	def finish(self):
+		"""Вывод статистики и запись профилей"""
+		self.stop()
+
+		if self.stats:
+			print(self.report())
+
+		if self.profile is not None:
+			os.makedirs(self.profile, exist_ok=True)
+
+			for name, profiler in self.profilers.items():
+				profiler.dump_stats(os.path.join(self.profile, f"{name.replace(' ', '_')}.prof"))
+
+			with open(os.path.join(self.profile, "trace.json"), "w") as file:
+				json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, file)
+
+	def report(self) -> str:
+		lines = [f"{'phase':<18}{'time ms':>10}{'alloc KiB':>12}{'peak KiB':>11}  output"]
+		total = 0.0
+
+		for name, stats in self.phases.items():
+			counts = ", ".join(f"{key} {value}" for key, value in stats.counts.items())
+			lines.append(f"{name:<18}{stats.time * 1000:>10.2f}{stats.allocated / 1024:>12.1f}{stats.peak / 1024:>11.1f}  {counts}")
+			total += stats.time
+
+		lines.append(f"{'total':<18}{total * 1000:>10.2f}")
+
+		return "\n".join(lines)
@@ -1,8 +1,14 @@
 import sys
 import re
-from typing import List, Tuple
+from functools import lru_cache
+from typing import Iterator, NamedTuple
 
-Token = Tuple[str, str]
+class Token(NamedTuple):
+	"""Токен с позицией в исходном коде"""
+	type: str
+	value: str
+	line: int
+	column: int
 
 TOKEN_SPECIFICATION = {
 	"NUMBER": r"\d+",
@@ -11,6 +17,8 @@ TOKEN_SPECIFICATION = {
 	"GE": r">=",
 	"EQ": r"==",
 	"NEQ": r"!=",
+	"AND": r"&&",
+	"OR": r"\|\|",
 	"EQUAL": r"=",
 	"PLUS": r"\+",
 	"MINUS": r"-",
@@ -28,38 +36,65 @@ TOKEN_SPECIFICATION = {
 	"MISMATCH": r"."
 }
 
-KEYWORDS = [
+KEYWORDS = frozenset([
 	"func",
+	"noinline",
 	"if",
 	"elseif",
 	"else",
 	"while",
-	"for"
-]
+	"for",
+	"var"
+])
 
-TOKEN_REGEX = "|".join(f"(?P<{name}>{pattern})" for name, pattern in TOKEN_SPECIFICATION.items())
+TOKEN_REGEX = re.compile("|".join(f"(?P<{name}>{pattern})" for name, pattern in TOKEN_SPECIFICATION.items()))
+
+@lru_cache(maxsize=None)
+def build_identifier_table(registers: frozenset, opcodes: frozenset) -> dict:
+	"""Таблица классификации идентификаторов: имя -> KEYWORD / OPCODE / REGISTER"""
+	table = {}
+
+	# Порядок важен: ключевые слова приоритетнее опкодов, опкоды приоритетнее регистров
+	for register in registers:
+		table[register] = "REGISTER"
+
+	for opcode in opcodes:
+		table[opcode] = "OPCODE"
+
+	for keyword in KEYWORDS:
+		table[keyword] = "KEYWORD"
+
+	return table
 
 class Lexer:
 	def __init__(self, code, registers, opcodes):
 		self.code = code
 		self.registers = registers
 		self.opcodes = opcodes
+		self.identifiers = build_identifier_table(frozenset(registers), frozenset(opcodes))
+
+	def tokenize(self) -> Iterator[Token]:
+		"""Токенизация. Токены выдаются лениво по мере чтения исходного кода.
+		Код может быть строкой или потоком блоков из целых строк (см. Preprocessor.stream)"""
+		identifiers = self.identifiers
+		chunks = (self.code,) if isinstance(self.code, str) else self.code
+		line = 1
+
+		for chunk in chunks:
+			line_start = 0
 
-	def tokenize(self) -> List[Token]:
-		"""Токенизация"""
-		tokens = []
+			for match in TOKEN_REGEX.finditer(chunk):
+				group = match.lastgroup
+				value = match.group()
+				start = match.start()
 
-		for match in re.finditer(TOKEN_REGEX, self.code):
-			group = match.lastgroup
-			value = match.group()
+				if group == "ID":
+					group = identifiers.get(value, "ID")
+				elif group == "MISMATCH":
+					continue
 
-			if value in KEYWORDS:
-				tokens.append(("KEYWORD", value))
-			elif value in self.opcodes:
-				tokens.append(("OPCODE", value))
-			elif value in self.registers:
-				tokens.append(("REGISTER", value))
-			elif group != "MISMATCH":
-				tokens.append((group, value))
+				yield Token(group, value, line, start - line_start + 1)
 
-		return tokens
\ No newline at end of file
+				if group == "NEW_LINE":
+					line += 1
+					line_start = start + 1
@@ -1,64 +1,127 @@
 import sys
-from typing import List
+from collections import deque
+from typing import Iterable, List
 from ast import *
+from lexer import Token
+from symbols import SymbolTable
+
+LOOKAHEAD = 3 # Максимальная глубина просмотра токенов вперёд
+
+# Бинарные операторы: тип токена -> (приоритет, правоассоциативность). Больший приоритет связывает сильнее
+BINARY_OPERATORS = {
+	"EQUAL": (1, True),
+	"OR": (2, False),
+	"AND": (3, False),
+	"LT": (4, False),
+	"GT": (4, False),
+	"LE": (4, False),
+	"GE": (4, False),
+	"EQ": (4, False),
+	"NEQ": (4, False),
+	"PLUS": (5, False),
+	"MINUS": (5, False),
+	"STAR": (6, False),
+	"SLASH": (6, False),
+}
+
+# Инкремент и декремент записываются двумя одинаковыми токенами подряд
+STEP_OPERATORS = {"PLUS": "++", "MINUS": "--"}
 
 class ParserError(Exception):
-	def __init__(self, message, position=None):
-		super().__init__(f"{message} at token position {position}")
+	def __init__(self, message, token: Token = None, line: int = None):
+		if token is None:
+			super().__init__(f"{message} at end of file")
+		else:
+			super().__init__(f"{message} at line {line or token.line}, column {token.column}")
 
 class Parser(ASTNode):
-	def __init__(self, tokens) -> List:
-		self.tokens = tokens
-		self.pos = 0
-		self.current_func = None
+	def __init__(self, tokens: Iterable[Token], source_map=None) -> List:
+		self.tokens = iter(tokens)
+		self.source_map = source_map # Номера исходных строк для строк после препроцессинга
+		self.window = deque() # Окно просмотра вперёд, не больше LOOKAHEAD токенов
+		self.previous = None # Предыдущий токен
+		self.current_func = None # FunctionSymbol разбираемой функции
+		self.symbols = SymbolTable() # Сигнатуры всех разобранных функций
+
+	def peek(self, offset: int = 0):
+		"""Получить токен на offset позиций впереди текущего"""
+		if offset >= LOOKAHEAD:
+			raise ValueError(f"lookahead {offset} exceeds limit {LOOKAHEAD}")
+
+		while len(self.window) <= offset:
+			token = next(self.tokens, None)
+
+			if token is None:
+				return None
+
+			self.window.append(token)
+
+		return self.window[offset]
+
+	def error(self, message) -> ParserError:
+		"""Ошибка парсинга в позиции текущего токена"""
+		token = self.current()
+
+		if token is not None and self.source_map and token.line <= len(self.source_map):
+			return ParserError(message, token, self.source_map[token.line - 1])
+
+		return ParserError(message, token)
 
 	def current(self):
 		"""Получить текущий токен"""
-		return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+		return self.peek(0)
 
 	def advance(self):
 		"""Следующий токен"""
-		self.pos += 1
+		if self.window or self.peek(0) is not None:
+			self.previous = self.window.popleft()
 
 	def expect(self, token_types: List):
 		"""Проверка на соответствие типов"""
 		if self.current() and self.current()[0] in token_types:
 			return self.current()[1]
 		else:
-			raise ParserError(f"expected token type {token_types}", position=self.pos)
+			raise self.error(f"expected token type {token_types}")
 
 	def parse(self) -> Program:
 		"""Парсинг"""
 		functions = []
 
-		while self.pos < len(self.tokens):
-			group, value = self.current()
+		while self.current() is not None:
+			group, value = self.current()[:2]
 
 			if group == "KEYWORD" and value == "func":
 				functions.append(self.parse_func())
+			elif group == "KEYWORD" and value == "noinline":
+				self.advance()
+
+				if not self.current() or self.current()[1] != "func":
+					raise self.error("expected keyword 'func' after 'noinline'")
+
+				functions.append(self.parse_func(noinline=True))
 			else:
 				self.advance()
 
 		return Program(functions)
 
-	def parse_func(self) -> Func:
+	def parse_func(self, noinline: bool = False) -> Func:
 		"""Парсинг функции"""
 		self.advance()
 
 		# Если название функции равно опкоду или регистру выдаем ошибку
 		if self.current()[0] == "OPCODE" or self.current()[0] == "REGISTER":
-			raise ParserError("function name matches the opcode", position=self.pos)
+			raise self.error("function name matches the opcode")
 
 		identifier = self.expect(["ID"])
 		self.advance()
 
 		params = self.parse_func_params()
-		self.current_func = {"name": identifier, "params": params}
+		self.current_func = self.symbols.define(identifier, params)
 
 		self.advance()
 		body = self.parse_func_body()
 
-		return Func(identifier, params, body)
+		return Func(identifier, params, body, noinline)
 
 	def parse_func_params(self) -> List:
 		"""Парсинг параметров функции"""
@@ -83,25 +146,52 @@ class Parser(ASTNode):
 		body = []
 
 		while self.current()[0] != "RBRACE":
-			group, value = self.current()
+			group, value = self.current()[:2]
 
 			if group == "OPCODE":
 				body.append(self.parse_instruction())
-			elif group == "ID" and self.tokens[self.pos + 1][0] == "LPARENT":
+			elif group == "ID" and self.peek(1) and self.peek(1)[0] == "LPARENT":
 				body.append(self.parse_call_func())
 			elif group == "KEYWORD" and value == "if":
 				body.append(self.parse_if_else_chain())
 			elif group == "KEYWORD" and value == "while":
 				body.append(self.parse_while_do_loop())
-			elif group == "LBRACE" and self.tokens[self.pos - 1][0] != "RPARENT":
+			elif group == "LBRACE" and self.previous[0] != "RPARENT":
 				body.append(self.parse_do_while_loop())
 			elif group == "KEYWORD" and value == "for":
 				body.append(self.parse_for_loop())
+			elif group == "KEYWORD" and value == "var":
+				body.extend(self.parse_var_declaration())
 
 			self.advance()
 
 		return body
 
+	def parse_var_declaration(self) -> List[Instruction]:
+		"""Парсинг объявления локальных переменных: var x, y = 5. Инициализация превращается в mov.
+		Текущий токен в конце - перевод строки"""
+		self.advance()
+		initializers = []
+
+		while True:
+			name = self.expect(["ID"])
+			self.symbols.declare(self.current_func, name)
+			self.advance()
+
+			if self.check("EQUAL"):
+				self.advance()
+				initializers.append(Instruction("mov", [Variable(name), self.parse_expression()]))
+
+			if not self.check("COMMA"):
+				break
+
+			self.advance()
+
+		if not self.check("NEW_LINE"):
+			raise self.error("expected ',' or end of line after variable")
+
+		return initializers
+
 	def parse_instruction(self) -> Instruction:
 		"""Парсинг инструкции"""
 		opcode = self.current()[1]
@@ -111,113 +201,109 @@ class Parser(ASTNode):
 		return Instruction(opcode, operands)
 
 	def parse_operands(self) -> List:
-		"""Парсинг операндов"""
+		"""Парсинг операндов. Текущий токен в конце - перевод строки"""
 		operands = []
-		buffer = []
-
-		while self.current()[0] != "NEW_LINE":
-			group, value = self.current()
-
-			if group == "COMMA" and len(buffer) == 0:
-				raise ParserError("expected operand before ','", position=self.pos)
-
-			if group == "REGISTER":
-				buffer.append(Register(value))
-			elif group == "NUMBER":
-				buffer.append(Literal(value))
-			elif group == "ID" and self.tokens[self.pos + 1][0] == "LPARENT":
-				buffer.append(self.parse_call_func())
-			elif group == "ID" and value in self.current_func["params"]:
-				buffer.append(Parameter(value))
-			elif group == "COMMA":
-				operands.append(self.parse_expr(buffer))
-				buffer = []
-			else:
-				buffer.append(self.current())
 
+		if self.check("NEW_LINE"):
+			return operands
+
+		operands.append(self.parse_expression())
+
+		while self.check("COMMA"):
 			self.advance()
+			operands.append(self.parse_expression())
 
-		operands.append(self.parse_expr(buffer))
+		if not self.check("NEW_LINE"):
+			raise self.error("expected ',' or end of line after operand")
 
 		return operands
 
-	def parse_expr(self, buffer) -> Expression:
-		"""Парсинг выражений в буфере"""
-		buffer = self.parse_prefix_operation(buffer, ["PLUS"])
-		buffer = self.parse_prefix_operation(buffer, ["MINUS"])
-		buffer = self.parse_postfix_operation(buffer, ["PLUS"])
-		buffer = self.parse_postfix_operation(buffer, ["MINUS"])
-		buffer = self.parse_binary_opeartion(buffer, ["STAR", "SLASH"])
-		buffer = self.parse_binary_opeartion(buffer, ["PLUS", "MINUS"])
-		buffer = self.parse_binary_opeartion(buffer, ["LT", "GT", "LE", "GE", "EQ", "NEQ"])
-		buffer = self.parse_binary_opeartion(buffer, ["EQUAL"])
-
-		return buffer[0] if buffer else None
-
-	def parse_prefix_operation(self, buffer, operations):
-		"""Парсинг префиксных операций в выражении"""
-		result = []
-		i = 0
-
-		while i < len(buffer):
-			if (i + 2 < len(buffer)
-				and isinstance(buffer[i], tuple)
-				and buffer[i][0] in operations
-				and isinstance(buffer[i + 1], tuple)
-				and buffer[i + 1][0] in operations
-			):
-				result.append(UnaryOperation(buffer[i + 2], str(buffer[i][1]) + str(buffer[i + 1][1]), "prefix"))
-
-				i += 3
-			else:
-				result.append(buffer[i])
-				i += 1
+	def check(self, token_type: str) -> bool:
+		"""Имеет ли текущий токен тип token_type"""
+		token = self.current()
 
-		return result
+		return token is not None and token[0] == token_type
 
-	def parse_postfix_operation(self, buffer, operations):
-		"""Парсинг постфиксных операций в выражении"""
-		result = []
-		i = 0
+	def is_step_operator(self) -> bool:
+		"""Текущий и следующий токены образуют ++ или --"""
+		token = self.current()
 
-		while i < len(buffer):
-			if (i + 1 < len(buffer)
-				and isinstance(buffer[i], tuple)
-				and buffer[i][0] in operations
-				and isinstance(buffer[i + 1], tuple)
-				and buffer[i + 1][0] in operations
-			):
-				operand = result.pop()
+		if token is None or token[0] not in STEP_OPERATORS:
+			return False
 
-				result.append(UnaryOperation(operand, str(buffer[i][1]) + str(buffer[i + 1][1]), "postfix"))
+		following = self.peek(1)
 
-				i += 2
-			else:
-				result.append(buffer[i])
-				i += 1
+		return following is not None and following[0] == token[0]
 
-		return result
+	def parse_expression(self, precedence: int = 0) -> Expression:
+		"""Парсинг выражения методом подъёма по приоритетам за один проход.
+		Разбираются операторы с приоритетом больше precedence, текущий токен в конце - первый после выражения"""
+		left = self.parse_unary()
 
-	def parse_binary_opeartion(self, buffer, operations):
-		"""Парсинг бинарных операций в выражении"""
-		result = []
-		i = 0
+		while True:
+			token = self.current()
 
-		while i < len(buffer):
-			node = buffer[i]
+			if token is None or token[0] not in BINARY_OPERATORS:
+				return left
 
-			if isinstance(node, tuple) and node[0] in operations:
-				left = result.pop()
-				right = buffer[i + 1]
+			binding, right_associative = BINARY_OPERATORS[token[0]]
 
-				result.append(BinaryOperation(left, right, node[1]))
+			if binding <= precedence:
+				return left
 
-				i += 2
-			else:
-				result.append(node)
-				i += 1
+			self.advance()
+
+			# Правоассоциативный оператор принимает справа операторы того же приоритета
+			right = self.parse_expression(binding - 1 if right_associative else binding)
+			left = BinaryOperation(left, right, token[1])
+
+	def parse_unary(self) -> Expression:
+		"""Парсинг префиксных ++ / -- и постфиксных операций над операндом"""
+		if self.is_step_operator():
+			operation = STEP_OPERATORS[self.current()[0]]
+			self.advance()
+			self.advance()
+
+			return UnaryOperation(self.parse_unary(), operation, "prefix")
+
+		operand = self.parse_primary()
+
+		while self.is_step_operator():
+			operand = UnaryOperation(operand, STEP_OPERATORS[self.current()[0]], "postfix")
+			self.advance()
+			self.advance()
+
+		return operand
+
+	def parse_primary(self) -> Expression:
+		"""Парсинг операнда: регистр, число, параметр, переменная, вызов функции или выражение в скобках"""
+		token = self.current()
+
+		if token is None:
+			raise self.error("expected operand")
 
-		return result
+		group, value = token[:2]
+
+		if group == "REGISTER":
+			node = Register(value)
+		elif group == "NUMBER":
+			node = Literal(value)
+		elif group == "ID" and self.peek(1) and self.peek(1)[0] == "LPARENT":
+			node = self.parse_call_func()
+		elif group == "ID" and self.current_func.is_parameter(value):
+			node = Parameter(value)
+		elif group == "ID" and self.current_func.is_variable(value):
+			node = Variable(value)
+		elif group == "LPARENT":
+			self.advance()
+			node = self.parse_expression()
+			self.expect(["RPARENT"])
+		else:
+			raise self.error(f"expected operand, got '{value.strip() or group}'")
+
+		self.advance()
+
+		return node
 
 	def parse_call_func(self) -> CallFunc:
 		"""Парсинг вызова функции"""
@@ -228,35 +314,22 @@ class Parser(ASTNode):
 		return CallFunc(func, args)
 
 	def parse_call_func_args(self) -> List:
-		"""Парсинг параметров вызываемой функции"""
+		"""Парсинг параметров вызываемой функции. Текущий токен в конце - ')'"""
 		args = []
-		buffer = []
 
-		self.expect("LPARENT")
+		self.expect(["LPARENT"])
 		self.advance()
 
-		while self.current()[0] != "RPARENT":
-			group, value = self.current()
-
-			if group == "REGISTER":
-				buffer.append(Register(value))
-			elif group == "NUMBER":
-				buffer.append(Literal(value))
-			elif group == "ID" and self.tokens[self.pos + 1][0] == "LPARENT":
-				buffer.append(self.parse_call_func())
-			elif group == "COMMA":
-				args.append(self.parse_expr(buffer))
-
-				buffer = []
-			else:
-				buffer.append(self.current())
+		if self.check("RPARENT"):
+			return args
 
-			self.advance()
+		args.append(self.parse_expression())
 
-		arg = self.parse_expr(buffer)
+		while self.check("COMMA"):
+			self.advance()
+			args.append(self.parse_expression())
 
-		if arg:
-			args.append(arg)
+		self.expect(["RPARENT"])
 
 		return args
 
@@ -269,11 +342,9 @@ class Parser(ASTNode):
 		body = self.parse_func_body()
 		if_branch = IfOperator(condition, body)
 
-		self.advance()
-
 		elseif_branches = []
 
-		while self.current() and self.current()[1] == "elseif":
+		while self.skip_to_keyword("elseif"):
 			self.advance()
 			condition = self.parse_condition()
 
@@ -281,41 +352,43 @@ class Parser(ASTNode):
 			body = self.parse_func_body()
 			elseif_branches.append(ElseIfOperator(condition, body))
 
-		self.advance()
-
 		else_branch = None
 
-		if self.current() and self.current()[1] == "else":
+		if self.skip_to_keyword("else"):
 			self.advance()
 			body = self.parse_func_body()
 			else_branch = ElseOperator(body)
 
+		# Текущий токен - последняя '}' конструкции
 		return IfElseChain(if_branch, elseif_branches, else_branch)
 
-	def parse_condition(self) -> Expression:
-		"""Парсинг условий"""
-		self.expect("LPARENT")
-		self.advance()
+	def skip_to_keyword(self, keyword: str) -> bool:
+		"""Перейти с '}' на ключевое слово, которое идёт следом (возможно, на следующей строке).
+		Если следом идёт что-то другое, позиция не меняется"""
+		offset = 1
 
-		buffer = []
+		if self.peek(offset) and self.peek(offset)[0] == "NEW_LINE":
+			offset += 1
 
-		while self.current()[0] != "RPARENT":
-			group, value = self.current()
-
-			if group == "REGISTER":
-				buffer.append(Register(value))
-			elif group == "NUMBER":
-				buffer.append(Literal(value))
-			elif group == "ID" and self.tokens[self.pos + 1][0] == "LPARENT":
-				buffer.append(self.parse_call_func())
-			elif group == "ID" and value in self.current_func["params"]:
-				buffer.append(Parameter(value))
-			else:
-				buffer.append(self.current())
+		token = self.peek(offset)
 
+		if not token or token[0] != "KEYWORD" or token[1] != keyword:
+			return False
+
+		for _ in range(offset):
 			self.advance()
 
-		return self.parse_expr(buffer)
+		return True
+
+	def parse_condition(self) -> Expression:
+		"""Парсинг условий. Текущий токен в конце - ')'"""
+		self.expect(["LPARENT"])
+		self.advance()
+
+		condition = self.parse_expression()
+		self.expect(["RPARENT"])
+
+		return condition
 
 	def parse_while_do_loop(self) -> WhileDoLoop:
 		"""Парсинг цикла while"""
@@ -334,7 +407,7 @@ class Parser(ASTNode):
 		self.advance()
 
 		if self.current()[1] != "while":
-			raise ParserError("expected keyword 'while' after '}'", position=self.pos)
+			raise self.error("expected keyword 'while' after '}'")
 
 		self.advance()
 		condition = self.parse_condition()
@@ -350,46 +423,26 @@ class Parser(ASTNode):
 		return ForLoop(counter, condition, operation, body)
 
 	def parse_for_init(self):
-		"""Парсинг блока инициализации цикла for"""
-		self.expect("LPARENT")
+		"""Парсинг блока инициализации цикла for: (счётчик; условие; шаг). Шаг можно не указывать"""
+		self.expect(["LPARENT"])
 		self.advance()
 
-		counter = None
-		condition = None
-		operation = None
+		if self.check("SEMICOLON"):
+			raise self.error("expected for init before ';'")
 
-		buffer = []
-		count_semicolon = 0
+		counter = self.parse_expression()
+		self.expect(["SEMICOLON"])
+		self.advance()
 
-		while self.current()[0] != "RPARENT":
-			group, value = self.current()
-
-			if group == "SEMICOLON" and len(buffer) == 0:
-				raise ParserError("expected for init before ';'", position=self.pos)
-
-			if group == "REGISTER":
-				buffer.append(Register(value))
-			elif group == "NUMBER":
-				buffer.append(Literal(value))
-			elif group == "ID" and self.tokens[self.pos + 1][0] == "LPARENT":
-				buffer.append(self.parse_call_func())
-			elif group == "ID" and value in self.current_func["params"]:
-				buffer.append(Parameter(value))
-			elif group == "SEMICOLON":
-				count_semicolon += 1
-
-				if count_semicolon == 1:
-					counter = self.parse_expr(buffer)
-				elif count_semicolon == 2:
-					condition = self.parse_expr(buffer)
-
-				buffer = []
-			else:
-				buffer.append(self.current())
+		if self.check("SEMICOLON"):
+			raise self.error("expected for condition before ';'")
 
-			self.advance()
+		condition = self.parse_expression()
+		self.expect(["SEMICOLON"])
+		self.advance()
 
-		operation = self.parse_expr(buffer)
+		operation = None if self.check("RPARENT") else self.parse_expression()
+		self.expect(["RPARENT"])
 		self.advance()
 
-		return counter, condition, operation
\ No newline at end of file
+		return counter, condition, operation
@@ -0,0 +1,6 @@
+from .constant_folding import ConstantFolder
+from .inlining import Inliner, INLINE_THRESHOLD
+from .callgraph import CallGraph
+from .clobbers import ClobberAnalysis
+from .loops import LoopOptimizer
+from .allocation import RegisterAllocator
@@ -0,0 +1,351 @@
+from typing import Dict, List, Set
+from ast import *
+from arch.x86.modes.realmode import OVERWRITE_OPCODES, REGISTERS_8
+from arch.x86.calling import RegisterCallingConvention
+from passes.callgraph import CallGraph
+from passes.walk import child_bodies, statement_expressions, iter_expression
+
+# 16 битные регистры для переменных в порядке предпочтения. ax хранит результат функции и
+# неявно используется mul, cx и dx - инструкциями loop и mul, поэтому они последние
+ALLOCATABLE_REGISTERS = ("bx", "si", "di", "cx", "dx")
+
+LOOP_WEIGHT = 10 # Во столько раз обращение внутри цикла важнее обращения снаружи
+
+LOOPS = (WhileDoLoop, DoWhileLoop, ForLoop, CountLoop)
+
+def variable_reads(expr) -> Set[str]:
+	"""Переменные, которые читает выражение. Левая часть присваивания не читается"""
+	if isinstance(expr, BinaryOperation) and expr.operation == "=":
+		return variable_reads(expr.right)
+
+	return {node.name for node in iter_expression(expr) if isinstance(node, Variable)}
+
+def variable_kills(expr) -> Set[str]:
+	"""Переменные, которые выражение перезаписывает целиком (x = 0)"""
+	if isinstance(expr, BinaryOperation) and expr.operation == "=" and isinstance(expr.left, Variable):
+		return {expr.left.name}
+
+	return set()
+
+def instruction_variables(instruction: Instruction):
+	"""Переменные, которые инструкция читает, и переменные, которые она перезаписывает целиком"""
+	operands = instruction.operands
+	reads, kills = set(), set()
+
+	# xor x, x - обнуление, значение не читается
+	if instruction.opcode == "xor" and len(operands) == 2 and isinstance(operands[0], Variable) and repr(operands[0]) == repr(operands[1]):
+		return reads, {operands[0].name}
+
+	for index, operand in enumerate(operands):
+		if index == 0 and isinstance(operand, Variable) and instruction.opcode in OVERWRITE_OPCODES:
+			kills.add(operand.name)
+		else:
+			reads |= variable_reads(operand)
+
+	return reads, kills
+
+def location_name(location) -> str:
+	if isinstance(location, Register):
+		return location.name
+
+	return f"[bp - {location.offset}]"
+
+class Interval:
+	"""Интервал жизни переменной: позиции операторов от первой до последней, где она жива или упоминается"""
+	__slots__ = ("name", "start", "end", "weight", "memory", "location")
+
+	def __init__(self, name: str, position: int):
+		self.name = name
+		self.start = position
+		self.end = position
+		self.weight = 0 # Обращения, взвешенные по вложенности циклов
+		self.memory = False # Переменная используется вместе с 8 битным регистром: только в стеке
+		self.location = None # Регистр или StackSlot
+
+	def extend(self, position: int):
+		self.start = min(self.start, position)
+		self.end = max(self.end, position)
+
+	def __repr__(self):
+		return f"{self.name} [{self.start}, {self.end}]"
+
+class FunctionAllocation:
+	"""Результат распределения для одной функции"""
+	__slots__ = ("name", "intervals", "registers", "pressure", "frame_size")
+
+	def __init__(self, name: str, intervals: List[Interval], registers: List[str]):
+		self.name = name
+		self.intervals = intervals
+		self.registers = registers # Свободные регистры функции
+		self.pressure = 0 # Наибольшее число одновременно живых переменных
+		self.frame_size = 0 # Байт под переменные в стеке
+
+	@property
+	def spilled(self) -> List[Interval]:
+		return [interval for interval in self.intervals if isinstance(interval.location, StackSlot)]
+
+	def describe(self) -> str:
+		locations = ", ".join(f"{interval.name}: {location_name(interval.location)}" for interval in self.intervals)
+
+		return (f"{self.name}: {len(self.intervals)} variables, pressure {self.pressure}, "
+			f"{len(self.registers)} free registers, {len(self.spilled)} spilled, "
+			f"frame {self.frame_size} bytes ({locations})")
+
+class LiveIntervals:
+	"""Интервалы жизни переменных функции.
+
+	Операторы нумеруются в порядке следования, у составных операторов есть позиция заголовка
+	и позиция после тела (проверка условия цикла). Живые переменные вычисляются обратным
+	проходом, циклы - до неподвижной точки. Переменная, живая на обратном переходе цикла,
+	жива в его заголовке и в конце, поэтому её интервал покрывает весь цикл"""
+	def __init__(self, func: Func):
+		self.positions = {} # id(оператор) -> (позиция заголовка, позиция после тела)
+		self.intervals = {} # Имя переменной -> Interval
+		self.count = 0
+		self.loops = {} # (id(цикл), живые после цикла) -> живые перед циклом
+
+		self.number(func.body, 0)
+		self.live_in(func.body, set())
+
+	def interval(self, name: str, position: int) -> Interval:
+		interval = self.intervals.get(name)
+
+		if interval is None:
+			interval = self.intervals[name] = Interval(name, position)
+		else:
+			interval.extend(position)
+
+		return interval
+
+	def number(self, body: List, depth: int):
+		"""Нумерация операторов и обращения к переменным"""
+		for node in body:
+			start = self.count
+			self.count += 1
+			inner = depth + isinstance(node, LOOPS)
+
+			for child in child_bodies(node):
+				self.number(child, inner)
+
+			end = self.count if child_bodies(node) else start
+			self.count += end != start
+			self.positions[id(node)] = (start, end)
+
+			narrow = isinstance(node, Instruction) and any(
+				isinstance(operand, Register) and operand.name in REGISTERS_8 for operand in node.operands
+			)
+
+			for expr in statement_expressions(node):
+				for child in iter_expression(expr):
+					if not isinstance(child, Variable):
+						continue
+
+					interval = self.interval(child.name, start)
+					interval.weight += LOOP_WEIGHT ** inner
+					interval.memory |= narrow
+
+					# Условие и шаг цикла выполняются после тела
+					if isinstance(node, LOOPS):
+						interval.extend(end)
+
+	def mark(self, position: int, live: Set[str]):
+		for name in live:
+			self.interval(name, position)
+
+	def live_in(self, body: List, live_out: Set[str]) -> Set[str]:
+		"""Живые переменные перед блоком"""
+		live = set(live_out)
+
+		for statement in reversed(body):
+			live = self.statement_live(statement, live)
+
+		return live
+
+	def statement_live(self, node: ASTNode, live: Set[str]) -> Set[str]:
+		"""Живые переменные перед оператором. Отмечает их в позициях оператора"""
+		start, end = self.positions[id(node)]
+		self.mark(end, live)
+
+		if isinstance(node, LOOPS):
+			key = (id(node), frozenset(live))
+
+			if key not in self.loops:
+				self.loops[key] = self.loop_live(node, live)
+
+			result = set(self.loops[key])
+			self.mark(end, result)
+		elif isinstance(node, Instruction):
+			reads, kills = instruction_variables(node)
+			result = (live - kills) | reads
+		elif isinstance(node, IfElseChain):
+			if node.else_branch:
+				result = self.live_in(node.else_branch.body, live)
+			else:
+				result = set(live)
+
+			for branch in reversed([node.if_branch] + (node.elseif_branches or [])):
+				result = self.live_in(branch.body, live) | result | variable_reads(branch.condition)
+		else:
+			result = live | variable_reads(node)
+
+		self.mark(start, result)
+
+		return result
+
+	def expression_live(self, expr, live: Set[str]) -> Set[str]:
+		if expr is None:
+			return set(live)
+
+		return (live - variable_kills(expr)) | variable_reads(expr)
+
+	def loop_live(self, node: ASTNode, live: Set[str]) -> Set[str]:
+		"""Живые переменные перед циклом: итерация до неподвижной точки"""
+		carried = set()
+
+		while True:
+			if isinstance(node, WhileDoLoop):
+				updated = self.expression_live(node.condition, live | self.live_in(node.body, carried))
+			elif isinstance(node, DoWhileLoop):
+				updated = self.live_in(node.body, self.expression_live(node.condition, live | carried))
+			elif isinstance(node, ForLoop):
+				after_body = self.expression_live(node.operation, carried)
+				updated = self.expression_live(node.condition, live | self.live_in(node.body, after_body))
+			else:
+				updated = self.live_in(node.body, live | carried)
+
+			if updated == carried:
+				break
+
+			carried = updated
+
+		if isinstance(node, ForLoop):
+			return self.expression_live(node.counter, carried)
+
+		return carried
+
+class RegisterAllocator(NodeTransformer):
+	"""Распределение регистров для локальных переменных линейным сканированием.
+
+	Переменным функции достаются 16 битные регистры, которые функция не упоминает.
+	Регистры переменных попадают в портящиеся регистры функции, и вызывающие функции сохраняют
+	их вокруг вызова, если они там живы (ClobberAnalysis).
+	Если живых переменных больше, чем свободных регистров, в стек ([bp - N]) уходит
+	переменная с наименьшим весом обращений, поэтому переменные внутри циклов остаются
+	в регистрах. Переменные в стеке с непересекающимися интервалами делят одну ячейку"""
+	prefix = "rewrite_"
+
+	def __init__(self, program: Program, call_graph: CallGraph):
+		self.program = program
+		self.call_graph = call_graph
+		self.functions = {} # Имя функции -> FunctionAllocation
+		self.locations = {} # Имя переменной текущей функции -> Register или StackSlot
+
+		self.mentioned = {func.name: RegisterCallingConvention.mentioned_registers(func) for func in program.functions}
+
+	def allocate(self) -> Program:
+		for func in self.program.functions:
+			intervals = LiveIntervals(func).intervals
+
+			if not intervals:
+				continue
+
+			allocation = self.allocate_function(func, list(intervals.values()))
+			self.functions[func.name] = allocation
+			self.locations = {interval.name: interval.location for interval in allocation.intervals}
+			self.visit(func)
+
+			# Регистры переменных теперь заняты и для вызывающих функций
+			self.mentioned[func.name] |= {
+				location.name for location in self.locations.values() if isinstance(location, Register)
+			}
+
+		return self.program
+
+	def free_registers(self, func: Func) -> List[str]:
+		"""Регистры, которые функция не упоминает. Сначала те, которые не портят вызываемые функции:
+		их не нужно сохранять вокруг вызовов"""
+		busy = self.mentioned[func.name]
+		callees = set()
+
+		if func.name in self.call_graph.functions:
+			for callee in self.call_graph.closure(func.name) - {func.name}:
+				callees |= self.mentioned.get(callee, set())
+
+		free = [register for register in ALLOCATABLE_REGISTERS if register not in busy]
+
+		return sorted(free, key=lambda register: register in callees)
+
+	def allocate_function(self, func: Func, intervals: List[Interval]) -> FunctionAllocation:
+		"""Линейное сканирование интервалов по возрастанию начала"""
+		intervals.sort(key=lambda interval: (interval.start, interval.end))
+		allocation = FunctionAllocation(func.name, intervals, self.free_registers(func))
+		free = list(allocation.registers)
+		active = [] # Интервалы в регистрах, которые ещё живы
+		spilled = []
+
+		for interval in intervals:
+			for other in [other for other in active if other.end < interval.start]:
+				active.remove(other)
+				free.append(other.location.name)
+
+			free.sort(key=allocation.registers.index)
+
+			if interval.memory:
+				spilled.append(interval)
+			elif free:
+				interval.location = Register(free.pop(0))
+				active.append(interval)
+			elif not active:
+				# Функция сама использует все регистры
+				spilled.append(interval)
+			else:
+				# Регистр остаётся у переменной с большим весом, при равном весе - у той, что раньше освободит его
+				victim = min(active, key=lambda other: (other.weight, -other.end))
+
+				if (victim.weight, -victim.end) < (interval.weight, -interval.end):
+					interval.location = victim.location
+					victim.location = None
+					active.remove(victim)
+					active.append(interval)
+					spilled.append(victim)
+				else:
+					spilled.append(interval)
+
+		allocation.pressure = max(
+			sum(other.start <= interval.start <= other.end for other in intervals)
+			for interval in intervals
+		)
+		allocation.frame_size = self.assign_slots(spilled)
+
+		return allocation
+
+	@staticmethod
+	def assign_slots(spilled: List[Interval]) -> int:
+		"""Ячейки стека для вытесненных переменных. Возвращает размер кадра в байтах"""
+		slots = [] # Конец последнего интервала в каждой ячейке
+
+		for interval in sorted(spilled, key=lambda interval: interval.start):
+			for index, end in enumerate(slots):
+				if end < interval.start:
+					break
+			else:
+				index = len(slots)
+				slots.append(None)
+
+			slots[index] = interval.end
+			interval.location = StackSlot(interval.name, 2 * (index + 1))
+
+		return 2 * len(slots)
+
+	def frame_size(self, func_name: str) -> int:
+		"""Байт под переменные в кадре стека функции"""
+		allocation = self.functions.get(func_name)
+
+		return allocation.frame_size if allocation else 0
+
+	def frames(self) -> Dict[str, int]:
+		"""Байт под переменные в кадре стека каждой функции с переменными"""
+		return {name: allocation.frame_size for name, allocation in self.functions.items()}
+
+	def rewrite_variable(self, node: Variable) -> ASTNode:
+		return self.locations[node.name]
@@ -0,0 +1,229 @@
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+from ast import *
+from passes.walk import iter_statements, statement_expressions, iter_calls
+
+class CallGraph:
+	"""Граф вызовов программы. Учитываются и вызовы в операндах и аргументах"""
+	def __init__(self, program: Program):
+		self.program = program
+		self.functions = {func.name: func for func in program.functions}
+		self.callees = {}
+		self.undefined = {} # Вызовы несуществующих функций: имя вызывающей -> имена
+
+		for func in program.functions:
+			names = list(dict.fromkeys(call.func_name for call in iter_calls(func.body)))
+
+			self.callees[func.name] = [name for name in names if name in self.functions]
+			self.undefined[func.name] = [name for name in names if name not in self.functions]
+
+		self.callers = {name: [] for name in self.functions}
+
+		for caller, callees in self.callees.items():
+			for callee in callees:
+				self.callers[callee].append(caller)
+
+	def closure(self, name: str, graph: Dict[str, List[str]] = None) -> Set[str]:
+		"""Функция и все функции, достижимые из неё (по умолчанию по вызовам)"""
+		graph = self.callees if graph is None else graph
+		seen = {name}
+		stack = [name]
+
+		while stack:
+			for following in graph.get(stack.pop(), ()):
+				if following not in seen:
+					seen.add(following)
+					stack.append(following)
+
+		return seen
+
+	def reachable(self, root: str = "main") -> Set[str]:
+		"""Функции, достижимые из root"""
+		if root not in self.functions:
+			return set(self.functions)
+
+		return self.closure(root)
+
+	def eliminate_dead(self, root: str = "main") -> List[str]:
+		"""Удалить из программы функции, недостижимые из root. Возвращает имена удалённых функций"""
+		reachable = self.reachable(root)
+		removed = [func.name for func in self.program.functions if func.name not in reachable]
+
+		self.program.functions = [func for func in self.program.functions if func.name in reachable]
+
+		for name in removed:
+			del self.functions[name]
+			del self.callees[name]
+			del self.callers[name]
+			del self.undefined[name]
+
+		for name in self.callers:
+			self.callers[name] = [caller for caller in self.callers[name] if caller in reachable]
+
+		return removed
+
+	def components(self) -> List[List[str]]:
+		"""Компоненты сильной связности (алгоритм Тарьяна) в обратном топологическом порядке:
+		вызываемые функции раньше вызывающих. Явный стек вместо рекурсии: глубина цепочки
+		вызовов не ограничена глубиной рекурсии Python"""
+		index = {}
+		lowlink = {}
+		stack = []
+		on_stack = set()
+		result = []
+
+		def enter(name):
+			index[name] = lowlink[name] = len(index)
+			stack.append(name)
+			on_stack.add(name)
+			work.append((name, iter(self.callees[name])))
+
+		for root in self.functions:
+			if root in index:
+				continue
+
+			work = [] # (функция, ещё не просмотренные вызываемые)
+			enter(root)
+
+			while work:
+				name, callees = work[-1]
+
+				for callee in callees:
+					if callee not in index:
+						enter(callee)
+						break
+					elif callee in on_stack:
+						lowlink[name] = min(lowlink[name], index[callee])
+				else:
+					work.pop()
+
+					if work:
+						caller = work[-1][0]
+						lowlink[caller] = min(lowlink[caller], lowlink[name])
+
+					if lowlink[name] == index[name]:
+						component = []
+
+						while True:
+							member = stack.pop()
+							on_stack.discard(member)
+							component.append(member)
+
+							if member == name:
+								break
+
+						result.append(component[::-1])
+
+		return result
+
+	def cycles(self) -> List[List[str]]:
+		"""Циклы рекурсии: компоненты сильной связности из нескольких функций и прямая рекурсия"""
+		return [
+			component for component in self.components()
+			if len(component) > 1 or component[0] in self.callees[component[0]]
+		]
+
+	def call_sites(self, func: Func, convention, clobbers=None) -> Iterator[Tuple[CallFunc, int]]:
+		"""Вызовы функции вместе с числом байт, уже лежащих в стеке в момент вызова
+		(регистры, сохранённые вокруг вызова, и аргументы внешнего вызова, переданные до вычисления
+		вложенного). clobbers - ClobberAnalysis: какие регистры сохраняются вокруг каждого вызова"""
+		def nested(call: CallFunc, pending: int):
+			if clobbers:
+				pending += 2 * len(clobbers.saved_registers(call))
+
+			yield call, pending
+
+			layout = convention.layout(call.func_name, len(call.args))
+			stack_args = [index for index in range(len(call.args)) if not layout.argument_register(index)]
+			register_calls = 0
+
+			for index, arg in enumerate(call.args):
+				if not isinstance(arg, CallFunc):
+					continue
+
+				if index in stack_args:
+					# Аргументы передаются справа налево: правее уже в стеке
+					extra = 2 * sum(other > index for other in stack_args)
+				else:
+					# Регистровые аргументы вычисляются после стековых, результаты сохраняются в стеке
+					extra = 2 * len(stack_args) + 2 * register_calls
+					register_calls += 1
+
+				yield from nested(arg, pending + extra)
+
+		for statement in iter_statements(func.body):
+			for expr in statement_expressions(statement):
+				if isinstance(expr, CallFunc):
+					yield from nested(expr, 0)
+
+	def stack_depth(self, convention, frames: Dict[str, int] = None, clobbers=None) -> Dict[str, Optional[int]]:
+		"""Наибольшая глубина стека в байтах для каждой функции, включая вызываемые.
+		frames - байт под локальные переменные в кадре функции, clobbers - ClobberAnalysis.
+		None - глубина не ограничена из-за рекурсии"""
+		frames = frames or {}
+
+		# Рекурсивные функции и все, кто их вызывает
+		unbounded = {name for cycle in self.cycles() for name in cycle}
+		stack = list(unbounded)
+
+		while stack:
+			for caller in self.callers[stack.pop()]:
+				if caller not in unbounded:
+					unbounded.add(caller)
+					stack.append(caller)
+
+		depth = {}
+
+		# Вызываемые функции обрабатываются раньше вызывающих
+		for component in self.components():
+			for name in component:
+				if name in unbounded:
+					depth[name] = None
+					continue
+
+				func = self.functions[name]
+				locals_size = frames.get(name, 0)
+				own = (2 if convention.layout(name).has_frame or locals_size else 0) + locals_size # Сохранённый bp и переменные
+				result = own
+
+				for call, pending in self.call_sites(func, convention, clobbers):
+					callee = depth.get(call.func_name)
+
+					if callee is None:
+						continue
+
+					layout = convention.layout(call.func_name, len(call.args))
+					arguments = 2 * sum(not layout.argument_register(index) for index in range(len(call.args)))
+
+					# Сохранённые регистры, аргументы, адрес возврата и стек вызываемой функции
+					result = max(result, own + pending + arguments + 2 + callee)
+
+				depth[name] = result
+
+		return {name: depth.get(name) for name in self.functions}
+
+	def dump(self, convention, sizes: Dict[str, int] = None, frames: Dict[str, int] = None, root: str = "main", clobbers=None) -> str:
+		"""Текстовое представление графа вызовов"""
+		sizes = sizes or {}
+		depth = self.stack_depth(convention, frames, clobbers)
+		lines = ["Call graph:"]
+
+		for name in self.functions:
+			size = f"{sizes[name]} bytes" if name in sizes else "unknown"
+			stack = f"{depth[name]} bytes" if depth[name] is not None else "unbounded (recursion)"
+
+			lines.append(f"{name}: size {size}, stack depth {stack}")
+
+			for callee in self.callees[name]:
+				lines.append(f"\t-> {callee}")
+
+			for callee in self.undefined[name]:
+				lines.append(f"\t-> {callee} (undefined)")
+
+		for cycle in self.cycles():
+			lines.append(f"recursion: {' -> '.join(cycle + [cycle[0]])}")
+
+		if root in self.functions:
+			stack = f"{depth[root]} bytes" if depth[root] is not None else "unbounded (recursion)"
+			lines.append(f"worst-case stack depth from {root}: {stack}")
+
+		return "\n".join(lines)
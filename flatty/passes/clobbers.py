@@ -0,0 +1,263 @@
+from typing import List, Set
+from ast import *
+from arch.x86.modes.realmode import OVERWRITE_OPCODES
+from passes.callgraph import CallGraph
+from passes.walk import iter_expression
+from passes.effects import (
+	written_registers, expression_reads, expression_writes,
+	instruction_reads, instruction_kills
+)
+
+RESULT_REGISTER = "ax" # Результат функции, его никогда не сохраняют
+PRESERVED_REGISTERS = frozenset(["bp", "sp"]) # Восстанавливаются самой функцией
+
+def outer_calls(expr) -> List[CallFunc]:
+	"""Вызовы в выражении, не вложенные в аргументы других вызовов"""
+	if isinstance(expr, CallFunc):
+		return [expr]
+	elif isinstance(expr, BinaryOperation):
+		return outer_calls(expr.left) + outer_calls(expr.right)
+	elif isinstance(expr, UnaryOperation):
+		return outer_calls(expr.operand)
+
+	return []
+
+class ClobberAnalysis:
+	"""Межпроцедурный анализ портящихся регистров.
+
+	Для каждой функции вычисляется множество регистров, которые она изменяет, и множество
+	регистров, которые она читает до записи, с учётом вызываемых функций. Для каждого вызова вычисляются регистры, живые после вызова,
+	и вызывающая функция сохраняет только те из них, которые портит вызываемая"""
+	def __init__(self, program: Program, call_graph: CallGraph, convention):
+		self.program = program
+		self.call_graph = call_graph
+		self.convention = convention
+		self.clobbers = {func.name: set() for func in program.functions}
+		self.live_on_entry = {func.name: set() for func in program.functions} # Регистры, живые при входе в функцию
+		self.live_after = {} # id(CallFunc) -> регистры, живые после вызова
+		self.sites = [] # Вызовы в анализируемой функции
+		self.loops = {} # (id(цикл), живые после цикла) -> живые перед циклом
+		self.parameters = {} # Параметры анализируемой функции, переданные в регистрах: имя -> регистр
+
+	def analyze(self) -> "ClobberAnalysis":
+		"""Вычисление до неподвижной точки (рекурсивные функции)"""
+		changed = True
+
+		while changed:
+			changed = False
+
+			for func in self.program.functions:
+				clobbers, live = self.analyze_function(func)
+
+				if clobbers != self.clobbers[func.name] or live != self.live_on_entry[func.name]:
+					self.clobbers[func.name] = clobbers
+					self.live_on_entry[func.name] = live
+					changed = True
+
+		return self
+
+	def saved_registers(self, call: CallFunc) -> List[str]:
+		"""Регистры, которые нужно сохранить вокруг вызова"""
+		clobbers = self.clobbers.get(call.func_name)
+
+		if clobbers is None:
+			return []
+
+		live = self.live_after.get(id(call), set())
+
+		# Вызов загружает свои аргументы в регистры: их значения до вызова теряются
+		clobbers = clobbers | self.argument_registers(call)
+
+		return sorted((live & clobbers) - {RESULT_REGISTER} - PRESERVED_REGISTERS)
+
+	def argument_registers(self, call: CallFunc) -> Set[str]:
+		"""Регистры, в которых вызов передаёт аргументы"""
+		layout = self.convention.layout(call.func_name, len(call.args))
+
+		return {layout.argument_register(index) for index in range(len(call.args))} - {None}
+
+	def parameter_registers(self, func: Func) -> dict:
+		"""Параметры функции, переданные в регистрах: имя -> регистр"""
+		layout = self.convention.layout(func.name, len(func.params))
+
+		return {
+			param: layout.argument_register(index)
+			for index, param in enumerate(func.params) if layout.argument_register(index)
+		}
+
+	def parameter_reads(self, expr) -> Set[str]:
+		"""Регистры параметров, которые читает выражение. Левая часть присваивания не читается"""
+		if not self.parameters:
+			return set()
+
+		if isinstance(expr, BinaryOperation) and expr.operation == "=":
+			return self.parameter_reads(expr.right)
+
+		return {
+			self.parameters[node.name] for node in iter_expression(expr)
+			if isinstance(node, Parameter) and node.name in self.parameters
+		}
+
+	def instruction_parameters(self, node: Instruction):
+		"""Регистры параметров, которые инструкция читает, и которые она перезаписывает целиком"""
+		reads, kills = set(), set()
+
+		for index, operand in enumerate(node.operands):
+			if (index == 0 and isinstance(operand, Parameter) and operand.name in self.parameters
+				and node.opcode in OVERWRITE_OPCODES
+			):
+				kills.add(self.parameters[operand.name])
+			elif not isinstance(operand, CallFunc):
+				reads |= self.parameter_reads(operand)
+
+		return reads, kills
+
+	def analyze_function(self, func: Func):
+		"""Регистры, которые изменяет функция, и регистры, живые при входе в неё, с учётом вызовов"""
+		self.sites = []
+		self.loops = {}
+		self.parameters = self.parameter_registers(func)
+		live = self.live_in(func.body, set())
+
+		clobbers = written_registers(func.body)
+
+		for call in self.sites:
+			if call.func_name not in self.clobbers:
+				continue
+
+			arguments = self.argument_registers(call)
+			saved = self.live_after[id(call)] - {RESULT_REGISTER}
+
+			clobbers |= arguments
+			clobbers |= (self.clobbers[call.func_name] | {RESULT_REGISTER}) - saved
+
+		return clobbers - PRESERVED_REGISTERS, live - PRESERVED_REGISTERS
+
+	def live_in(self, body: List, live_out: Set[str]) -> Set[str]:
+		"""Живые регистры перед блоком"""
+		live = set(live_out)
+
+		for statement in reversed(body):
+			live = self.statement_live(statement, live)
+
+		return live
+
+	def statement_live(self, node: ASTNode, live: Set[str]) -> Set[str]:
+		"""Живые регистры перед оператором"""
+		if isinstance(node, (WhileDoLoop, DoWhileLoop, CountLoop, ForLoop)):
+			# Внешний цикл пересчитывает вложенные на каждой итерации. Без запоминания
+			# время растёт экспоненциально от глубины вложенности
+			key = (id(node), frozenset(live))
+
+			if key not in self.loops:
+				self.loops[key] = self.loop_live(node, live)
+
+			return set(self.loops[key])
+		elif isinstance(node, Instruction):
+			reads, kills = self.instruction_parameters(node)
+			live = (live - instruction_kills(node) - kills) | instruction_reads(node) | reads
+
+			# Вызовы в операндах выполняются до инструкции
+			for operand in reversed(node.operands):
+				if isinstance(operand, CallFunc):
+					live = self.call_live(operand, live)
+
+			return live
+		elif isinstance(node, CallFunc):
+			return self.call_live(node, live)
+		elif isinstance(node, IfElseChain):
+			if node.else_branch:
+				rest = self.live_in(node.else_branch.body, live)
+			else:
+				rest = set(live)
+
+			for branch in reversed([node.if_branch] + (node.elseif_branches or [])):
+				rest = self.expression_live(branch.condition, self.live_in(branch.body, live) | rest)
+
+			return rest
+
+		return live
+
+	def loop_live(self, node: ASTNode, live: Set[str]) -> Set[str]:
+		"""Живые регистры перед циклом: итерация до неподвижной точки"""
+		if isinstance(node, WhileDoLoop):
+			condition = set()
+
+			while True:
+				updated = self.expression_live(node.condition, live | self.live_in(node.body, condition))
+
+				if updated == condition:
+					return condition
+
+				condition = updated
+		elif isinstance(node, DoWhileLoop):
+			body = set()
+
+			while True:
+				updated = self.live_in(node.body, self.expression_live(node.condition, live | body))
+
+				if updated == body:
+					return body
+
+				body = updated
+		elif isinstance(node, CountLoop):
+			body = set()
+
+			# loop уменьшает cx и проверяет его после тела, jcxz - перед входом
+			while True:
+				updated = self.live_in(node.body, live | body | {"cx"}) | {"cx"}
+
+				if updated == body:
+					return body
+
+				body = updated
+		elif isinstance(node, ForLoop):
+			condition = set()
+
+			while True:
+				after_body = self.expression_live(node.operation, condition)
+				updated = self.expression_live(node.condition, live | self.live_in(node.body, after_body))
+
+				if updated == condition:
+					return self.expression_live(node.counter, condition)
+
+				condition = updated
+
+		return live
+
+	def expression_live(self, expr, live: Set[str]) -> Set[str]:
+		"""Живые регистры перед вычислением выражения (условия, счётчика цикла)"""
+		if expr is None:
+			return set(live)
+
+		live = (live - expression_writes(expr)) | expression_reads(expr) | self.parameter_reads(expr)
+
+		for call in reversed(outer_calls(expr)):
+			live = self.call_live(call, live)
+
+		return live
+
+	def call_live(self, call: CallFunc, live: Set[str]) -> Set[str]:
+		"""Живые регистры перед вызовом. Запоминает регистры, живые после него.
+		Внутри циклов множество только растёт до неподвижной точки, поэтому значения объединяются:
+		вложенный цикл из кэша не пересчитывается на последней итерации внешнего"""
+		self.live_after[id(call)] = self.live_after.get(id(call), set()) | live
+		self.sites.append(call)
+
+		# Живые регистры сохраняются вокруг вызова, результат возвращается в AX.
+		# Регистры, которые вызываемая функция читает до записи, кроме аргументов, живы перед вызовом
+		live = live - {RESULT_REGISTER}
+
+		if call.func_name in self.live_on_entry:
+			live |= self.live_on_entry[call.func_name] - self.argument_registers(call)
+
+		for arg in call.args:
+			if not isinstance(arg, CallFunc):
+				live |= expression_reads(arg) | self.parameter_reads(arg)
+
+		# Вложенные вызовы в аргументах выполняются до внешнего
+		for arg in reversed(call.args):
+			if isinstance(arg, CallFunc):
+				live = self.call_live(arg, live)
+
+		return live
@@ -0,0 +1,84 @@
+import sys
+from ast import *
+
+WORD_MASK = 0xFFFF # Все вычисления ведутся в 16 битном слове с переполнением
+
+def divide(left: int, right: int) -> int:
+	"""Беззнаковое деление как у оператора / в NASM"""
+	if right == 0:
+		print("error: division by zero in constant expression")
+		sys.exit()
+
+	return left // right
+
+BINARY_OPERATIONS = {
+	"+": lambda left, right: left + right,
+	"-": lambda left, right: left - right,
+	"*": lambda left, right: left * right,
+	"/": divide,
+	"<": lambda left, right: int(left < right),
+	">": lambda left, right: int(left > right),
+	"<=": lambda left, right: int(left <= right),
+	">=": lambda left, right: int(left >= right),
+	"==": lambda left, right: int(left == right),
+	"!=": lambda left, right: int(left != right),
+	"&&": lambda left, right: int(bool(left) and bool(right)),
+	"||": lambda left, right: int(bool(left) or bool(right)),
+}
+
+UNARY_OPERATIONS = {
+	("++", "prefix"): lambda value: value + 1,
+	("--", "prefix"): lambda value: value - 1,
+	("++", "postfix"): lambda value: value, # Значение выражения x++ равно x
+	("--", "postfix"): lambda value: value,
+}
+
+def literal_value(node):
+	"""Значение литерала или None если узел не является числовой константой"""
+	if isinstance(node, Literal) and str(node.value).isdigit():
+		return int(node.value) & WORD_MASK
+
+	return None
+
+class ConstantFolder(NodeTransformer):
+	"""Свёртка константных выражений на этапе компиляции"""
+	prefix = "fold_"
+
+	def __init__(self, program: Program):
+		self.program = program
+		self.folded = 0 # Количество свёрнутых операций
+
+	def fold(self) -> Program:
+		"""Свёртка констант во всех функциях программы"""
+		for func in self.program.functions:
+			self.visit(func)
+
+		return self.program
+
+	def fold_binary_operation(self, node: BinaryOperation):
+		"""Свёртка бинарной операции над литералами в один литерал"""
+		node.left = self.visit(node.left)
+		node.right = self.visit(node.right)
+
+		left = literal_value(node.left)
+		right = literal_value(node.right)
+		operation = BINARY_OPERATIONS.get(node.operation)
+
+		if left is not None and right is not None and operation:
+			self.folded += 1
+			return Literal(str(operation(left, right) & WORD_MASK))
+
+		return node
+
+	def fold_unary_operation(self, node: UnaryOperation):
+		"""Свёртка унарной операции над литералом"""
+		node.operand = self.visit(node.operand)
+
+		value = literal_value(node.operand)
+		operation = UNARY_OPERATIONS.get((node.operation, node.type))
+
+		if value is not None and operation:
+			self.folded += 1
+			return Literal(str(operation(value) & WORD_MASK))
+
+		return node
@@ -0,0 +1,91 @@
+from typing import List, Set
+from ast import *
+from arch.x86.modes.realmode import REGISTER_FAMILIES, WRITE_OPCODES, IMPLICIT_WRITES, IMPLICIT_READS, OVERWRITE_OPCODES
+from passes.walk import iter_statements, statement_expressions, iter_expression
+
+def expression_writes(expr) -> Set[str]:
+	"""Регистры, которые изменяет выражение (cx = 0, cx++ и т.д.)"""
+	written = set()
+
+	for node in iter_expression(expr):
+		if isinstance(node, BinaryOperation) and node.operation == "=" and isinstance(node.left, Register):
+			written.add(REGISTER_FAMILIES[node.left.name])
+		elif isinstance(node, UnaryOperation) and isinstance(node.operand, Register):
+			written.add(REGISTER_FAMILIES[node.operand.name])
+
+	return written
+
+def instruction_writes(instruction: Instruction) -> Set[str]:
+	"""Регистры, которые изменяет инструкция"""
+	written = set(IMPLICIT_WRITES.get(instruction.opcode, ()))
+
+	if (instruction.opcode in WRITE_OPCODES
+		and instruction.operands
+		and isinstance(instruction.operands[0], Register)
+	):
+		written.add(REGISTER_FAMILIES[instruction.operands[0].name])
+
+	return written
+
+def expression_reads(expr) -> Set[str]:
+	"""Регистры, которые читает выражение. Левая часть присваивания не читается"""
+	read = set()
+
+	if isinstance(expr, BinaryOperation) and expr.operation == "=":
+		return expression_reads(expr.right)
+
+	for node in iter_expression(expr):
+		if isinstance(node, Register):
+			read.add(REGISTER_FAMILIES[node.name])
+
+	return read
+
+def instruction_reads(instruction: Instruction) -> Set[str]:
+	"""Регистры, которые читает инструкция (без учёта вызовов в операндах)"""
+	read = set(IMPLICIT_READS.get(instruction.opcode, ()))
+	operands = instruction.operands
+
+	# xor ax, ax - обнуление, значение регистра не читается
+	if instruction.opcode == "xor" and len(operands) == 2 and repr(operands[0]) == repr(operands[1]):
+		return read
+
+	for index, operand in enumerate(operands):
+		if isinstance(operand, CallFunc):
+			continue
+
+		if index == 0 and isinstance(operand, Register) and instruction.opcode in OVERWRITE_OPCODES:
+			# Запись в 8 битный регистр сохраняет вторую половину 16 битного
+			if REGISTER_FAMILIES[operand.name] == operand.name:
+				continue
+
+		read |= expression_reads(operand)
+
+	return read
+
+def instruction_kills(instruction: Instruction) -> Set[str]:
+	"""16 битные регистры, значение которых инструкция полностью перезаписывает"""
+	killed = set(IMPLICIT_WRITES.get(instruction.opcode, ()))
+
+	if (instruction.opcode in WRITE_OPCODES
+		and instruction.operands
+		and isinstance(instruction.operands[0], Register)
+		and REGISTER_FAMILIES[instruction.operands[0].name] == instruction.operands[0].name
+	):
+		killed.add(instruction.operands[0].name)
+
+	return killed
+
+def written_registers(body: List) -> Set[str]:
+	"""16 битные регистры, которые изменяет блок без учёта вызываемых функций"""
+	written = set()
+
+	for statement in iter_statements(body):
+		if isinstance(statement, Instruction):
+			written |= instruction_writes(statement)
+		elif isinstance(statement, CountLoop):
+			written.add("cx")
+
+		for expr in statement_expressions(statement):
+			written |= expression_writes(expr)
+
+	return written
@@ -0,0 +1,211 @@
+import copy
+from typing import List, Set
+from ast import *
+from arch.x86.modes.realmode import REGISTER_FAMILIES, REGISTERS_8
+from passes.walk import child_bodies, iter_statements, statement_expressions, iter_expression, iter_calls
+from passes.effects import written_registers
+from passes.clobbers import ClobberAnalysis, RESULT_REGISTER
+from arch.x86.calling import StackCallingConvention
+
+INLINE_THRESHOLD = 4 # Максимальная стоимость встраиваемой функции
+MAX_ROUNDS = 4 # Количество проходов: после встраивания вызывающая функция сама может стать листовой
+
+def body_cost(body: List) -> int:
+	"""Оценка размера блока в инструкциях"""
+	cost = 0
+
+	for node in body:
+		if isinstance(node, Instruction):
+			cost += 1
+		else:
+			# Сравнение и переход на каждую ветку или итерацию
+			cost += 2 * max(len(child_bodies(node)), 1)
+
+			for child in child_bodies(node):
+				cost += body_cost(child)
+
+	return cost
+
+def call_cost(func: Func) -> int:
+	"""Стоимость вызова функции в инструкциях: аргументы, call, кадр стека, ret, очистка стека"""
+	cost = len(func.params) + 2
+
+	if func.params:
+		cost += 4 # push bp / mov bp, sp / pop bp / add sp, N
+
+	return cost
+
+def substitute(node, mapping: dict):
+	"""Замена параметров функции на аргументы вызова"""
+	if isinstance(node, Parameter):
+		return mapping.get(node.name, node)
+	elif isinstance(node, BinaryOperation):
+		node.left = substitute(node.left, mapping)
+		node.right = substitute(node.right, mapping)
+	elif isinstance(node, UnaryOperation):
+		node.operand = substitute(node.operand, mapping)
+	elif isinstance(node, CallFunc):
+		node.args = [substitute(arg, mapping) for arg in node.args]
+	elif isinstance(node, Instruction):
+		node.operands = [substitute(operand, mapping) for operand in node.operands]
+	elif isinstance(node, IfElseChain):
+		for branch in [node.if_branch] + (node.elseif_branches or []):
+			branch.condition = substitute(branch.condition, mapping)
+	elif isinstance(node, (WhileDoLoop, DoWhileLoop)):
+		node.condition = substitute(node.condition, mapping)
+	elif isinstance(node, ForLoop):
+		node.counter = substitute(node.counter, mapping)
+		node.condition = substitute(node.condition, mapping)
+		node.operation = substitute(node.operation, mapping)
+
+	for child in child_bodies(node):
+		for statement in child:
+			substitute(statement, mapping)
+
+	return node
+
+class Inliner:
+	"""Встраивание маленьких листовых функций в места вызова"""
+	def __init__(self, program: Program, threshold: int = INLINE_THRESHOLD):
+		self.program = program
+		self.threshold = threshold
+		self.inlined = 0 # Количество встроенных вызовов
+
+	def inline(self) -> Program:
+		"""Встраивание функций"""
+		for _ in range(MAX_ROUNDS):
+			candidates = {func.name: func for func in self.program.functions if self.is_candidate(func)}
+
+			if not candidates:
+				break
+
+			inlined = self.inlined
+
+			# Регистры, живые после каждого вызова. Регистры, которые встраиваемая функция читает
+			# до записи, живы перед её вызовом, поэтому после встраивания живые множества остаются верными
+			live_after = ClobberAnalysis(self.program, None, StackCallingConvention(self.program)).analyze().live_after
+
+			for func in self.program.functions:
+				func.body = self.inline_body(func.body, candidates, func, live_after)
+
+			if self.inlined == inlined:
+				break
+
+		return self.program
+
+	def is_candidate(self, func: Func) -> bool:
+		"""Можно ли встраивать функцию"""
+		if func.name == "main" or func.noinline:
+			return False
+
+		if body_cost(func.body) > self.threshold:
+			return False
+
+		# Только листовые функции
+		if next(iter_calls(func.body), None) is not None:
+			return False
+
+		for statement in iter_statements(func.body):
+			for expr in statement_expressions(statement):
+				for node in iter_expression(expr):
+					# Код, работающий с кадром стека напрямую, встраивать нельзя
+					if isinstance(node, Register) and node.name in ("bp", "sp"):
+						return False
+
+					# Переменные встроенной функции смешались бы с переменными вызывающей
+					if isinstance(node, Variable):
+						return False
+
+			# Запись в параметр изменяет копию аргумента в стеке, а не аргумент
+			if (isinstance(statement, Instruction)
+				and statement.operands
+				and isinstance(statement.operands[0], Parameter)
+			):
+				return False
+
+		return True
+
+	def can_substitute(self, func: Func, args: List, live_after: Set[str] = frozenset()) -> bool:
+		"""Можно ли подставить аргументы вызова вместо параметров.
+		live_after - регистры, живые после вызова"""
+		if len(args) != len(func.params):
+			return False
+
+		written = written_registers(func.body)
+
+		# Вызов сохраняет живые регистры, которые портит функция, а встроенный код нет
+		if (written - {RESULT_REGISTER}) & live_after:
+			return False
+		mapping = dict(zip(func.params, args))
+
+		for param, arg in mapping.items():
+			# Переменная, как и параметр, не изменяется встроенным кодом: он не пишет в параметры
+			if isinstance(arg, (Literal, Parameter, Variable)):
+				continue
+
+			if not isinstance(arg, Register) or REGISTER_FAMILIES[arg.name] in written | {"bp", "sp"}:
+				return False
+
+		for statement in iter_statements(func.body):
+			if not isinstance(statement, Instruction):
+				continue
+
+			for operand in statement.operands:
+				if not isinstance(operand, Parameter):
+					continue
+
+				arg = mapping[operand.name]
+
+				# mul принимает только регистр или память
+				if isinstance(arg, Literal) and statement.opcode != "mov" and len(statement.operands) < 2:
+					return False
+
+				# Параметр в стеке можно читать как байт, а 16 битный регистр нет
+				if isinstance(arg, Register) and any(
+					isinstance(other, Register) and other.name in REGISTERS_8 for other in statement.operands
+				):
+					return False
+
+		return True
+
+	def expand(self, func: Func, args: List) -> List:
+		"""Копия тела функции с подставленными аргументами"""
+		mapping = dict(zip(func.params, args))
+
+		return [substitute(copy.deepcopy(statement), mapping) for statement in func.body]
+
+	def inline_body(self, body: List, candidates: dict, caller: Func, live_after: dict) -> List:
+		"""Встраивание вызовов в блоке. live_after - регистры, живые после каждого вызова"""
+		result = []
+
+		for node in body:
+			callee = None
+
+			if isinstance(node, CallFunc):
+				callee = candidates.get(node.func_name)
+
+			if callee and callee is not caller and self.can_substitute(callee, node.args, live_after.get(id(node), set())):
+				result.extend(self.expand(callee, node.args))
+				self.inlined += 1
+				continue
+
+			# Порядок вызовов сохраняется только если в инструкции один вызов
+			if isinstance(node, Instruction) and sum(isinstance(operand, CallFunc) for operand in node.operands) == 1:
+				for i, operand in enumerate(node.operands):
+					if not isinstance(operand, CallFunc):
+						continue
+
+					callee = candidates.get(operand.func_name)
+
+					if callee and callee is not caller and self.can_substitute(callee, operand.args, live_after.get(id(operand), set())):
+						# Результат функции возвращается в регистре AX
+						result.extend(self.expand(callee, operand.args))
+						node.operands[i] = Register("ax")
+						self.inlined += 1
+
+			for child in child_bodies(node):
+				child[:] = self.inline_body(child, candidates, caller, live_after)
+
+			result.append(node)
+
+		return result
@@ -0,0 +1,496 @@
+import copy
+from typing import List, Optional, Set, Tuple
+from ast import *
+from arch.x86.modes.realmode import REGISTER_FAMILIES
+from arch.x86.calling import RegisterCallingConvention
+from passes.callgraph import CallGraph
+from passes.effects import written_registers, instruction_reads, instruction_writes, expression_reads, expression_writes
+from passes.inlining import body_cost
+from passes.walk import iter_statements, statement_expressions, iter_expression, iter_calls
+
+WORD_MASK = 0xFFFF
+UNROLL_LIMIT = 4 # Максимальное число итераций разворачиваемого цикла
+UNROLL_COST = 16 # Максимальный размер развёрнутого цикла в инструкциях
+
+# Свободные регистры для индуктивных переменных, в порядке предпочтения
+SCRATCH_REGISTERS = ("si", "di", "bx")
+
+LOOPS = (WhileDoLoop, DoWhileLoop, ForLoop, CountLoop)
+
+# Опкоды, которые разрешены в чистых функциях
+PURE_OPCODES = frozenset(["mov", "add", "sub", "shl", "shr", "inc", "dec", "xor"])
+
+COMPARISONS = {
+	"<": lambda left, right: left < right,
+	">": lambda left, right: left > right,
+	"<=": lambda left, right: left <= right,
+	">=": lambda left, right: left >= right,
+	"==": lambda left, right: left == right,
+	"!=": lambda left, right: left != right,
+}
+
+MIRROR = {"==": "==", "!=": "!=", "<": ">", ">": "<", "<=": ">=", ">=": "<="}
+
+def memory_location(node) -> Optional[str]:
+	"""Ячейка памяти операнда: параметр в стеке (param:имя) или переменная в кадре (slot:смещение)"""
+	if isinstance(node, Parameter):
+		return f"param:{node.name}"
+	elif isinstance(node, StackSlot):
+		return f"slot:{node.offset}"
+
+	return None
+
+def literal(node) -> Optional[int]:
+	if isinstance(node, Literal) and node.value.isdigit():
+		return int(node.value) & WORD_MASK
+
+	return None
+
+class InductionVariable:
+	"""Счётчик цикла for вида (r = a; r op b; r++ / r--)"""
+	__slots__ = ("register", "init", "operation", "limit", "step")
+
+	def __init__(self, register: str, init: Optional[int], operation: str, limit: Optional[int], step: int):
+		self.register = register
+		self.init = init
+		self.operation = operation
+		self.limit = limit
+		self.step = step
+
+	def trip_count(self) -> Optional[int]:
+		"""Число итераций или None, если оно неизвестно или цикл бесконечен"""
+		if self.init is None or self.limit is None:
+			return None
+
+		compare = COMPARISONS[self.operation]
+		value = self.init
+		count = 0
+
+		while compare(value, self.limit):
+			count += 1
+			value = (value + self.step) & WORD_MASK
+
+			if count > WORD_MASK:
+				return None
+
+		return count
+
+	def values(self) -> List[int]:
+		"""Значения счётчика на каждой итерации (только для известного числа итераций)"""
+		return [(self.init + self.step * i) & WORD_MASK for i in range(self.trip_count())]
+
+def induction_variable(node: ForLoop) -> Optional[InductionVariable]:
+	"""Разбор заголовка цикла for"""
+	counter, condition, operation = node.counter, node.condition, node.operation
+
+	if not (isinstance(counter, BinaryOperation) and counter.operation == "=" and isinstance(counter.left, Register)):
+		return None
+
+	register = counter.left.name
+
+	if REGISTER_FAMILIES[register] != register:
+		return None
+
+	if not (isinstance(operation, UnaryOperation)
+		and operation.operation in ("++", "--")
+		and isinstance(operation.operand, Register)
+		and operation.operand.name == register
+	):
+		return None
+
+	if not isinstance(condition, BinaryOperation) or condition.operation not in COMPARISONS:
+		return None
+
+	if isinstance(condition.left, Register) and condition.left.name == register:
+		comparison, limit = condition.operation, condition.right
+	elif isinstance(condition.right, Register) and condition.right.name == register:
+		comparison, limit = MIRROR[condition.operation], condition.left
+	else:
+		return None
+
+	if not isinstance(limit, Literal):
+		return None
+
+	return InductionVariable(register, literal(counter.right), comparison, literal(limit), 1 if operation.operation == "++" else -1)
+
+class LoopOptimizer:
+	"""Оптимизация циклов: инструкция loop, снижение стоимости умножения на счётчик,
+	вынос инвариантов из тела и разворачивание коротких циклов"""
+	def __init__(self, program: Program, call_graph: CallGraph, unroll: bool = False):
+		self.program = program
+		self.call_graph = call_graph
+		self.unroll = unroll
+		self.stats = {"loop": 0, "strength-reduction": 0, "hoisted": 0, "unrolled": 0, "removed": 0}
+		self.func = None
+
+		self.callee_registers = self.collect_callee_registers() if self.has_loops() else {}
+		self.pure = {func.name for func in program.functions if self.is_pure(func)}
+
+	def has_loops(self) -> bool:
+		return any(
+			isinstance(statement, LOOPS)
+			for func in self.program.functions
+			for statement in iter_statements(func.body)
+		)
+
+	def collect_callee_registers(self) -> dict:
+		"""Регистры, которые упоминает каждая функция вместе со всеми вызываемыми. Компоненты
+		сильной связности обходятся от вызываемых к вызывающим, поэтому каждая функция
+		объединяет только свои регистры и готовые множества прямых вызываемых"""
+		mentioned = {func.name: RegisterCallingConvention.mentioned_registers(func) for func in self.program.functions}
+		registers = {}
+
+		for component in self.call_graph.components():
+			result = set().union(*(mentioned[name] for name in component))
+
+			for name in component:
+				for callee in self.call_graph.callees[name]:
+					result |= registers.get(callee, set())
+
+			for name in component:
+				registers[name] = set(result)
+
+		return registers
+
+	def optimize(self) -> Program:
+		"""Оптимизация циклов во всех функциях"""
+		for func in self.program.functions:
+			self.func = func
+			func.body = self.optimize_body(func.body)
+
+		return self.program
+
+	def is_pure(self, func: Func) -> bool:
+		"""Функция без побочных эффектов: меняет только AX и не пишет в память"""
+		if next(iter_calls(func.body), None) is not None:
+			return False
+
+		if written_registers(func.body) - {"ax"}:
+			return False
+
+		for statement in iter_statements(func.body):
+			if isinstance(statement, Instruction):
+				if statement.opcode not in PURE_OPCODES:
+					return False
+
+				if statement.operands and memory_location(statement.operands[0]):
+					return False
+
+		return True
+
+	def optimize_body(self, body: List) -> List:
+		"""Оптимизация циклов в блоке, начиная с вложенных"""
+		result = []
+
+		for node in body:
+			if isinstance(node, IfElseChain):
+				for branch in [node.if_branch] + (node.elseif_branches or []):
+					branch.body = self.optimize_body(branch.body)
+
+				if node.else_branch:
+					node.else_branch.body = self.optimize_body(node.else_branch.body)
+			elif isinstance(node, (WhileDoLoop, DoWhileLoop, ForLoop)):
+				node.body = self.optimize_body(node.body)
+
+			if isinstance(node, ForLoop):
+				result.extend(self.optimize_for_loop(node))
+			elif isinstance(node, WhileDoLoop):
+				result.extend(self.optimize_while_do_loop(node))
+			elif isinstance(node, DoWhileLoop):
+				result.extend(self.hoist_invariants(node, [node.condition]))
+				result.append(node)
+			else:
+				result.append(node)
+
+		return result
+
+	# Эффекты операторов
+
+	@staticmethod
+	def split(nodes: List) -> Tuple[List, List]:
+		"""Операторы (включая вложенные) и выражения, которые они содержат.
+		В nodes могут быть и операторы, и выражения заголовка цикла"""
+		statements, expressions = [], []
+
+		for node in nodes:
+			if node is None:
+				continue
+
+			if isinstance(node, (Instruction, CallFunc, IfElseChain, WhileDoLoop, DoWhileLoop, ForLoop, CountLoop)):
+				for statement in iter_statements([node]):
+					statements.append(statement)
+					expressions += statement_expressions(statement)
+			else:
+				expressions.append(node)
+
+		return statements, expressions
+
+	def reads(self, nodes: List) -> Set[str]:
+		"""Регистры и ячейки памяти (memory_location), которые могут читать операторы с учётом вызываемых функций"""
+		statements, expressions = self.split(nodes)
+		read = set()
+
+		for statement in statements:
+			if isinstance(statement, Instruction):
+				read |= instruction_reads(statement)
+			elif isinstance(statement, CountLoop):
+				read.add("cx")
+
+		for expr in expressions:
+			if not isinstance(expr, (Register, Literal)):
+				read |= expression_reads(expr)
+
+			for child in iter_expression(expr):
+				if memory_location(child):
+					read.add(memory_location(child))
+				elif isinstance(child, CallFunc):
+					read |= self.callee_registers.get(child.func_name, set())
+
+		return read
+
+	def writes(self, nodes: List) -> Set[str]:
+		"""Регистры и ячейки памяти (memory_location), которые могут изменять операторы с учётом вызываемых функций"""
+		statements, expressions = self.split(nodes)
+		written = set()
+
+		for expr in expressions:
+			written |= expression_writes(expr)
+
+			for child in iter_expression(expr):
+				if isinstance(child, CallFunc):
+					written |= self.callee_registers.get(child.func_name, set())
+
+		for statement in statements:
+			if isinstance(statement, Instruction):
+				written |= instruction_writes(statement)
+
+				if statement.operands and memory_location(statement.operands[0]):
+					written.add(memory_location(statement.operands[0]))
+			elif isinstance(statement, CountLoop):
+				written.add("cx")
+
+		return written
+
+	# Вынос инвариантов
+
+	def is_hoist_candidate(self, node: ASTNode) -> bool:
+		"""Оператор, который можно вынести: запись в регистр без побочных эффектов"""
+		if isinstance(node, CallFunc):
+			return node.func_name in self.pure and all(not isinstance(arg, CallFunc) for arg in node.args)
+
+		if not isinstance(node, Instruction) or len(node.operands) != 2:
+			return False
+
+		target, source = node.operands
+
+		if not isinstance(target, Register) or target.name in ("sp", "bp"):
+			return False
+
+		if node.opcode == "xor":
+			return isinstance(source, Register) and source.name == target.name
+
+		if node.opcode != "mov":
+			return False
+
+		if isinstance(source, CallFunc):
+			return self.is_hoist_candidate(source)
+
+		return isinstance(source, (Literal, Register, Parameter, StackSlot))
+
+	def hoist_invariants(self, loop: ASTNode, header: List) -> List:
+		"""Вынос инвариантных операторов из тела цикла, который выполняется хотя бы один раз.
+		header - условие и шаг цикла. Возвращает операторы, которые нужно поставить перед циклом"""
+		hoisted = []
+		changed = True
+
+		while changed:
+			changed = False
+
+			for index, node in enumerate(loop.body):
+				if not self.is_hoist_candidate(node):
+					continue
+
+				rest = loop.body[:index] + loop.body[index + 1:]
+				node_writes = self.writes([node])
+				node_reads = self.reads([node])
+
+				if node_reads & (self.writes(rest) | self.writes(header)):
+					continue
+
+				if node_writes & (self.writes(rest) | self.writes(header) | node_reads):
+					continue
+
+				if node_writes & (self.reads(loop.body[:index]) | self.reads(header)):
+					continue
+
+				hoisted.append(loop.body.pop(index))
+				self.stats["hoisted"] += 1
+				changed = True
+				break
+
+		return hoisted
+
+	# Снижение стоимости умножения на счётчик
+
+	def free_register(self) -> Optional[str]:
+		"""Регистр, который не использует ни текущая функция, ни вызываемые ей"""
+		busy = self.callee_registers[self.func.name]
+
+		for register in SCRATCH_REGISTERS:
+			if register not in busy:
+				return register
+
+		return None
+
+	def reduce_strength(self, node: ForLoop, variable: InductionVariable) -> List:
+		"""mov ax, K / mul i в теле цикла -> mov ax, r, где r увеличивается на K каждую итерацию.
+		Возвращает операторы, которые нужно поставить перед циклом"""
+		if variable.trip_count() is None or variable.register in written_registers(node.body):
+			return []
+
+		body = node.body
+		result = []
+
+		for index in range(len(body) - 1):
+			first, second = body[index], body[index + 1]
+
+			if not (isinstance(first, Instruction) and isinstance(second, Instruction)):
+				continue
+
+			if not (first.opcode == "mov"
+				and len(first.operands) == 2
+				and isinstance(first.operands[0], Register)
+				and first.operands[0].name == "ax"
+				and literal(first.operands[1]) is not None
+				and second.opcode == "mul"
+				and len(second.operands) == 1
+				and isinstance(second.operands[0], Register)
+				and second.operands[0].name == variable.register
+			):
+				continue
+
+			factor = literal(first.operands[1])
+
+			# Произведение должно помещаться в слово: тогда mul записывает в dx ноль
+			if any(factor * value > WORD_MASK for value in variable.values()):
+				continue
+
+			register = self.free_register()
+
+			if register is None:
+				break
+
+			self.callee_registers[self.func.name] = self.callee_registers[self.func.name] | {register}
+
+			body[index:index + 2] = [
+				Instruction("mov", [Register("ax"), Register(register)]),
+				Instruction("xor", [Register("dx"), Register("dx")]),
+			]
+			body.append(Instruction("add" if variable.step > 0 else "sub", [Register(register), Literal(str(factor))]))
+			result.append(Instruction("mov", [Register(register), Literal(str(factor * variable.init & WORD_MASK))]))
+
+			self.stats["strength-reduction"] += 1
+
+		return result
+
+	# Циклы
+
+	def optimize_for_loop(self, node: ForLoop) -> List:
+		"""Оптимизация цикла for"""
+		variable = induction_variable(node)
+
+		if variable is None:
+			return [node]
+
+		register = Register(variable.register)
+		trip_count = variable.trip_count()
+		uses_counter = variable.register in self.reads(node.body) | self.writes(node.body)
+		result = []
+
+		if trip_count == 0:
+			# Тело не выполняется ни разу: остаётся только инициализация счётчика
+			self.stats["removed"] += 1
+			return [Instruction("mov", [register, Literal(str(variable.init))])]
+
+		result += self.reduce_strength(node, variable)
+
+		if trip_count is not None:
+			result += self.hoist_invariants(node, [node.condition, node.operation])
+
+		final = (variable.init + variable.step * trip_count) & WORD_MASK if trip_count is not None else None
+
+		if (self.unroll
+			and trip_count is not None
+			and trip_count <= UNROLL_LIMIT
+			and body_cost(node.body) * trip_count <= UNROLL_COST
+			and variable.register not in written_registers(node.body)
+		):
+			# Тело повторяется с нужным значением счётчика перед каждой итерацией
+			for value in variable.values():
+				if uses_counter:
+					result.append(Instruction("mov", [register, Literal(str(value))]))
+
+				result += copy.deepcopy(node.body)
+
+			result.append(Instruction("mov", [register, Literal(str(final))]))
+			self.stats["unrolled"] += 1
+			return result
+
+		# Между loop и dec cx / jne выбирает генератор по размеру кода тела
+		if "cx" in written_registers(node.body):
+			return result + [node]
+
+		if trip_count is not None and not uses_counter and (variable.register == "cx" or "cx" not in self.callee_registers[self.func.name]):
+			# Счётчик не используется в теле: считаем итерации в cx вниз до нуля
+			result.append(Instruction("mov", [Register("cx"), Literal(str(trip_count))]))
+			result.append(CountLoop(node.body, check_zero=False))
+
+			# После loop cx всегда равен нулю
+			if variable.register != "cx" or final != 0:
+				result.append(Instruction("mov", [register, Literal(str(final))]))
+			self.stats["loop"] += 1
+			return result
+
+		if variable.register == "cx" and variable.step == -1 and self.counts_to_zero(variable.operation, variable.limit):
+			# for (cx = n; cx > 0; cx--): тело видит те же значения cx, после цикла cx = 0
+			result.append(Instruction("mov", [register, node.counter.right]))
+			result.append(CountLoop(node.body, check_zero=variable.init is None or variable.init == 0))
+			self.stats["loop"] += 1
+			return result
+
+		return result + [node]
+
+	def optimize_while_do_loop(self, node: WhileDoLoop) -> List:
+		"""while (cx != 0) { ...; dec cx } -> loop"""
+		condition = node.condition
+
+		if not (isinstance(condition, BinaryOperation)
+			and isinstance(condition.left, Register)
+			and condition.left.name == "cx"
+			and self.counts_to_zero(condition.operation, literal(condition.right))
+			and node.body
+		):
+			return [node]
+
+		last = node.body[-1]
+
+		if not (isinstance(last, Instruction)
+			and last.opcode == "dec"
+			and len(last.operands) == 1
+			and isinstance(last.operands[0], Register)
+			and last.operands[0].name == "cx"
+		):
+			return [node]
+
+		body = node.body[:-1]
+
+		if "cx" in written_registers(body):
+			return [node]
+
+		self.stats["loop"] += 1
+		return [CountLoop(body, check_zero=True)]
+
+	@staticmethod
+	def counts_to_zero(operation: str, limit: Optional[int]) -> bool:
+		"""Условие cx > 0, cx != 0 или cx >= 1"""
+		return (operation in (">", "!=") and limit == 0) or (operation == ">=" and limit == 1)
@@ -0,0 +1,105 @@
+from typing import Iterator, List
+from ast import *
+
+def if_else_bodies(node: IfElseChain) -> List[List]:
+	bodies = [node.if_branch.body]
+	bodies += [branch.body for branch in node.elseif_branches or []]
+
+	if node.else_branch:
+		bodies.append(node.else_branch.body)
+
+	return bodies
+
+def for_expressions(node: ForLoop) -> List:
+	return [expr for expr in (node.counter, node.condition, node.operation) if expr is not None]
+
+# Таблицы по классу узла вместо цепочек isinstance: обход выполняется на каждом проходе
+CHILD_BODIES = {
+	IfElseChain: if_else_bodies,
+	WhileDoLoop: lambda node: [node.body],
+	DoWhileLoop: lambda node: [node.body],
+	ForLoop: lambda node: [node.body],
+	CountLoop: lambda node: [node.body],
+}
+
+STATEMENT_EXPRESSIONS = {
+	Instruction: lambda node: list(node.operands),
+	CallFunc: lambda node: [node],
+	IfElseChain: lambda node: [branch.condition for branch in [node.if_branch] + (node.elseif_branches or [])],
+	WhileDoLoop: lambda node: [node.condition],
+	DoWhileLoop: lambda node: [node.condition],
+	ForLoop: for_expressions,
+}
+
+# Подвыражения в обратном порядке: так их удобно класть в стек
+EXPRESSION_CHILDREN = {
+	BinaryOperation: lambda node: (node.right, node.left),
+	UnaryOperation: lambda node: (node.operand,),
+	CallFunc: lambda node: reversed(node.args),
+}
+
+def child_bodies(node: ASTNode) -> List[List]:
+	"""Вложенные блоки оператора"""
+	children = CHILD_BODIES.get(node.__class__)
+
+	return children(node) if children else []
+
+def statement_expressions(node: ASTNode) -> List:
+	"""Выражения, которые непосредственно содержит оператор"""
+	expressions = STATEMENT_EXPRESSIONS.get(node.__class__)
+
+	return expressions(node) if expressions else []
+
+def iter_statements(body: List) -> Iterator[ASTNode]:
+	"""Обход всех операторов блока, включая вложенные.
+	Явный стек вместо рекурсивных генераторов: иначе каждый оператор поднимается через все уровни вложенности"""
+	stack = [iter(body)]
+
+	while stack:
+		node = next(stack[-1], None)
+
+		if node is None:
+			stack.pop()
+			continue
+
+		yield node
+
+		for child in reversed(child_bodies(node)):
+			stack.append(iter(child))
+
+def iter_expression(expr) -> Iterator[ASTNode]:
+	"""Обход узла выражения и всех его подвыражений (в прямом порядке)"""
+	stack = [expr]
+
+	while stack:
+		node = stack.pop()
+
+		if node is None:
+			continue
+
+		yield node
+
+		children = EXPRESSION_CHILDREN.get(node.__class__)
+
+		if children:
+			stack.extend(children(node))
+
+def iter_calls(body: List) -> Iterator[CallFunc]:
+	"""Все вызовы функций в блоке, включая вызовы в операндах и аргументах"""
+	for statement in iter_statements(body):
+		for expr in statement_expressions(statement):
+			for node in iter_expression(expr):
+				if isinstance(node, CallFunc):
+					yield node
+
+def count_nodes(body: List) -> int:
+	"""Количество узлов AST в блоке: операторы и все узлы их выражений"""
+	total = 0
+
+	for statement in iter_statements(body):
+		total += 1
+
+		for expr in statement_expressions(statement):
+			total += sum(1 for _ in iter_expression(expr))
+
+	return total
@@ -1,22 +1,58 @@
 import re
+from array import array
+from typing import Iterator
+
+CHUNK_LINES = 512 # Количество строк в одном блоке потокового вывода
+
+def iter_lines(code) -> Iterator[str]:
+	"""Построчное чтение исходного кода из строки или буфера (bytes, mmap)"""
+	if isinstance(code, str):
+		separator = "\n"
+		decode = str
+	else:
+		separator = b"\n"
+		decode = lambda line: line.decode("utf-8")
+
+	start = 0
+
+	while (end := code.find(separator, start)) != -1:
+		yield decode(code[start:end])
+		start = end + 1
+
+	yield decode(code[start:])
 
 class Preprocessor:
 	def __init__(self, code):
 		self.code = code
+		# source_map[i] - номер исходной строки для строки i + 1 после препроцессинга
+		self.source_map = array("I")
 
-	def preprocess(self) -> str:
-		"""Препроцессинг"""
-		processed_code = ""
-		lines = self.code.split("\n")
+	def stream(self, chunk_lines: int = CHUNK_LINES) -> Iterator[str]:
+		"""Потоковый препроцессинг. Выдаёт блоки по chunk_lines строк"""
+		source_map = self.source_map
+		del source_map[:]
+		chunk = []
 
 		# Удаляем все комментарии и удалеяем лишние пробелы
-		for line in lines:
+		for number, line in enumerate(iter_lines(self.code), 1):
 			comment_index = line.find("//")
 
 			if comment_index != -1:
 				line = line[:comment_index].rstrip()
 
 			if line.strip():
-				processed_code += line + "\n"
+				chunk.append(line)
+				source_map.append(number)
+
+				if len(chunk) >= chunk_lines:
+					chunk.append("")
+					yield "\n".join(chunk)
+					chunk = []
+
+		if chunk:
+			chunk.append("")
+			yield "\n".join(chunk)
 
-		return processed_code
\ No newline at end of file
+	def preprocess(self) -> str:
+		"""Препроцессинг"""
+		return "".join(self.stream())
@@ -0,0 +1,134 @@
+"""Сервер компиляции: flatty.py serve [--socket PATH] [--stop].
+
+Модули компилятора импортируются один раз, скомпилированные регулярные выражения лексера
+и кэш сгенерированного кода функций живут в памяти между запросами. Запросы принимаются
+через Unix сокет по протоколу из client.py и выполняются по одному"""
+import io
+import os
+import sys
+import json
+import signal
+import argparse
+import contextlib
+import socketserver
+import flatty
+from batch import warm_up
+from cache import MemoryCache
+from client import default_socket, request
+
+class CompileHandler(socketserver.StreamRequestHandler):
+	"""Один запрос: строка JSON с аргументами, ответ - строка JSON с выводом и кодом возврата"""
+	def handle(self):
+		try:
+			message = json.loads(self.rfile.readline())
+			response = self.server.execute(message)
+		except (ValueError, KeyError, TypeError) as error:
+			response = {"status": 2, "stdout": "", "stderr": f"error: malformed request: {error}\n"}
+
+		self.wfile.write(json.dumps(response).encode() + b"\n")
+
+class CompileServer(socketserver.UnixStreamServer):
+	def __init__(self, path: str):
+		self.path = path
+		self.cache = MemoryCache() # Код функций между запросами
+		self.running = True
+		self.requests = 0
+
+		# Через сокет можно писать файлы от имени владельца сервера: сокет создается
+		# сразу с правами 0o600, чтобы к нему нельзя было подключиться до chmod
+		umask = os.umask(0o077)
+
+		try:
+			super().__init__(path, CompileHandler)
+		finally:
+			os.umask(umask)
+
+		os.chmod(path, 0o600)
+
+	def execute(self, message: dict) -> dict:
+		"""Выполнить запрос в рабочем каталоге клиента, перехватив вывод"""
+		if message.get("command") == "stop":
+			self.running = False
+			return {"status": 0, "stdout": "", "stderr": ""}
+		elif message.get("command") == "ping":
+			return {"status": 0, "stdout": "", "stderr": ""}
+
+		argv = [str(argument) for argument in message["argv"]]
+
+		if argv[:1] == ["serve"]:
+			return {"status": 2, "stdout": "", "stderr": "error: server is already running\n"}
+
+		stdout = io.StringIO()
+		stderr = io.StringIO()
+		directory = os.getcwd()
+		status = 0
+
+		try:
+			os.chdir(message.get("cwd") or directory)
+
+			with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+				status = flatty.main(argv, self.cache)
+		except SystemExit as exit:
+			# argparse и генератор завершают работу через sys.exit
+			status = exit.code if isinstance(exit.code, int) else int(exit.code is not None)
+		except Exception as error:
+			stderr.write(f"error: {type(error).__name__}: {error}\n")
+			status = 1
+		finally:
+			os.chdir(directory)
+
+		self.requests += 1
+
+		return {"status": status, "stdout": stdout.getvalue(), "stderr": stderr.getvalue()}
+
+	def serve(self):
+		while self.running:
+			self.handle_request()
+
+def main(argv=None) -> int:
+	argument_parser = argparse.ArgumentParser(prog="flatty.py serve")
+	argument_parser.add_argument("--socket", type=str, default=default_socket(), help="Unix socket path")
+	argument_parser.add_argument("--stop", action="store_true", help="Stop the running server")
+	args = argument_parser.parse_args(argv)
+
+	# Чужой файл на месте сокета (например, в /tmp) нельзя ни удалять, ни использовать
+	if os.path.lexists(args.socket) and os.lstat(args.socket).st_uid != os.getuid():
+		print(f"error: {args.socket} belongs to another user")
+		return 1
+
+	if os.path.exists(args.socket):
+		try:
+			if args.stop:
+				request(args.socket, {"command": "stop"})
+				return 0
+
+			request(args.socket, {"command": "ping"})
+			print(f"error: server is already running on {args.socket}")
+			return 1
+		except (OSError, ValueError):
+			# Сокет остался от завершившегося сервера
+			os.remove(args.socket)
+
+	if args.stop:
+		print(f"error: no server on {args.socket}")
+		return 1
+
+	warm_up()
+	server = CompileServer(args.socket)
+	signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+	print(f"flatty server listening on {args.socket}")
+	sys.stdout.flush()
+
+	try:
+		server.serve()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+
+		if os.path.exists(args.socket):
+			os.remove(args.socket)
+
+	print(f"flatty server stopped after {server.requests} requests, {server.cache}")
+
+	return 0
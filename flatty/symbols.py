@@ -0,0 +1,87 @@
+from typing import Dict, List, Optional
+from ast import *
+from passes.walk import iter_calls
+
+class FunctionSymbol:
+	"""Сигнатура функции: имя и параметры с заранее вычисленными индексами, объявленные локальные переменные"""
+	__slots__ = ("name", "params", "indexes", "variables")
+
+	def __init__(self, name: str, params: List[str]):
+		self.name = name
+		self.params = tuple(params)
+		self.indexes = {} # Имя параметра -> индекс (первое вхождение)
+		self.variables = [] # Локальные переменные в порядке объявления
+
+		for index, param in enumerate(params):
+			self.indexes.setdefault(param, index)
+
+	@property
+	def arity(self) -> int:
+		return len(self.params)
+
+	def is_parameter(self, name: str) -> bool:
+		return name in self.indexes
+
+	def is_variable(self, name: str) -> bool:
+		return name in self.variables
+
+	def __repr__(self):
+		return f"{self.name}({", ".join(self.params)})"
+
+class SymbolTable:
+	"""Таблица функций программы: имя -> сигнатура"""
+	def __init__(self, program: Program = None):
+		self.functions = {} # Имя функции -> FunctionSymbol
+		self.errors = [] # Ошибки объявлений: повторные функции и параметры
+
+		if program is not None:
+			for func in program.functions:
+				self.define(func.name, func.params)
+
+	def define(self, name: str, params: List[str]) -> FunctionSymbol:
+		"""Объявить функцию"""
+		symbol = FunctionSymbol(name, params)
+
+		if name in self.functions:
+			self.errors.append(f"function {name} is defined more than once")
+
+		if len(symbol.indexes) != len(symbol.params):
+			self.errors.append(f"function {name} has duplicate parameter names")
+
+		self.functions[name] = symbol
+
+		return symbol
+
+	def declare(self, symbol: FunctionSymbol, name: str):
+		"""Объявить локальную переменную функции. Переменная видна до конца функции"""
+		if symbol.is_parameter(name):
+			self.errors.append(f"in function {symbol.name}: variable {name} shadows a parameter")
+		elif symbol.is_variable(name):
+			self.errors.append(f"in function {symbol.name}: variable {name} is declared more than once")
+		else:
+			symbol.variables.append(name)
+
+	def lookup(self, name: str) -> Optional[FunctionSymbol]:
+		return self.functions.get(name)
+
+	def locations(self, name: str, layout) -> Dict[str, str]:
+		"""Операнды параметров функции при заданном размещении: регистр или [bp + N]"""
+		return {param: layout.location(index) for param, index in self.functions[name].indexes.items()}
+
+	def check(self, program: Program) -> List[str]:
+		"""Все вызовы несуществующих функций и вызовы с неверным количеством аргументов за один проход"""
+		errors = list(self.errors)
+
+		for func in program.functions:
+			for call in iter_calls(func.body):
+				symbol = self.functions.get(call.func_name)
+
+				if symbol is None:
+					errors.append(f"in function {func.name}: call to undefined function {call.func_name}")
+				elif len(call.args) != symbol.arity:
+					errors.append(
+						f"in function {func.name}: {call.func_name} expects {symbol.arity} arguments, "
+						f"got {len(call.args)}"
+					)
+
+		return errors